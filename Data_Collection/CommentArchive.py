@@ -0,0 +1,393 @@
+# CommentArchive.py
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Dict, Generator, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from Data_Collection.SmartBiliCrawler import DB_FILE, CommentDatabase, filter_existing_keys, get_raw_connection
+
+# 冷数据目录，与原始评论数据库放在一起
+ARCHIVE_DIR = os.path.join(os.path.dirname(DB_FILE), "archive")
+
+
+def month_range(key: str) -> Tuple[int, int]:
+    """月份分区对应的 [开始, 结束) Unix时间戳"""
+    start = datetime.strptime(key, "%Y-%m").replace(tzinfo=timezone.utc)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+class MonthPartition:
+    """
+    单个月份的列式压缩文件 (npz)
+    列: rpid, aid, ctime, category, is_hot, parent, seq, text_offsets, text_blob
+    seq 为评论在热数据库中的写入序号（raw_comments_ingest），早期分区没有该列，视为0
+    第i条评论的文本为 text_blob[text_offsets[i]:text_offsets[i+1]] 的UTF-8解码
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        # 归档时合并后的新文件先写到这里，热数据删除提交后才替换正式文件
+        self.staged_path = file_path[:-len(".npz")] + ".staged"
+
+    @staticmethod
+    def _to_columns(rows: List[Tuple]) -> Dict[str, np.ndarray]:
+        """[(rpid, aid, comment, ctime, category, is_hot, parent, seq), ...] 转为列"""
+        encoded = [row[2].encode("utf-8") for row in rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded], dtype=np.int64)
+        return {
+            "rpid": np.array([row[0] for row in rows], dtype=np.int64),
+            "aid": np.array([row[1] for row in rows], dtype=np.int64),
+            "ctime": np.array([row[3] for row in rows], dtype=np.int64),
+            "category": np.array([row[4] or "Other" for row in rows], dtype=str),
+            "is_hot": np.array([bool(row[5]) for row in rows], dtype=bool),
+            "parent": np.array([row[6] or 0 for row in rows], dtype=np.int64),
+            "seq": np.array([row[7] or 0 for row in rows], dtype=np.int64),
+            "text_offsets": offsets,
+            "text_blob": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        }
+
+    def read_columns(self) -> Optional[Dict[str, np.ndarray]]:
+        """读取全部列，文件不存在返回None"""
+        if not os.path.exists(self.file_path):
+            return None
+        with np.load(self.file_path) as data:
+            columns = {name: data[name] for name in data.files}
+        # 早期分区没有 parent 列，均为顶层评论
+        if "parent" not in columns:
+            columns["parent"] = np.zeros(len(columns["rpid"]), dtype=np.int64)
+        # 早期分区没有 seq 列，其中的评论在归档前已按旧的rpid水位线处理过
+        if "seq" not in columns:
+            columns["seq"] = np.zeros(len(columns["rpid"]), dtype=np.int64)
+        return columns
+
+    def read_rows(self) -> List[Tuple]:
+        """读取为 [(rpid, aid, comment, ctime, category, is_hot, parent, seq), ...]"""
+        columns = self.read_columns()
+        if columns is None:
+            return []
+        return [
+            (int(rpid), int(aid), self.text_at(columns, i), int(ctime), str(category), bool(is_hot),
+             int(parent), int(seq))
+            for i, (rpid, aid, ctime, category, is_hot, parent, seq) in enumerate(zip(
+                columns["rpid"], columns["aid"], columns["ctime"],
+                columns["category"], columns["is_hot"], columns["parent"], columns["seq"]
+            ))
+        ]
+
+    def max_seq(self) -> int:
+        """分区中最大的写入序号，只读取seq列；文件不存在或早期分区没有seq列时返回0"""
+        if not os.path.exists(self.file_path):
+            return 0
+        with np.load(self.file_path) as data:
+            if "seq" not in data.files:
+                return 0
+            seq = data["seq"]
+            return int(seq.max()) if len(seq) else 0
+
+    @staticmethod
+    def text_at(columns: Dict[str, np.ndarray], i: int) -> str:
+        offsets = columns["text_offsets"]
+        return columns["text_blob"][offsets[i]:offsets[i + 1]].tobytes().decode("utf-8")
+
+    def stage(self, rows: List[Tuple]) -> int:
+        """合并新行（按rpid去重、排序）写入暂存文件，不影响正式文件；返回合并后的总行数"""
+        merged = {row[0]: row for row in self.read_rows()}
+        merged.update({row[0]: row for row in rows})
+        ordered = [merged[rpid] for rpid in sorted(merged)]
+
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        tmp_path = self.staged_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **self._to_columns(ordered))
+        os.replace(tmp_path, self.staged_path)
+        return len(ordered)
+
+    def publish(self):
+        """用暂存文件原子地替换正式文件"""
+        os.replace(self.staged_path, self.file_path)
+
+    def discard(self):
+        if os.path.exists(self.staged_path):
+            os.remove(self.staged_path)
+
+    def staged_rpids(self) -> List[int]:
+        with np.load(self.staged_path) as data:
+            return data["rpid"].tolist()
+
+
+class CommentArchive:
+    """
+    原始评论的按月冷存储
+    archive_older_than 把超过N天的评论从 raw_comments 移到按月分区的列式文件中，
+    stream_comment_rows 以同一接口先读冷数据再读热数据，get_word_usage_stats 的统计同样包括冷数据
+    """
+
+    def __init__(self, db: Optional[CommentDatabase] = None, archive_dir: str = ARCHIVE_DIR):
+        self.db = db or CommentDatabase()
+        self.archive_dir = archive_dir
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self._backfill_archived_rpids()
+        self._recover_staged()
+
+    def _backfill_archived_rpids(self):
+        """archived_rpids 表出现之前归档的分区：表为空而已有分区时，把分区中的rpid补写进去"""
+        conn = get_raw_connection(self.db.db_file)
+        if not self.list_months() or conn.execute("SELECT 1 FROM archived_rpids LIMIT 1").fetchone():
+            return
+        rpids = self.archived_rpids()
+        conn.executemany("INSERT OR IGNORE INTO archived_rpids (rpid) VALUES (?)", ((rpid,) for rpid in rpids))
+        conn.commit()
+        print(f"Recorded {len(rpids)} previously archived rpids")
+
+    def _recover_staged(self):
+        """
+        上次归档在删除热数据与替换分区文件之间中断时留下的暂存文件：
+        其中的rpid都已记入 archived_rpids 说明删除已提交，替换正式文件；否则热数据仍在，丢弃
+        """
+        for name in os.listdir(self.archive_dir):
+            if not (name.startswith("raw_comments_") and name.endswith(".staged")):
+                continue
+            partition = self.partition(name[len("raw_comments_"):-len(".staged")])
+            rpids = partition.staged_rpids()
+            if len(filter_existing_keys(self.db.db_file, "archived_rpids", "rpid", rpids)) == len(rpids):
+                partition.publish()
+                print(f"Recovered archive partition {partition.file_path}")
+            else:
+                partition.discard()
+
+    def partition(self, key: str) -> MonthPartition:
+        return MonthPartition(os.path.join(self.archive_dir, f"raw_comments_{key}.npz"))
+
+    def list_months(self) -> List[str]:
+        """已归档的月份，按时间排序"""
+        months = []
+        for name in os.listdir(self.archive_dir):
+            if name.startswith("raw_comments_") and name.endswith(".npz"):
+                months.append(name[len("raw_comments_"):-len(".npz")])
+        return sorted(months)
+
+    def filter_archived_rpids(self, rpids: Iterable[int]) -> set:
+        """返回 rpids 中已移入冷存储的部分（查 archived_rpids 表，不读取分区文件）"""
+        return filter_existing_keys(self.db.db_file, "archived_rpids", "rpid", rpids)
+
+    def archived_rpids(self) -> set:
+        """冷存储中全部评论的rpid（每个分区只读取rpid列）"""
+        rpids = set()
+        for key in self.list_months():
+            with np.load(self.partition(key).file_path) as data:
+                rpids.update(data["rpid"].tolist())
+        return rpids
+
+    def archive_older_than(self, days: int, vacuum: bool = False) -> int:
+        """
+        把评论时间早于N天前的评论移入冷存储，返回移动的评论数
+
+        合并后的分区先写入暂存文件，热数据删除提交后才替换正式文件，冷热数据中不会同时出现同一条评论；
+        删除失败时丢弃暂存文件，在两步之间中断时由下次打开归档时恢复
+        只删除已写入分区文件的rpid：读取之后其他进程新写入的同月评论留在热数据中，下次再归档
+        删除的rpid在同一事务中记入 archived_rpids，爬虫据此不再把它们当作新评论
+        :param vacuum: 移动后是否VACUUM以缩小数据库文件
+        """
+        cutoff = int(time.time()) - days * 86400
+        conn = get_raw_connection(self.db.db_file)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT DISTINCT strftime('%Y-%m', ctime, 'unixepoch')
+            FROM raw_comments
+            WHERE ctime < ?
+        ''', (cutoff,))
+        months = sorted(row[0] for row in cursor.fetchall() if row[0])
+
+        moved = 0
+        for key in months:
+            start, end = month_range(key)
+            end = min(end, cutoff)
+            cursor.execute('''
+                SELECT r.rpid, r.aid, r.comment, r.ctime, r.category, r.is_hot, r.parent, i.seq
+                FROM raw_comments r
+                LEFT JOIN raw_comments_ingest i ON i.rpid = r.rpid
+                WHERE r.ctime >= ? AND r.ctime < ?
+            ''', (start, end))
+            rows = cursor.fetchall()
+            if not rows:
+                continue
+
+            partition = self.partition(key)
+            total = partition.stage(rows)
+            try:
+                rpids = [(row[0],) for row in rows]
+                cursor.executemany("INSERT OR IGNORE INTO archived_rpids (rpid) VALUES (?)", rpids)
+                cursor.executemany("DELETE FROM raw_comments WHERE rpid = ?", rpids)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"数据库操作错误: {e}")
+                conn.rollback()
+                partition.discard()
+                continue
+            partition.publish()
+            moved += len(rows)
+            print(f"Archived {len(rows)} comments of {key} ({total} in partition)")
+
+        if vacuum and moved:
+            conn.execute("VACUUM")
+        return moved
+
+    def _stream_cold_rows(
+        self,
+        batch_size: int,
+        category: Optional[str],
+        is_hot: Optional[bool],
+        start_ctime: Optional[int],
+        end_ctime: Optional[int],
+        after_rpid: int,
+    ) -> Generator[List[Tuple], None, None]:
+        for key in self.list_months():
+            month_start, month_end = month_range(key)
+            if start_ctime is not None and month_end <= start_ctime:
+                continue
+            if end_ctime is not None and month_start >= end_ctime:
+                continue
+
+            partition = self.partition(key)
+            columns = partition.read_columns()
+            if columns is None:
+                continue
+
+            mask = columns["rpid"] > after_rpid
+            if category is not None:
+                mask &= columns["category"] == category
+            if is_hot is not None:
+                mask &= columns["is_hot"] == bool(is_hot)
+            if start_ctime is not None:
+                mask &= columns["ctime"] >= start_ctime
+            if end_ctime is not None:
+                mask &= columns["ctime"] < end_ctime
+
+            indices = np.flatnonzero(mask)
+            for begin in range(0, len(indices), batch_size):
+                yield [
+                    (
+                        int(columns["rpid"][i]),
+                        int(columns["aid"][i]),
+                        partition.text_at(columns, i),
+                        int(columns["ctime"][i]),
+                    )
+                    for i in indices[begin:begin + batch_size]
+                ]
+
+    def stream_comment_rows(
+        self,
+        batch_size: int = 5000,
+        category: Optional[str] = None,
+        is_hot: Optional[bool] = None,
+        start_ctime: Optional[int] = None,
+        end_ctime: Optional[int] = None,
+        after_rpid: int = 0,
+        include_cold: bool = True,
+    ) -> Generator[List[Tuple], None, None]:
+        """
+        与 CommentDatabase.stream_comment_rows 相同的接口，先按月读冷数据，再读热数据
+        每批返回 [(rpid, aid, comment, ctime), ...]；批内按rpid有序，批之间不保证
+        """
+        if include_cold:
+            yield from self._stream_cold_rows(
+                batch_size, category, is_hot, start_ctime, end_ctime, after_rpid
+            )
+        yield from self.db.stream_comment_rows(
+            batch_size=batch_size,
+            category=category,
+            is_hot=is_hot,
+            start_ctime=start_ctime,
+            end_ctime=end_ctime,
+            after_rpid=after_rpid,
+        )
+
+    def stream_new_comment_rows(self, batch_size: int = 5000, after_seq: int = 0) -> Generator[List[Tuple], None, None]:
+        """
+        与 CommentDatabase.stream_new_comment_rows 相同，按写入序号读取 after_seq 之后入库的冷热评论
+        每批返回 [(seq, rpid, aid, comment, ctime), ...]；冷数据批内按rpid有序，调用方应取批内最大seq
+        归档在处理之后进行，冷分区通常全部在水位线之下：先只读seq列判断，不解压文本
+        """
+        for key in self.list_months():
+            partition = self.partition(key)
+            if partition.max_seq() <= after_seq:
+                continue
+            columns = partition.read_columns()
+            if columns is None:
+                continue
+            indices = np.flatnonzero(columns["seq"] > after_seq)
+            for begin in range(0, len(indices), batch_size):
+                yield [
+                    (
+                        int(columns["seq"][i]),
+                        int(columns["rpid"][i]),
+                        int(columns["aid"][i]),
+                        partition.text_at(columns, i),
+                        int(columns["ctime"][i]),
+                    )
+                    for i in indices[begin:begin + batch_size]
+                ]
+        yield from self.db.stream_new_comment_rows(batch_size=batch_size, after_seq=after_seq)
+
+    @staticmethod
+    def _rows_containing(columns: Dict[str, np.ndarray], word: str) -> np.ndarray:
+        """分区中文本包含该词的行号：在拼接的UTF-8文本中查找子串，再按偏移量定位到行（不逐行解码）"""
+        needle = word.encode("utf-8")
+        blob = columns["text_blob"].tobytes()
+        offsets = columns["text_offsets"]
+        positions = []
+        pos = blob.find(needle)
+        while pos != -1:
+            positions.append(pos)
+            pos = blob.find(needle, pos + 1)
+        if not positions:
+            return np.zeros(0, dtype=np.int64)
+        starts = np.array(positions, dtype=np.int64)
+        rows = np.searchsorted(offsets, starts, side="right") - 1
+        # 跨越两条评论边界的匹配不算
+        rows = rows[starts + len(needle) <= offsets[rows + 1]]
+        return np.unique(rows)
+
+    def get_word_usage_stats(self, word: str) -> Dict:
+        """
+        与 CommentDatabase.get_word_usage_stats 相同，统计冷热数据中包含该词的评论总数、各分区数量和最早出现时间；
+        另返回 hot_total：热数据中的条数，即 search_word_contexts 能分页取到的范围
+        冷数据逐月解压后按子串查找，没有索引
+        """
+        hot = self.db.get_word_usage_stats(word)
+        total = hot["total"]
+        by_category = dict(hot["by_category"])
+        first_seen = hot["first_seen"]
+        if word:
+            for key in self.list_months():
+                columns = self.partition(key).read_columns()
+                if columns is None:
+                    continue
+                rows = self._rows_containing(columns, word)
+                if not len(rows):
+                    continue
+                total += len(rows)
+                categories, counts = np.unique(columns["category"][rows], return_counts=True)
+                for category, count in zip(categories.tolist(), counts.tolist()):
+                    by_category[category] = by_category.get(category, 0) + count
+                month_first = int(columns["ctime"][rows].min())
+                first_seen = month_first if first_seen is None else min(first_seen, month_first)
+        return {
+            "total": total,
+            "hot_total": hot["total"],
+            "by_category": by_category,
+            "first_seen": first_seen,
+        }
+
+    def stream_comments(self, batch_size: int = 5000, **filters) -> Generator[List[Tuple], None, None]:
+        """流式读取冷热评论，每批返回 [(comment, aid), ...]"""
+        for rows in self.stream_comment_rows(batch_size=batch_size, **filters):
+            yield [(comment, aid) for _, aid, comment, _ in rows]
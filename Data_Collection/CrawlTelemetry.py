@@ -0,0 +1,215 @@
+# CrawlTelemetry.py
+"""
+爬虫运行指标：按接口统计请求延迟分布、HTTP状态码和API错误码，
+按阶段累计耗时（等待令牌、主动等待、签名、数据库写入、浏览器重启），
+以及保存的评论数和重复rpid比例（爬取时跳过的已有rpid和写入时忽略的重复行）
+
+阶段耗时是各并发任务耗时之和，可能超过实际运行时间。
+snapshot() 返回可直接写成JSON的字典，summary() 返回可打印的汇总
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator
+from urllib.parse import urlsplit
+
+import httpx
+
+# 延迟直方图的桶上界（秒），最后一个桶收集超过 10 秒的请求
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 阶段名称
+PHASE_RATE_LIMIT = "rate_limit_wait"
+PHASE_SLEEP = "sleep"
+PHASE_SIGN = "sign"
+PHASE_DB_WRITE = "db_write"
+PHASE_BROWSER_RESTART = "browser_restart"
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """按桶估计分位数，返回所在桶的上界（最后一个桶返回最大值）"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return self.max
+
+    def to_dict(self) -> Dict:
+        labels = [f"<={bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.max,
+            "buckets": dict(zip(labels, self.buckets)),
+        }
+
+
+class CrawlTelemetry:
+    def __init__(self):
+        self.started_at = time.time()
+        # 数据库写入在写入线程中记录
+        self._lock = threading.Lock()
+        self.latency: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.error_codes: Dict[str, Counter] = defaultdict(Counter)
+        self.transport_errors: Dict[str, Counter] = defaultdict(Counter)
+        self.phase_seconds: Counter = Counter()
+        self.phase_counts: Counter = Counter()
+        self.comments_saved = 0
+        self.comments_duplicate = 0
+
+    @staticmethod
+    def endpoint(url) -> str:
+        return urlsplit(str(url)).path
+
+    def observe_request(self, endpoint: str, seconds: float, status: int):
+        with self._lock:
+            self.latency[endpoint].observe(seconds)
+            self.statuses[endpoint][status] += 1
+
+    def observe_error_code(self, endpoint: str, code):
+        with self._lock:
+            self.error_codes[endpoint][code] += 1
+
+    def observe_transport_error(self, endpoint: str, error: Exception):
+        with self._lock:
+            self.transport_errors[endpoint][type(error).__name__] += 1
+
+    def add_time(self, phase: str, seconds: float):
+        with self._lock:
+            self.phase_seconds[phase] += seconds
+            self.phase_counts[phase] += 1
+
+    @contextmanager
+    def timed(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    async def sleep(self, seconds: float):
+        """asyncio.sleep 并计入主动等待时间"""
+        self.add_time(PHASE_SLEEP, seconds)
+        await asyncio.sleep(seconds)
+
+    def observe_comments(self, saved: int, duplicate: int):
+        """
+        :param saved: 实际插入的评论数
+        :param duplicate: 重复的评论数，包括爬取时按已有rpid跳过的和写入时被 INSERT OR IGNORE 忽略的
+        """
+        with self._lock:
+            self.comments_saved += saved
+            self.comments_duplicate += duplicate
+
+    def install(self, client: httpx.AsyncClient):
+        """在httpx客户端上安装事件钩子，记录每个请求的令牌等待、延迟、状态码和API错误码"""
+        if self._on_response in client.event_hooks["response"]:
+            return
+        # 排在限速器钩子之前和之后，两者之差即等待令牌的时间
+        client.event_hooks["request"].insert(0, self._on_request_queued)
+        client.event_hooks["request"].append(self._on_request_sent)
+        client.event_hooks["response"].append(self._on_response)
+
+    async def _on_request_queued(self, request: httpx.Request):
+        request.extensions["telemetry_queued"] = time.perf_counter()
+
+    async def _on_request_sent(self, request: httpx.Request):
+        now = time.perf_counter()
+        request.extensions["telemetry_sent"] = now
+        queued = request.extensions.get("telemetry_queued")
+        if queued is not None:
+            self.add_time(PHASE_RATE_LIMIT, now - queued)
+
+    async def _on_response(self, response: httpx.Response):
+        request = response.request
+        endpoint = self.endpoint(request.url)
+        sent = request.extensions.get("telemetry_sent")
+        if sent is not None:
+            self.observe_request(endpoint, time.perf_counter() - sent, response.status_code)
+        if response.status_code == 200 and "json" in response.headers.get("content-type", ""):
+            await response.aread()
+            try:
+                code = response.json().get("code")
+            except ValueError:
+                code = "invalid_json"
+            if code not in (0, None):
+                self.observe_error_code(endpoint, code)
+
+    def snapshot(self) -> Dict:
+        """当前指标的JSON友好字典"""
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            seen = self.comments_saved + self.comments_duplicate
+            # 只有传输错误、从未收到响应的接口也要列出
+            endpoints = set(self.latency) | set(self.statuses) | set(self.error_codes) | set(self.transport_errors)
+            return {
+                "started_at": self.started_at,
+                "elapsed": elapsed,
+                "endpoints": {
+                    endpoint: {
+                        "latency": self.latency.get(endpoint, LatencyHistogram()).to_dict(),
+                        "statuses": {str(k): v for k, v in self.statuses.get(endpoint, {}).items()},
+                        "error_codes": {str(k): v for k, v in self.error_codes.get(endpoint, {}).items()},
+                        "transport_errors": dict(self.transport_errors.get(endpoint, {})),
+                    }
+                    for endpoint in sorted(endpoints)
+                },
+                "phases": {
+                    phase: {"seconds": seconds, "count": self.phase_counts[phase]}
+                    for phase, seconds in self.phase_seconds.items()
+                },
+                "comments": {
+                    "saved": self.comments_saved,
+                    "duplicate": self.comments_duplicate,
+                    "per_second": self.comments_saved / elapsed if elapsed > 0 else 0.0,
+                    "duplicate_rate": self.comments_duplicate / seen if seen else 0.0,
+                },
+            }
+
+    def save(self, path: str):
+        """把快照写入JSON文件"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        lines = [f"Crawl telemetry ({snapshot['elapsed']:.1f}s):"]
+        for endpoint, stats in sorted(snapshot["endpoints"].items(), key=lambda item: -item[1]["latency"]["count"]):
+            latency = stats["latency"]
+            errors = sum(stats["error_codes"].values()) + sum(stats["transport_errors"].values())
+            non_200 = sum(v for k, v in stats["statuses"].items() if k != "200")
+            lines.append(
+                f"  {endpoint:<40} {latency['count']:>6} req  mean {latency['mean'] * 1000:7.1f} ms  "
+                f"p95 <= {latency['p95'] * 1000:7.1f} ms  non-200 {non_200}  api errors {errors}"
+                + (f"  codes {stats['error_codes']}" if stats["error_codes"] else "")
+            )
+        for phase, stats in sorted(snapshot["phases"].items()):
+            lines.append(f"  {phase:<18} {stats['seconds']:9.2f} s over {stats['count']} calls")
+        comments = snapshot["comments"]
+        lines.append(
+            f"  comments saved {comments['saved']} ({comments['per_second']:.1f}/s), "
+            f"duplicate rpids {comments['duplicate']} ({comments['duplicate_rate']:.1%})"
+        )
+        return "\n".join(lines)
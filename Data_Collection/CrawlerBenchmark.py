@@ -0,0 +1,117 @@
+# CrawlerBenchmark.py
+"""
+爬虫吞吐量基准：在本地模拟服务器上运行 MultiCategoryHotCrawler，
+报告 videos/min、comments/sec 和数据库写入延迟
+
+用法:
+    python -m Data_Collection.CrawlerBenchmark --videos 100 --concurrency 4 --latency 0.05
+    python -m Data_Collection.CrawlerBenchmark --record /tmp/responses   # 保存本次响应
+    python -m Data_Collection.CrawlerBenchmark --replay /tmp/responses   # 用存档的响应复现
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Dict, List
+
+from Data_Collection.FakeBiliServer import FakeBiliServer
+from Data_Collection.ResponseArchive import ResponseArchive
+from Data_Collection.SmartBiliCrawler import CommentDatabase, MultiCategoryHotCrawler, close_raw_connections
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def count_rows(db_file: str) -> Dict[str, int]:
+    conn = sqlite3.connect(db_file)
+    try:
+        return {
+            "videos": conn.execute("SELECT COUNT(*) FROM video_info").fetchone()[0],
+            "comments": conn.execute("SELECT COUNT(*) FROM raw_comments").fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+async def run_crawl(args, api_host: str, work_dir: str) -> Dict:
+    db = CommentDatabase(os.path.join(work_dir, "raw_bilibili_comments.db"))
+    # 模拟服务器总是报告已登录，写一个cookies文件让爬虫走纯HTTP模式
+    with open(os.path.join(work_dir, "bilibili_cookies.json"), "w") as f:
+        json.dump([{"name": "SESSDATA", "value": "benchmark"}], f)
+
+    crawler = MultiCategoryHotCrawler(
+        db,
+        max_comments_per_video=args.max_comments,
+        max_concurrent_videos=args.concurrency,
+        requests_per_second=args.rps,
+        api_host=api_host,
+        data_dir=work_dir,
+        sub_reply_threshold=args.sub_reply_threshold,
+        response_archive=ResponseArchive(args.record) if args.record else None,
+    )
+    start = time.perf_counter()
+    await crawler.crawl_strategically(total_videos=args.videos)
+    elapsed = time.perf_counter() - start
+
+    counts = count_rows(db.db_file)
+    latencies = crawler.writer.write_latencies if crawler.writer else []
+    return {
+        "elapsed": elapsed,
+        "videos": counts["videos"],
+        "comments": counts["comments"],
+        "write_latencies": latencies,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本地模拟服务器上测量爬虫吞吐量")
+    parser.add_argument("--videos", type=int, default=50, help="采集的视频数")
+    parser.add_argument("--max-comments", type=int, default=50, help="每个视频最多爬取的评论数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时爬取的视频数")
+    parser.add_argument("--rps", type=float, default=1000.0,
+                        help="爬虫的全局每秒请求数上限（设置后不再随机等待）")
+    parser.add_argument("--sub-reply-threshold", type=int, default=None,
+                        help="回复数达到该值的评论抓取楼中楼回复（默认不抓取）")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟服务器基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02, help="模拟服务器额外随机延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务器返回HTTP 500的概率")
+    parser.add_argument("--max-rps", type=float, default=None, help="模拟服务器限流阈值")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record", default=None, help="把爬虫收到的响应存入该目录")
+    parser.add_argument("--replay", default=None, help="模拟服务器回放该目录中存档的响应")
+    args = parser.parse_args()
+
+    server = FakeBiliServer(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        max_rps=args.max_rps, seed=args.seed,
+        replay=ResponseArchive(args.replay) if args.replay else None,
+    )
+    with server, tempfile.TemporaryDirectory() as work_dir:
+        try:
+            result = asyncio.run(run_crawl(args, server.url, work_dir))
+        finally:
+            close_raw_connections()
+        stats = dict(server.state.stats)
+
+    elapsed = result["elapsed"]
+    latencies = result["write_latencies"]
+    print("\n===== Crawler benchmark =====")
+    print(f"Elapsed:        {elapsed:.2f} s")
+    print(f"Videos:         {result['videos']}  ({result['videos'] / elapsed * 60:.1f} videos/min)")
+    print(f"Comments:       {result['comments']}  ({result['comments'] / elapsed:.1f} comments/sec)")
+    print(f"DB writes:      {len(latencies)} transactions, "
+          f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms, "
+          f"max {max(latencies, default=0.0) * 1000:.1f} ms")
+    print(f"Server:         {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# DanmakuCollector.py
+"""
+弹幕批量采集：为 video_info 中已有的视频按6分钟分段下载弹幕，写入 raw_danmaku 表
+
+一个分段请求可返回上千条弹幕，而评论接口每次只有20条。
+raw_danmaku 与 raw_comments 有相同的 (aid, comment, ctime, category, is_hot) 列，
+可用 CommentDatabase.stream_danmaku_rows 读取后交给 FindWords4XG，
+增量处理用 stream_new_danmaku_rows 按写入序号读取新入库的弹幕
+"""
+import asyncio
+import math
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from Data_Collection.SmartBiliCrawler import (
+    API_HOST,
+    CommentDatabase,
+    DataFetchError,
+    TokenBucketLimiter,
+    create_http_client,
+    get_user_agent,
+)
+
+# 每个弹幕分段覆盖的视频时长（秒）
+SEGMENT_SECONDS = 360
+
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(buf):
+            raise ValueError("truncated protobuf")
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _take(buf: bytes, pos: int, length: int) -> Tuple[bytes, int]:
+    """读取 length 个字节，超出末尾（分段被截断或损坏）时抛出 ValueError"""
+    end = pos + length
+    if end > len(buf):
+        raise ValueError("truncated protobuf")
+    return buf[pos:end], end
+
+
+def _iter_fields(buf: bytes) -> Iterator[Tuple[int, object]]:
+    """逐个读取protobuf字段 (字段号, 值)；varint为int，length-delimited为bytes；数据被截断时抛出 ValueError"""
+    pos = 0
+    while pos < len(buf):
+        key, pos = _read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value, pos = _take(buf, pos, length)
+        elif wire_type == 1:
+            value, pos = _take(buf, pos, 8)
+        elif wire_type == 5:
+            value, pos = _take(buf, pos, 4)
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield field, value
+
+
+def parse_danmaku_segment(data: bytes) -> List[Dict]:
+    """
+    解析弹幕分段 (DmSegMobileReply)，只取需要的字段:
+    elems(1) -> id(1), progress(2), content(7), ctime(8)
+    """
+    danmaku = []
+    for field, elem in _iter_fields(data):
+        if field != 1:
+            continue
+        item = {"dmid": 0, "progress": 0, "comment": "", "ctime": 0}
+        for elem_field, value in _iter_fields(elem):
+            if elem_field == 1:
+                item["dmid"] = value
+            elif elem_field == 2:
+                item["progress"] = value
+            elif elem_field == 7:
+                item["comment"] = value.decode("utf-8", errors="replace")
+            elif elem_field == 8:
+                item["ctime"] = value
+        if item["dmid"] and item["comment"]:
+            danmaku.append(item)
+    return danmaku
+
+
+class DanmakuCollector:
+    def __init__(
+        self,
+        db: Optional[CommentDatabase] = None,
+        requests_per_second: float = 2.0,
+        max_concurrent_videos: int = 2,
+        max_segments_per_video: int = 10,
+        api_host: str = API_HOST,
+    ):
+        """
+        :param db: 原始评论数据库，弹幕写入同一个库
+        :param requests_per_second: 全局每秒请求数上限
+        :param max_concurrent_videos: 同时采集弹幕的视频数
+        :param max_segments_per_video: 每个视频最多下载的分段数（长视频只取前若干段）
+        :param api_host: API地址，测试时可指向本地模拟服务器
+        """
+        self.db = db or CommentDatabase()
+        self.rate_limiter = TokenBucketLimiter(requests_per_second)
+        self.max_concurrent_videos = max(1, max_concurrent_videos)
+        self.max_segments_per_video = max_segments_per_video
+        self.api_host = api_host
+        self.headers = {
+            "User-Agent": get_user_agent(),
+            "Referer": "https://www.bilibili.com",
+        }
+        self.session: Optional[httpx.AsyncClient] = None
+
+    async def get_json(self, url: str, params: Dict) -> Dict:
+        response = await self.session.get(url, params=params)
+        try:
+            data = response.json()
+        except ValueError:
+            raise DataFetchError(f"Failed to parse JSON (HTTP {response.status_code})")
+        if data.get("code") != 0:
+            raise DataFetchError(f"API error: {data.get('message')} (code: {data.get('code')})", code=data.get("code"))
+        return data.get("data", {})
+
+    async def get_video_cid(self, aid: int) -> Tuple[int, int]:
+        """视频第一P的 (cid, 时长秒数)"""
+        data = await self.get_json(f"{self.api_host}/x/web-interface/view", {"aid": aid})
+        return data["cid"], data.get("duration", 0)
+
+    async def fetch_segment(self, aid: int, cid: int, segment_index: int) -> List[Dict]:
+        """下载并解析一个弹幕分段（分段序号从1开始）"""
+        response = await self.session.get(f"{self.api_host}/x/v2/dm/web/seg.so", params={
+            "type": 1,
+            "oid": cid,
+            "pid": aid,
+            "segment_index": segment_index,
+        })
+        if response.status_code != 200:
+            raise DataFetchError(f"HTTP {response.status_code} for danmaku segment {segment_index} of {aid}")
+        if "json" in response.headers.get("content-type", ""):
+            data = response.json()
+            raise DataFetchError(f"API error: {data.get('message')} (code: {data.get('code')})", code=data.get("code"))
+        return parse_danmaku_segment(response.content)
+
+    async def collect_video(self, aid: int, category: str, is_hot: bool) -> int:
+        """采集一个视频的弹幕，返回保存的条数；单个分段出错时保存其余分段，全部出错时抛出第一个异常"""
+        cid, duration = await self.get_video_cid(aid)
+        segments = max(1, min(self.max_segments_per_video, math.ceil(duration / SEGMENT_SECONDS)))
+        results = await asyncio.gather(*(
+            self.fetch_segment(aid, cid, index) for index in range(1, segments + 1)
+        ), return_exceptions=True)
+        fetched = []
+        for index, result in enumerate(results, 1):
+            if isinstance(result, Exception):
+                print(f"Error fetching danmaku segment {index} of {aid}: {result}")
+            else:
+                fetched.append(result)
+        if not fetched:
+            raise results[0]
+        danmaku = [
+            dict(item, category=category, is_hot=bool(is_hot))
+            for segment in fetched for item in segment
+        ]
+        self.db.save_danmaku_batch(aid, cid, len(fetched), danmaku)
+        return len(danmaku)
+
+    async def collect(self, max_videos: int = 50) -> int:
+        """为尚未抓取弹幕的视频采集弹幕，返回保存的总条数"""
+        videos = self.db.get_videos_without_danmaku(max_videos)
+        print(f"Collecting danmaku for {len(videos)} videos")
+        self.session = create_http_client(headers=self.headers, timeout=30.0, rate_limiter=self.rate_limiter)
+        semaphore = asyncio.Semaphore(self.max_concurrent_videos)
+        total = 0
+
+        async def collect_one(aid, category, is_hot):
+            nonlocal total
+            async with semaphore:
+                try:
+                    total += await self.collect_video(aid, category, is_hot)
+                except (DataFetchError, httpx.HTTPError, KeyError, ValueError) as e:
+                    print(f"Error collecting danmaku for video {aid}: {e}")
+
+        try:
+            await asyncio.gather(*(collect_one(*video) for video in videos))
+        finally:
+            await self.session.aclose()
+        print(f"Collected {total} danmaku from {len(videos)} videos")
+        return total
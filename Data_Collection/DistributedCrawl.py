@@ -0,0 +1,242 @@
+# DistributedCrawl.py
+"""
+多进程分布式采集：一个协调进程按全局分区比例把视频加入 crawl_jobs 队列，
+多个 worker 进程各自限速、以租约认领视频并爬取评论。
+所有进程须在同一台机器上、共享本地磁盘上的同一个数据库文件：SQLite 的 WAL 模式依赖共享内存，
+不能用于网络文件系统
+
+用法:
+    python -m Data_Collection.DistributedCrawl coordinator --videos 200
+    python -m Data_Collection.DistributedCrawl worker --id worker-a --rps 1.0
+    python -m Data_Collection.DistributedCrawl local --workers 3 --videos 60   # 本地模拟服务器上试运行
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from typing import Optional
+
+from Data_Collection.SmartBiliCrawler import (
+    API_HOST,
+    DB_FILE,
+    CategoryScheduler,
+    CommentDatabase,
+    CrawlJobQueue,
+    MultiCategoryHotCrawler,
+    close_raw_connections,
+    get_raw_connection,
+)
+
+
+class CrawlCoordinator:
+    def __init__(
+        self,
+        crawler: MultiCategoryHotCrawler,
+        queue: CrawlJobQueue,
+        total_videos: int = 100,
+        batch_size: int = 10,
+        low_watermark: int = 20,
+        poll_interval: float = 2.0,
+    ):
+        """
+        :param crawler: 只用它的列表接口和分区映射，不爬取评论
+        :param queue: 任务队列
+        :param total_videos: 本次采集的目标视频数（完成的任务数）
+        :param batch_size: 每次列表请求的视频数
+        :param low_watermark: 排队任务少于该值时补充
+        :param poll_interval: 检查队列的间隔（秒）
+        """
+        self.crawler = crawler
+        self.queue = queue
+        self.total_videos = total_videos
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.poll_interval = poll_interval
+
+    def refresh_counts(self, scheduler: CategoryScheduler):
+        """分区计数 = 已入库的视频 + 队列中未完成的任务，所有 worker 的进度都计入同一个比例"""
+        counts = self.crawler.db.get_video_count_by_category()
+        for category, outstanding in self.queue.outstanding_by_category().items():
+            counts[category] = counts.get(category, 0) + outstanding
+        scheduler.counts = counts
+
+    async def run(self) -> int:
+        """补充任务直到本次运行完成的任务数达到目标，然后关闭队列；返回本次运行完成的任务数"""
+        crawler = self.crawler
+        await crawler.init_session()
+        crawler.scheduler = scheduler = CategoryScheduler(crawler.target_ratios, {})
+        self.queue.open()
+        started_at = since = time.time()
+        consecutive_failures = 0
+
+        try:
+            while consecutive_failures < 10:
+                # 各 worker 完成的任务计入对应分区的收益：协调进程看不到请求数和评论正文，
+                # 每个任务按一次请求计，只计评论条数（空字符串不产生新n-gram）
+                for aid, category, comments, updated_at in self.queue.completed_since(since):
+                    scheduler.record_batch(category, 1, [''] * comments)
+                    since = max(since, updated_at)
+
+                # 只统计本次运行完成的任务，以前运行完成的任务不计入目标
+                counts = self.queue.status_counts(started_at)
+                done = counts.get(CrawlJobQueue.DONE, 0)
+                outstanding = counts.get(CrawlJobQueue.QUEUED, 0) + counts.get(CrawlJobQueue.LEASED, 0)
+                if done >= self.total_videos:
+                    break
+                if counts.get(CrawlJobQueue.QUEUED, 0) >= self.low_watermark or done + outstanding >= self.total_videos:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+
+                self.refresh_counts(scheduler)
+                category = scheduler.next_category()
+                videos, is_hot = await crawler.list_category_videos(category, self.batch_size, self.total_videos)
+                aids = [video['aid'] for video in videos]
+                known_aids = crawler.db.filter_existing_aids(aids) | self.queue.filter_known_aids(aids)
+                jobs = []
+                for aid in aids:
+                    if len(jobs) >= self.total_videos - done - outstanding:
+                        break
+                    if aid in known_aids:
+                        continue
+                    known_aids.add(aid)
+                    jobs.append((aid, category, is_hot))
+                if not jobs:
+                    scheduler.record_batch(category, 1, [])
+                    consecutive_failures += 1
+                    print(f"No new videos for category {category}. Consecutive failures: {consecutive_failures}")
+                    await asyncio.sleep(random.uniform(2.0, 5.0))
+                    continue
+                consecutive_failures = 0
+                added = self.queue.enqueue(jobs)
+                print(f"Enqueued {added} {category} videos ({done} done, {outstanding + added} outstanding)")
+        finally:
+            self.queue.close()
+            await crawler.close_session()
+
+        print("Crawl budget by category:")
+        print(scheduler.summary())
+        return self.queue.status_counts(started_at).get(CrawlJobQueue.DONE, 0)
+
+
+def run_worker(
+    worker_id: str,
+    db_file: str = DB_FILE,
+    requests_per_second: float = 1.0,
+    max_concurrent_videos: int = 2,
+    lease_seconds: float = 300.0,
+    api_host: str = API_HOST,
+    data_dir: Optional[str] = None,
+) -> int:
+    """在当前进程中运行一个 worker，直到队列关闭且任务处理完毕"""
+    crawler = MultiCategoryHotCrawler(
+        CommentDatabase(db_file),
+        max_concurrent_videos=max_concurrent_videos,
+        requests_per_second=requests_per_second,
+        api_host=api_host,
+        data_dir=data_dir,
+    )
+    queue = CrawlJobQueue(db_file, lease_seconds=lease_seconds)
+    try:
+        return asyncio.run(crawler.work_queue(queue, worker_id))
+    finally:
+        close_raw_connections()
+
+
+def run_coordinator(
+    total_videos: int,
+    db_file: str = DB_FILE,
+    lease_seconds: float = 300.0,
+    api_host: str = API_HOST,
+) -> int:
+    crawler = MultiCategoryHotCrawler(CommentDatabase(db_file), api_host=api_host)
+    coordinator = CrawlCoordinator(crawler, CrawlJobQueue(db_file, lease_seconds=lease_seconds), total_videos)
+    try:
+        return asyncio.run(coordinator.run())
+    finally:
+        close_raw_connections()
+
+
+def run_local(args):
+    """启动模拟服务器，在临时目录中运行一个协调进程和多个 worker 进程，报告各 worker 的任务分布"""
+    from Data_Collection.FakeBiliServer import FakeBiliServer
+
+    context = multiprocessing.get_context("spawn")
+    with FakeBiliServer(latency=args.latency, error_rate=args.error_rate) as server, \
+            tempfile.TemporaryDirectory() as work_dir:
+        db_file = os.path.join(work_dir, "raw_bilibili_comments.db")
+        # 模拟服务器总是报告已登录，写一个cookies文件让 worker 走纯HTTP模式
+        with open(os.path.join(work_dir, "bilibili_cookies.json"), "w") as f:
+            json.dump([{"name": "SESSDATA", "value": "local"}], f)
+        CommentDatabase(db_file)
+        CrawlJobQueue(db_file)
+
+        workers = [
+            context.Process(target=run_worker, args=(
+                f"worker-{i}", db_file, args.rps, args.concurrency, args.lease, server.url, work_dir,
+            ))
+            for i in range(args.workers)
+        ]
+        start = time.perf_counter()
+        for process in workers:
+            process.start()
+        done = run_coordinator(args.videos, db_file, args.lease, server.url)
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        conn = get_raw_connection(db_file)
+        per_worker = conn.execute(
+            "SELECT worker, COUNT(*), SUM(comments) FROM crawl_jobs WHERE status = 'done' GROUP BY worker"
+        ).fetchall()
+        retried = conn.execute("SELECT COUNT(*) FROM crawl_jobs WHERE attempts > 1").fetchone()[0]
+        videos = conn.execute("SELECT COUNT(*) FROM video_info").fetchone()[0]
+        comments = conn.execute("SELECT COUNT(*) FROM raw_comments").fetchone()[0]
+        close_raw_connections()
+
+    print("\n===== Distributed crawl =====")
+    print(f"Elapsed:        {elapsed:.2f} s")
+    print(f"Jobs done:      {done}  (retried {retried})")
+    for worker, count, worker_comments in per_worker:
+        print(f"  {worker}: {count} videos, {worker_comments} comments")
+    print(f"Database:       {videos} videos, {comments} comments")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程分布式采集")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    coordinator = subparsers.add_parser("coordinator", help="按分区比例向队列加入视频")
+    coordinator.add_argument("--videos", type=int, default=100, help="目标视频数")
+
+    worker = subparsers.add_parser("worker", help="从队列认领视频并爬取评论")
+    worker.add_argument("--id", required=True, help="worker 名称，各进程须不同")
+    worker.add_argument("--rps", type=float, default=1.0, help="本 worker 的每秒请求数上限")
+    worker.add_argument("--concurrency", type=int, default=2, help="同时爬取的视频数")
+
+    local = subparsers.add_parser("local", help="在本地模拟服务器上运行协调进程和多个 worker")
+    local.add_argument("--workers", type=int, default=3)
+    local.add_argument("--videos", type=int, default=60)
+    local.add_argument("--rps", type=float, default=20.0, help="每个 worker 的每秒请求数上限")
+    local.add_argument("--concurrency", type=int, default=2)
+    local.add_argument("--latency", type=float, default=0.02, help="模拟服务器延迟（秒）")
+    local.add_argument("--error-rate", type=float, default=0.0, help="模拟服务器返回HTTP 500的概率")
+
+    for sub in (coordinator, worker, local):
+        sub.add_argument("--lease", type=float, default=300.0, help="任务租约秒数")
+    args = parser.parse_args()
+
+    if args.command == "coordinator":
+        run_coordinator(args.videos, lease_seconds=args.lease)
+    elif args.command == "worker":
+        run_worker(args.id, requests_per_second=args.rps, max_concurrent_videos=args.concurrency,
+                   lease_seconds=args.lease)
+    else:
+        run_local(args)
+
+
+if __name__ == "__main__":
+    main()
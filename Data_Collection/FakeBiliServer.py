@@ -0,0 +1,490 @@
+# FakeBiliServer.py
+"""
+本地B站API模拟服务器，用于在不访问线上站点的情况下测试和压测爬虫
+
+实现的接口:
+    /x/web-interface/nav                  登录状态和WBI密钥
+    /x/v2/reply/wbi/main                  评论（游标分页，校验WBI签名 w_rid）
+    /x/v2/reply/reply                     楼中楼回复（页码分页）
+    /x/web-interface/view                 视频详情
+    /x/v2/dm/web/seg.so                   弹幕分段（protobuf）
+    /x/web-interface/dynamic/region       分区动态
+    /x/web-interface/popular              综合热门
+    /x/web-interface/popular/series/one   每周必看
+    /x/web-interface/ranking/v2           排行榜
+
+设置 replay 后优先返回 ResponseArchive 中存档的真实响应（视频列表依次给出存档中的aid），
+存档中没有的请求仍返回生成的数据
+
+用法:
+    python -m Data_Collection.FakeBiliServer --port 8765 --latency 0.05 --error-rate 0.02
+    python -m Data_Collection.FakeBiliServer --replay Database/responses
+    BILIBILI_API_HOST=http://127.0.0.1:8765 python ...  # 让爬虫访问模拟服务器
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from Data_Collection.ResponseArchive import ResponseArchive
+from Data_Collection.SmartBiliCrawler import (
+    COMMENT_MODE_TIME,
+    KIND_REPLY,
+    KIND_REPLY_TIME,
+    KIND_SUB_REPLY,
+    KIND_VIEW,
+    BilibiliSign,
+)
+
+# 模拟服务器使用的WBI密钥（取自 get_wbi_keys 的默认密钥）
+FAKE_IMG_KEY = "7cd084941338484aae1ad9425b84077c"
+FAKE_SUB_KEY = "4932caff0ff746eab6f01bf08b70ac45"
+
+# 分区动态接口按rid返回该分区的视频；其他列表接口从这些子分区中随机选
+FAKE_TIDS = [119, 3, 4, 160, 36, 188, 167, 117, 13, 11, 23, 17, 138, 201, 22, 1]
+
+PAGE_SIZE = 20
+REGION_VIDEOS = 1000  # 分区动态接口报告的每个分区视频总数
+DANMAKU_PER_SEGMENT = 800
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number: int, value) -> bytes:
+    """编码一个protobuf字段：int为varint，bytes/str为length-delimited"""
+    if isinstance(value, int):
+        return _varint(number << 3) + _varint(value)
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def encode_danmaku_segment(danmaku: List[Dict]) -> bytes:
+    """按 DmSegMobileReply 格式编码弹幕：elems(1) -> id(1), progress(2), content(7), ctime(8)"""
+    return b"".join(
+        _field(1, _field(1, d["dmid"]) + _field(2, d["progress"]) + _field(7, d["content"]) + _field(8, d["ctime"]))
+        for d in danmaku
+    )
+
+
+class FakeBiliState:
+    """
+    模拟服务器的数据和故障注入配置，在处理线程之间共享
+
+    视频和评论按aid确定性生成：同一个aid的详情和评论在多次请求间保持一致，
+    列表接口每次返回新的aid，保证爬虫总能拿到未爬过的视频
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        max_rps: Optional[float] = None,
+        comments_per_video: Tuple[int, int] = (0, 200),
+        new_comments_per_minute: float = 0.0,
+        seed: int = 0,
+        replay: Optional[ResponseArchive] = None,
+    ):
+        """
+        :param latency: 每个响应的基础延迟（秒）
+        :param jitter: 在基础延迟上增加的 [0, jitter] 秒随机延迟
+        :param error_rate: 返回HTTP 500的概率
+        :param max_rps: 每秒请求数上限，超过时返回 412 / -412（模拟风控）
+        :param comments_per_video: 每个视频评论数的范围
+        :param new_comments_per_minute: 每个视频每分钟新增的评论数，用于测试回访
+        :param seed: 随机种子
+        :param replay: 回放的响应存档
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.comments_per_video = comments_per_video
+        self.new_comments_per_minute = new_comments_per_minute
+        self.seed = seed
+        self.started_at = time.time()
+
+        self.salt = BilibiliSign(FAKE_IMG_KEY, FAKE_SUB_KEY).get_salt()
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.next_aid = 10_000_000
+        self.video_tids: Dict[int, int] = {}
+        self.recent_requests: deque = deque()
+        self.stats: Counter = Counter()
+        self.replay = replay
+        self.replay_aids: deque = deque(replay.aids(KIND_VIEW) if replay else [])
+
+    def new_videos(self, count: int, tid: Optional[int] = None) -> List[Dict]:
+        """生成一批新视频的列表项"""
+        videos = []
+        with self.lock:
+            # 先依次给出存档中的视频
+            while self.replay_aids and len(videos) < count:
+                aid = self.replay_aids.popleft()
+                videos.append({"aid": aid, "title": f"archived video {aid}"})
+            for _ in range(count - len(videos)):
+                aid = self.next_aid
+                self.next_aid += 1
+                video_tid = tid if tid is not None else self.random.choice(FAKE_TIDS)
+                self.video_tids[aid] = video_tid
+                videos.append({"aid": aid, "tid": video_tid, "title": f"fake video {aid}"})
+        return videos
+
+    def video_rng(self, aid: int) -> random.Random:
+        return random.Random(self.seed * 1_000_003 + aid)
+
+    def comment_total(self, aid: int) -> int:
+        low, high = self.comments_per_video
+        grown = int(self.new_comments_per_minute * (time.time() - self.started_at) / 60)
+        return self.video_rng(aid).randint(low, high) + grown
+
+    def video_detail(self, aid: int) -> Dict:
+        rng = self.video_rng(aid)
+        with self.lock:
+            tid = self.video_tids.get(aid)
+        if tid is None:
+            tid = rng.choice(FAKE_TIDS)
+        return {
+            "aid": aid,
+            "tid": tid,
+            "title": f"fake video {aid}",
+            "cid": aid * 10,
+            "duration": rng.randint(30, 1800),
+            "pubdate": 1_700_000_000 + aid % 10_000_000,
+            "stat": {
+                "view": rng.randint(100, 2_000_000),
+                "like": rng.randint(0, 50_000),
+                "reply": self.comment_total(aid),
+            },
+        }
+
+    def comment_page(self, aid: int, page: int, mode: int = 0) -> Dict:
+        """第page页（从0开始）的评论和游标；mode=2 时按时间从新到旧"""
+        total = self.comment_total(aid)
+        start = page * PAGE_SIZE
+        end = min(start + PAGE_SIZE, total)
+        indices = range(start, end)
+        if mode == 2:
+            indices = range(total - 1 - start, total - 1 - end, -1)
+        replies = [
+            {
+                "rpid": aid * 100_000 + i + 1,
+                "oid": aid,
+                "ctime": 1_700_000_000 + aid % 10_000_000 + i * 60,
+                "content": {"message": f"第{i + 1}条评论 来自视频{aid} 哈哈哈 awsl"},
+                "rcount": self.sub_reply_total(aid * 100_000 + i + 1),
+            }
+            for i in indices
+        ]
+        return {
+            "cursor": {"is_end": end >= total, "next": page + 1, "all_count": total},
+            "replies": replies,
+        }
+
+    def sub_reply_total(self, root: int) -> int:
+        """评论的楼中楼回复数：多数为0，少数热评有几十条"""
+        rng = random.Random(self.seed * 1_000_003 + root)
+        return rng.choice([0, 0, 0, 0, 1, 2, 5, 30, 80])
+
+    def sub_reply_page(self, aid: int, root: int, page: int, page_size: int) -> Dict:
+        """第page页（从1开始）的楼中楼回复"""
+        total = self.sub_reply_total(root)
+        start = (page - 1) * page_size
+        end = min(start + page_size, total)
+        replies = [
+            {
+                "rpid": root * 1000 + j + 1,
+                "oid": aid,
+                "root": root,
+                "parent": root,
+                "ctime": 1_700_000_000 + aid % 10_000_000 + j * 30,
+                "content": {"message": f"回复@楼主 第{j + 1}楼 {root} 绷不住了 xswl"},
+            }
+            for j in range(start, end)
+        ]
+        return {
+            "page": {"num": page, "size": page_size, "count": total},
+            "replies": replies,
+        }
+
+    def danmaku_segment(self, cid: int, segment_index: int) -> List[Dict]:
+        """视频某个6分钟分段内的弹幕"""
+        aid = cid // 10
+        duration = self.video_detail(aid)["duration"]
+        start_ms = (segment_index - 1) * 360_000
+        end_ms = min(segment_index * 360_000, duration * 1000)
+        if start_ms >= end_ms:
+            return []
+        count = DANMAKU_PER_SEGMENT * (end_ms - start_ms) // 360_000
+        step = (end_ms - start_ms) // max(count, 1)
+        return [
+            {
+                "dmid": cid * 100_000 + (segment_index - 1) * DANMAKU_PER_SEGMENT + k + 1,
+                "progress": start_ms + k * step,
+                "content": f"前方高能 {k} 泪目 yyds",
+                "ctime": 1_700_000_000 + aid % 10_000_000 + k,
+            }
+            for k in range(count)
+        ]
+
+    def check_rate(self) -> bool:
+        """滑动一秒窗口内的请求数是否超过上限"""
+        if not self.max_rps:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            while self.recent_requests and now - self.recent_requests[0] > 1.0:
+                self.recent_requests.popleft()
+            if len(self.recent_requests) >= self.max_rps:
+                return False
+            self.recent_requests.append(now)
+            return True
+
+    def verify_wbi(self, params: Dict[str, str]) -> bool:
+        """按与 BilibiliSign.sign 相同的规则重新计算 w_rid"""
+        w_rid = params.get("w_rid")
+        if not w_rid or "wts" not in params:
+            return False
+        unsigned = {k: v for k, v in sorted(params.items()) if k != "w_rid"}
+        query = urlencode(unsigned)
+        return hashlib.md5((query + self.salt).encode()).hexdigest() == w_rid
+
+    def replayed(self, kind: str, aid: int, page: int = 0, root: int = 0) -> Optional[Dict]:
+        """存档中对应的响应，未设置回放或没有存档时返回None"""
+        if self.replay is None:
+            return None
+        payload = self.replay.get(kind, aid, page, root)
+        if payload is not None:
+            self.record("replayed")
+        return payload
+
+    def record(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+
+class FakeBiliHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeBili/1.0"
+
+    @property
+    def state(self) -> FakeBiliState:
+        return self.server.state
+
+    def log_message(self, format, *args):
+        # 压测时请求量大，不输出访问日志
+        pass
+
+    def send_json(self, payload: Dict, status: int = 200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int, code: int, message: str):
+        self.state.record(f"error_{code}")
+        self.send_json({"code": code, "message": message, "data": None}, status)
+
+    def do_GET(self):
+        state = self.state
+        state.record("requests")
+
+        delay = state.latency + random.uniform(0, state.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if not state.check_rate():
+            self.send_error_json(412, -412, "请求被拦截")
+            return
+        if state.error_rate and random.random() < state.error_rate:
+            state.record("error_500")
+            body = b"Internal Server Error"
+            self.send_response(500)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        route = self.routes.get(url.path)
+        if route is None:
+            self.send_error_json(404, -404, "啥都木有")
+            return
+        try:
+            route(self, params)
+        except (KeyError, ValueError) as e:
+            self.send_error_json(400, -400, f"请求错误: {e}")
+
+    def handle_nav(self, params: Dict[str, str]):
+        self.send_json({"code": 0, "message": "0", "data": {
+            "isLogin": True,
+            "wbi_img": {
+                "img_url": f"https://i0.hdslb.com/bfs/wbi/{FAKE_IMG_KEY}.png",
+                "sub_url": f"https://i0.hdslb.com/bfs/wbi/{FAKE_SUB_KEY}.png",
+            },
+        }})
+
+    def handle_replies(self, params: Dict[str, str]):
+        if not self.state.verify_wbi(params):
+            self.send_error_json(200, -352, "风控校验失败")
+            return
+        aid = int(params["oid"])
+        page = int(params.get("next", 0))
+        self.state.record("comment_pages")
+        mode = int(params.get("mode", 0))
+        kind = KIND_REPLY_TIME if mode == COMMENT_MODE_TIME else KIND_REPLY
+        data = self.state.replayed(kind, aid, page)
+        if data is None:
+            data = self.state.comment_page(aid, page, mode)
+        self.send_json({"code": 0, "message": "0", "data": data})
+
+    def handle_sub_replies(self, params: Dict[str, str]):
+        aid = int(params["oid"])
+        root = int(params["root"])
+        page = int(params.get("pn", 1))
+        page_size = int(params.get("ps", 20))
+        self.state.record("sub_reply_pages")
+        data = self.state.replayed(KIND_SUB_REPLY, aid, page, root)
+        if data is None:
+            data = self.state.sub_reply_page(aid, root, page, page_size)
+        self.send_json({"code": 0, "message": "0", "data": data})
+
+    def handle_danmaku_segment(self, params: Dict[str, str]):
+        cid = int(params["oid"])
+        segment_index = int(params.get("segment_index", 1))
+        self.state.record("danmaku_segments")
+        body = encode_danmaku_segment(self.state.danmaku_segment(cid, segment_index))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_view(self, params: Dict[str, str]):
+        aid = int(params["aid"])
+        self.state.record("video_details")
+        data = self.state.replayed(KIND_VIEW, aid)
+        if data is None:
+            data = self.state.video_detail(aid)
+        self.send_json({"code": 0, "message": "0", "data": data})
+
+    def handle_region(self, params: Dict[str, str]):
+        page_num = int(params.get("pn", 1))
+        page_size = int(params.get("ps", 20))
+        remaining = max(0, REGION_VIDEOS - (page_num - 1) * page_size)
+        videos = self.state.new_videos(min(page_size, remaining), tid=int(params["rid"]) or None)
+        self.send_json({"code": 0, "message": "0", "data": {
+            "archives": videos,
+            "page": {"num": page_num, "size": page_size, "count": REGION_VIDEOS},
+        }})
+
+    def handle_popular(self, params: Dict[str, str]):
+        videos = self.state.new_videos(int(params.get("ps", 20)))
+        self.send_json({"code": 0, "message": "0", "data": {"list": videos}})
+
+    def handle_ranking(self, params: Dict[str, str]):
+        videos = self.state.new_videos(100)
+        self.send_json({"code": 0, "message": "0", "data": {"list": videos}})
+
+    routes = {
+        "/x/web-interface/nav": handle_nav,
+        "/x/v2/reply/wbi/main": handle_replies,
+        "/x/v2/reply/reply": handle_sub_replies,
+        "/x/web-interface/view": handle_view,
+        "/x/v2/dm/web/seg.so": handle_danmaku_segment,
+        "/x/web-interface/dynamic/region": handle_region,
+        "/x/web-interface/popular": handle_popular,
+        "/x/web-interface/popular/series/one": handle_popular,
+        "/x/web-interface/ranking/v2": handle_ranking,
+    }
+
+
+class FakeBiliServer:
+    """在后台线程中运行的模拟服务器，url 属性可作为爬虫的 api_host"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, **state_options):
+        """
+        :param port: 端口，0表示自动分配
+        :param state_options: 传给 FakeBiliState 的延迟、错误率和限流配置
+        """
+        self.state = FakeBiliState(**state_options)
+        self.httpd = ThreadingHTTPServer((host, port), FakeBiliHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeBiliServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "FakeBiliServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地B站API模拟服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="基础响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="额外随机延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回HTTP 500的概率")
+    parser.add_argument("--max-rps", type=float, default=None, help="每秒请求上限，超过返回-412")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", default=None, help="回放的响应存档目录")
+    args = parser.parse_args()
+
+    server = FakeBiliServer(
+        args.host, args.port,
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        max_rps=args.max_rps, seed=args.seed,
+        replay=ResponseArchive(args.replay) if args.replay else None,
+    )
+    print(f"Fake Bilibili API listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"Requests served: {dict(server.state.stats)}")
+
+
+if __name__ == "__main__":
+    main()
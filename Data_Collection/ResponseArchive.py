@@ -0,0 +1,265 @@
+# ResponseArchive.py
+"""
+原始API响应存档：按天追加写入压缩的JSON响应，并按 (类型, aid, root, 页码) 建索引
+
+爬虫入库时只保留 rpid、aid、评论内容和时间，存档保留完整响应（点赞数、回复数、用户等级、表情等），
+之后需要新字段时可用 rebuild_raw_comments 离线重建 raw_comments 或回填新加的列，不必重新爬取；
+FakeBiliServer 也可以用存档回放真实响应，做可复现的基准测试
+
+存档目录结构:
+    responses_YYYY-MM-DD.seg   每条记录为 4字节长度 + zlib压缩的JSON，只追加
+    index.db                   记录在段文件中的位置
+
+append 在爬虫的事件循环中调用，索引按批提交（每 index_batch_size 条、切换段文件或 close 时），
+提交前先把段文件刷到磁盘；进程异常退出时最后一批记录没有索引，段文件中只留下无法寻址的数据
+"""
+import json
+import os
+import struct
+import time
+import zlib
+from datetime import datetime
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from Data_Collection.SmartBiliCrawler import (
+    DB_FILE,
+    KIND_REPLY,
+    KIND_REPLY_TIME,
+    KIND_SUB_REPLY,
+    KIND_VIEW,
+    BilibiliCommentCrawler,
+    CommentDatabase,
+    get_raw_connection,
+)
+from Data_Collection.CommentArchive import CommentArchive
+
+RESPONSE_ARCHIVE_DIR = os.path.join(os.path.dirname(DB_FILE), "responses")
+
+_HEADER = struct.Struct(">I")
+
+
+class ResponseArchive:
+    def __init__(self, archive_dir: str = RESPONSE_ARCHIVE_DIR, compress_level: int = 6, index_batch_size: int = 100):
+        """
+        :param archive_dir: 存档目录，段文件和索引都在其中，整个目录可直接复制
+        :param compress_level: zlib压缩级别
+        :param index_batch_size: 积累多少条记录提交一次索引
+        """
+        self.archive_dir = archive_dir
+        self.compress_level = compress_level
+        self.index_batch_size = max(1, index_batch_size)
+        self._pending: List[Tuple] = []
+        os.makedirs(archive_dir, exist_ok=True)
+        self.index_file = os.path.join(archive_dir, "index.db")
+        self._segment_day: Optional[str] = None
+        self._segment: Optional[BinaryIO] = None
+
+        conn = get_raw_connection(self.index_file)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                aid INTEGER NOT NULL,
+                root INTEGER DEFAULT 0,
+                page INTEGER DEFAULT 0,
+                day TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_key ON responses(kind, aid, root, page)')
+        conn.commit()
+
+    def segment_path(self, day: str) -> str:
+        return os.path.join(self.archive_dir, f"responses_{day}.seg")
+
+    def _open_segment(self, day: str) -> BinaryIO:
+        if self._segment_day != day:
+            # 旧段文件的记录先提交索引再关闭
+            self.close()
+            self._segment = open(self.segment_path(day), "ab")
+            self._segment_day = day
+        return self._segment
+
+    def append(self, kind: str, aid: int, payload: Dict, page: int = 0, root: int = 0):
+        """追加一条响应（API返回的 data 部分）"""
+        fetched_at = time.time()
+        day = datetime.fromtimestamp(fetched_at).strftime("%Y-%m-%d")
+        blob = zlib.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"), self.compress_level)
+
+        segment = self._open_segment(day)
+        segment.write(_HEADER.pack(len(blob)))
+        offset = segment.tell()
+        segment.write(blob)
+
+        self._pending.append((kind, int(aid), root, page, day, offset, len(blob), fetched_at))
+        if len(self._pending) >= self.index_batch_size:
+            self.flush()
+
+    def flush(self):
+        """把段文件刷到磁盘，再提交积累的索引记录"""
+        if not self._pending:
+            return
+        if self._segment:
+            self._segment.flush()
+        conn = get_raw_connection(self.index_file)
+        conn.executemany('''
+            INSERT INTO responses (kind, aid, root, page, day, offset, length, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', self._pending)
+        conn.commit()
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        if self._segment:
+            self._segment.close()
+            self._segment = None
+            self._segment_day = None
+
+    def _read(self, day: str, offset: int, length: int) -> Dict:
+        with open(self.segment_path(day), "rb") as f:
+            f.seek(offset)
+            return json.loads(zlib.decompress(f.read(length)))
+
+    def get(self, kind: str, aid: int, page: int = 0, root: int = 0) -> Optional[Dict]:
+        """该键最近一次存档的响应，没有则返回None"""
+        self.flush()
+        row = get_raw_connection(self.index_file).execute('''
+            SELECT day, offset, length FROM responses
+            WHERE kind = ? AND aid = ? AND root = ? AND page = ?
+            ORDER BY id DESC LIMIT 1
+        ''', (kind, int(aid), root, page)).fetchone()
+        return self._read(*row) if row else None
+
+    def aids(self, kind: str = KIND_VIEW) -> List[int]:
+        """存档中出现过的aid，按首次存档顺序"""
+        self.flush()
+        rows = get_raw_connection(self.index_file).execute(
+            "SELECT aid FROM responses WHERE kind = ? GROUP BY aid ORDER BY MIN(id)", (kind,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_records(
+        self,
+        kinds: Optional[Tuple[str, ...]] = None,
+        day: Optional[str] = None,
+    ) -> Iterator[Tuple[str, int, int, int, Dict]]:
+        """按存档顺序读取 (kind, aid, root, page, payload)；每个段文件只顺序打开一次"""
+        self.flush()
+        conditions = []
+        params: List = []
+        if kinds:
+            conditions.append(f"kind IN ({','.join('?' * len(kinds))})")
+            params.extend(kinds)
+        if day:
+            conditions.append("day = ?")
+            params.append(day)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = get_raw_connection(self.index_file).execute(f'''
+            SELECT kind, aid, root, page, day, offset, length FROM responses {where}
+            ORDER BY day, offset
+        ''', params)
+
+        current_day, segment = None, None
+        try:
+            for kind, aid, root, page, row_day, offset, length in cursor:
+                if row_day != current_day:
+                    if segment:
+                        segment.close()
+                    segment = open(self.segment_path(row_day), "rb")
+                    current_day = row_day
+                segment.seek(offset)
+                yield kind, aid, root, page, json.loads(zlib.decompress(segment.read(length)))
+        finally:
+            if segment:
+                segment.close()
+
+    def iter_replies(self, day: Optional[str] = None) -> Iterator[Tuple[int, int, Dict]]:
+        """逐条读取存档中的评论 (aid, parent, 原始评论JSON)，可用于提取新字段"""
+        for kind, aid, root, _, payload in self.iter_records((KIND_REPLY, KIND_REPLY_TIME, KIND_SUB_REPLY), day):
+            for reply in payload.get("replies") or []:
+                parent = (reply.get("parent") or root) if kind == KIND_SUB_REPLY else 0
+                yield aid, parent, reply
+
+
+def rebuild_raw_comments(
+    archive: ResponseArchive,
+    db: Optional[CommentDatabase] = None,
+    day: Optional[str] = None,
+    batch_size: int = 5000,
+    to_row: Optional[Callable[[int, int, Dict, Dict], Dict]] = None,
+    update_columns: Sequence[str] = (),
+    cold: Optional[CommentArchive] = None,
+) -> int:
+    """
+    用存档重建 raw_comments，返回处理的评论数
+    分类和热门标记取自 video_info；已移入冷存储的rpid（archived_rpids 表）按批跳过，不会重新写回热数据
+    :param to_row: 自定义转换 (aid, parent, 原始评论, 视频信息) -> 评论字典，
+        除 comment_to_row 的列外还可以返回 update_columns 中的列
+    :param update_columns: 已存在的rpid要覆盖的 raw_comments 列（须先用 ALTER TABLE 加好）；
+        为空时已存在的rpid保持不变
+    :param cold: 冷存储，用于判断rpid是否已归档；默认使用 db 对应的 CommentArchive
+    """
+    db = db or CommentDatabase()
+    cold = cold or CommentArchive(db)
+    conn = get_raw_connection(db.db_file)
+    video_info = {
+        aid: {"category": category, "is_hot": bool(is_hot)}
+        for aid, category, is_hot in conn.execute(
+            "SELECT aid, category, is_hot FROM video_info"
+        )
+    }
+    to_row = to_row or (
+        lambda aid, parent, reply, info: BilibiliCommentCrawler.to_comment_data(aid, reply, info, parent=parent)
+    )
+
+    # comment_to_row 的列之后追加新列，冲突时覆盖 update_columns
+    base_columns = ["rpid", "aid", "comment", "ctime", "category", "is_hot", "parent"]
+    table_columns = {row[1] for row in conn.execute("PRAGMA table_info(raw_comments)")}
+    unknown = [column for column in update_columns if column not in table_columns or column == "rpid"]
+    if unknown:
+        raise ValueError(f"raw_comments has no updatable column(s): {', '.join(unknown)}")
+    extra_columns = [column for column in update_columns if column not in base_columns]
+    columns = base_columns + extra_columns
+    if update_columns:
+        upsert_sql = f'''
+            INSERT INTO raw_comments ({', '.join(columns)})
+            VALUES ({', '.join('?' * len(columns))})
+            ON CONFLICT(rpid) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in update_columns)}
+        '''
+
+    def save(rows: List[Dict]) -> int:
+        archived = cold.filter_archived_rpids(row["rpid"] for row in rows)
+        rows = [row for row in rows if row["rpid"] not in archived]
+        if not rows:
+            return 0
+        if not update_columns:
+            db.save_comments_batch(rows)
+            return len(rows)
+        conn.executemany(upsert_sql, [
+            db.comment_to_row(row) + tuple(row.get(column) for column in extra_columns) for row in rows
+        ])
+        conn.commit()
+        print(f"Upsert {len(rows)} comments ({', '.join(update_columns)})")
+        return len(rows)
+
+    batch = []
+    total = 0
+    for aid, parent, reply in archive.iter_replies(day):
+        row = to_row(aid, parent, reply, video_info.get(aid, {}))
+        if not row.get("rpid") or not row.get("comment"):
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            total += save(batch)
+            batch = []
+    if batch:
+        total += save(batch)
+    return total
+
+
+if __name__ == "__main__":
+    count = rebuild_raw_comments(ResponseArchive())
+    print(f"Rebuilt {count} comments from archived responses")
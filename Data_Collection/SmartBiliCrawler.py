@@ -1,17 +1,23 @@
 # BiliCrawler.py
 import asyncio
+import contextlib
 import random
 import json
 import httpx
 import hashlib
+import math
 import os
 import time
 import pickle
+import threading
 from datetime import datetime
-from typing import Any, Iterable, List, Dict, Optional, Tuple, Generator
+from typing import Any, Iterable, List, Dict, Optional, Sequence, Tuple, Generator
 from urllib.parse import urlencode
 from playwright.async_api import async_playwright, BrowserContext, Page
 import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from Data_Collection.CrawlTelemetry import CrawlTelemetry, PHASE_BROWSER_RESTART, PHASE_DB_WRITE, PHASE_SIGN
 
 def ensure_dir_exists(path: str):
     """确保目录存在，不存在则创建"""
@@ -22,6 +28,8 @@ def ensure_dir_exists(path: str):
 BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # 数据库文件路径
 DB_FILE = os.path.join(BASEDIR, "Database", "raw_bilibili_comments.db")
+# API地址，可通过环境变量指向本地模拟服务器（见 FakeBiliServer.py）
+API_HOST = os.environ.get("BILIBILI_API_HOST", "https://api.bilibili.com")
 
 # 工具函数
 def get_user_agent() -> str:
@@ -37,8 +45,255 @@ def get_unix_timestamp() -> int:
     """获取当前Unix时间戳"""
     return int(datetime.now().timestamp())
 
+class TokenBucketLimiter:
+    """全局令牌桶限速器：所有共享它的请求合计不超过每秒 rate 个"""
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        :param rate: 每秒请求数上限
+        :param burst: 允许的最大突发请求数
+        """
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """在接下来的 seconds 秒内不发放令牌"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """取得一个令牌，没有令牌时等待"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# 表示请求过快或触发风控的API错误码
+THROTTLE_CODES = {-352, -412, -509, -799}
+
+class AdaptiveRateLimiter(TokenBucketLimiter):
+    """
+    AIMD自适应限速器：响应正常时线性提高速率，
+    遇到限流错误码、HTTP错误或非JSON响应时速率减半并暂停一段时间。
+    学到的速率保存在 state_file 中，下次运行从该速率开始
+    """
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float = 0.2,
+        max_rate: float = 3.0,
+        increase_step: float = 0.02,
+        decrease_factor: float = 0.5,
+        cooldown: float = 5.0,
+        state_file: Optional[str] = None,
+        burst: int = 1,
+    ):
+        """
+        :param rate: 没有保存的速率时使用的初始速率
+        :param min_rate / max_rate: 速率上下限
+        :param increase_step: 每个正常响应增加的速率
+        :param decrease_factor: 出错时速率乘以该系数
+        :param cooldown: 出错后暂停的秒数
+        :param state_file: 保存速率的JSON文件
+        """
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.state_file = state_file
+        self.backoff_until = 0.0  # 上次降速后的冷却期结束时间
+        super().__init__(self.load_rate(rate), burst)
+
+    def load_rate(self, default_rate: float) -> float:
+        """读取上次保存的速率"""
+        rate = default_rate
+        if self.state_file and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, "r") as f:
+                    rate = json.load(f).get("rate", default_rate)
+                print(f"Loaded request rate {rate:.2f}/s from {self.state_file}")
+            except (OSError, ValueError) as e:
+                print(f"Failed to load request rate: {e}")
+        return min(self.max_rate, max(self.min_rate, rate))
+
+    def save(self):
+        """保存当前速率"""
+        if not self.state_file:
+            return
+        try:
+            ensure_dir_exists(self.state_file)
+            with open(self.state_file, "w") as f:
+                json.dump({"rate": self.rate, "updated": time.time()}, f)
+        except OSError as e:
+            print(f"Failed to save request rate: {e}")
+
+    def on_success(self):
+        """加性增：响应正常时提高速率"""
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_backoff(self, reason: str):
+        """乘性减：速率减半并暂停；冷却期内其他出错的响应（并发请求同时被限流）不再重复降速"""
+        now = time.monotonic()
+        if now < self.backoff_until:
+            return
+        self.backoff_until = now + self.cooldown
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.pause(self.cooldown)
+        print(f"Backing off ({reason}): request rate lowered to {self.rate:.2f}/s")
+        self.save()
+
+    async def observe(self, response: httpx.Response):
+        """httpx响应钩子：根据状态码、内容类型和API错误码调整速率"""
+        if response.status_code != 200:
+            self.on_backoff(f"HTTP {response.status_code}")
+            return
+        if "json" not in response.headers.get("content-type", ""):
+            self.on_backoff("non-JSON response")
+            return
+
+        await response.aread()
+        try:
+            code = response.json().get("code")
+        except ValueError:
+            self.on_backoff("invalid JSON")
+            return
+
+        if code in THROTTLE_CODES:
+            self.on_backoff(f"API code {code}")
+        else:
+            self.on_success()
+
+def retry_delay(rate_limiter: Optional[TokenBucketLimiter], retry_count: int, throttled: bool = False) -> float:
+    """
+    失败重试前的等待秒数：自适应限速器的响应钩子已对该响应降速并暂停时（throttled）不再等待，
+    其余失败（传输错误、超时、非限流的API错误，钩子看不到或不处理）指数退避
+    """
+    if throttled and isinstance(rate_limiter, AdaptiveRateLimiter):
+        return 0.0
+    return 2 ** retry_count + random.uniform(0, 1)
+
+def is_throttle_error(error: Exception) -> bool:
+    """
+    该错误对应的响应是否已由 AdaptiveRateLimiter.observe 处理：限流错误码，
+    或HTTP错误、非JSON响应导致的解析失败（这类 DataFetchError 没有错误码）
+    """
+    return isinstance(error, DataFetchError) and (error.code is None or error.code in THROTTLE_CODES)
+
+def create_http_client(
+    proxy: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: float = 30.0,
+    rate_limiter: Optional[TokenBucketLimiter] = None,
+) -> httpx.AsyncClient:
+    """
+    创建共享的连接池HTTP客户端：保持长连接，限制连接数，安装了h2时启用HTTP/2
+    由爬虫生命周期持有，在close()中关闭
+    :param rate_limiter: 全局限速器，经该客户端发出的每个请求都先取得令牌
+    """
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+
+    event_hooks = {}
+    if rate_limiter is not None:
+        async def wait_for_token(request: httpx.Request):
+            await rate_limiter.acquire()
+        event_hooks["request"] = [wait_for_token]
+    if isinstance(rate_limiter, AdaptiveRateLimiter):
+        event_hooks["response"] = [rate_limiter.observe]
+
+    return httpx.AsyncClient(
+        proxy=proxy,
+        headers=headers,
+        timeout=timeout,
+        http2=http2,
+        event_hooks=event_hooks,
+        limits=httpx.Limits(
+            max_connections=20,
+            max_keepalive_connections=10,
+            keepalive_expiry=60.0,
+        ),
+    )
+
 class DataFetchError(Exception):
     """数据获取错误异常"""
+    def __init__(self, message: str = "", code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code  # B站API返回的错误码，非API错误时为None
+
+class DataWriteError(Exception):
+    """写入队列中有批次未能落盘"""
+
+# 原始评论数据库连接管理
+RAW_DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",       # 读写并发：读者不阻塞爬虫写入
+    "PRAGMA synchronous=NORMAL",     # WAL模式下只在checkpoint时fsync
+    "PRAGMA cache_size=-65536",      # 64MB页缓存
+    "PRAGMA mmap_size=268435456",    # 256MB内存映射读取
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=30000",
+)
+
+_raw_db_local = threading.local()
+
+def get_raw_connection(db_file: str = DB_FILE) -> sqlite3.Connection:
+    """
+    获取当前线程/进程的原始数据库长连接，不存在则创建
+    连接开启WAL并缓存预编译语句，调用方不应关闭它
+    """
+    pid = os.getpid()
+    # fork出的子进程不能复用父进程的连接
+    if getattr(_raw_db_local, "pid", None) != pid:
+        _raw_db_local.pid = pid
+        _raw_db_local.connections = {}
+
+    conn = _raw_db_local.connections.get(db_file)
+    if conn is None:
+        ensure_dir_exists(db_file)
+        conn = sqlite3.connect(db_file, timeout=30, cached_statements=256)
+        for pragma in RAW_DB_PRAGMAS:
+            conn.execute(pragma)
+        _raw_db_local.connections[db_file] = conn
+    return conn
+
+# 一次 IN 查询中的参数个数
+EXISTS_CHUNK_SIZE = 500
+
+def filter_existing_keys(db_file: str, table: str, column: str, keys: Iterable[int]) -> set:
+    """返回 keys 中已存在于 table.column 的值；按块用主键/索引上的 IN 查询，不加载整张表"""
+    keys = list(dict.fromkeys(int(key) for key in keys))
+    conn = get_raw_connection(db_file)
+    found = set()
+    for start in range(0, len(keys), EXISTS_CHUNK_SIZE):
+        chunk = keys[start:start + EXISTS_CHUNK_SIZE]
+        rows = conn.execute(
+            f"SELECT {column} FROM {table} WHERE {column} IN ({','.join('?' * len(chunk))})", chunk
+        ).fetchall()
+        found.update(row[0] for row in rows)
+    return found
+
+def close_raw_connections():
+    """关闭当前线程持有的所有原始数据库连接"""
+    connections = getattr(_raw_db_local, "connections", None) or {}
+    for conn in connections.values():
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Error while closing database connection: {e}")
+    connections.clear()
 
 # 签名帮助类
 class BilibiliSign:
@@ -52,11 +307,15 @@ class BilibiliSign:
             36, 20, 34, 44, 52
         ]
 
+        self._salt: Optional[str] = None
+
     def get_salt(self) -> str:
-        """获取加盐的key"""
-        mixin_key = self.img_key + self.sub_key
-        salt = ''.join(mixin_key[i] for i in self.map_table)
-        return salt[:32]
+        """获取加盐的key（只计算一次）"""
+        if self._salt is None:
+            mixin_key = self.img_key + self.sub_key
+            salt = ''.join(mixin_key[i] for i in self.map_table)
+            self._salt = salt[:32]
+        return self._salt
 
     def sign(self, req_data: Dict) -> Dict:
         """请求参数签名"""
@@ -129,66 +388,618 @@ class BilibiliLogin:
         
         raise TimeoutError("登录超时")
 
-# 爬虫状态管理器
+# rpid布隆过滤器：内存中的快速去重，判定不存在则一定不存在
+class RpidBloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+        :param capacity: 预计元素数量
+        :param error_rate: 目标误判率
+        """
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.count = 0  # 已加入的rpid数（含重复），超过容量后误判率上升
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, rpid: int):
+        # 双重哈希：由两个64位混合值生成 hash_count 个位置
+        h1 = (rpid * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        h2 = ((rpid ^ (rpid >> 31)) * 0xBF58476D1CE4E5B9 & 0xFFFFFFFFFFFFFFFF) | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, rpid: int):
+        self.count += 1
+        for pos in self._positions(rpid):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, rpid: int) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(rpid))
+
+# 进程内共享的rpid布隆过滤器，每个数据库只全量构建一次：db_file -> (过滤器, 已加入的最大写入序号)
+_rpid_filters: Dict[str, Tuple[RpidBloomFilter, int]] = {}
+
+# 爬虫状态管理器：进度保存在原始数据库的 crawl_progress 表，rpid去重依赖 raw_comments 主键
 class CrawlerStateManager:
-    def __init__(self, state_file: str):
-        self.state_file = state_file
-        ensure_dir_exists(state_file)
-        self.state = self.load_state()
-        
-        # 初始化全局rpid集合
-        self.global_rpid_set = self.state.get("global_rpid_set", set())
-        
-    def load_state(self):
-        """加载爬虫状态"""
-        if os.path.exists(self.state_file):
-            try:
-                with open(self.state_file, "rb") as f:
-                    return pickle.load(f)
-            except Exception as e:
-                print(f"Load crawler status: {str(e)}")
-        return {
-            "global_rpid_set": set(),
-            "video_progress": {}
-        }
-    
-    def save_state(self):
-        """保存爬虫状态"""
-        self.state["global_rpid_set"] = self.global_rpid_set
+    def __init__(self, db_file: str = DB_FILE, legacy_state_file: Optional[str] = None):
+        """
+        :param db_file: 原始评论数据库
+        :param legacy_state_file: 旧版pickle状态文件，存在时把其中的视频进度迁移到数据库
+        """
+        self.db_file = db_file
+        conn = get_raw_connection(db_file)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_progress (
+                aid INTEGER PRIMARY KEY,
+                next_page INTEGER DEFAULT 0,
+                comment_count INTEGER DEFAULT 0,
+                last_updated REAL DEFAULT 0,
+                newest_ctime INTEGER DEFAULT 0,
+                velocity REAL,
+                last_recrawl REAL DEFAULT 0,
+                recrawl_page INTEGER,
+                recrawl_newest INTEGER DEFAULT 0
+            )
+        ''')
+        # 旧表补充回访所需的列：最新评论时间水位线、评论速度（条/小时）、上次回访时间，
+        # 以及未回访到水位线时的续爬位置（按时间排序的页码，NULL 表示没有）和已见到的最新评论时间
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(crawl_progress)")}
+        for column, definition in (
+            ("newest_ctime", "INTEGER DEFAULT 0"),
+            ("velocity", "REAL"),
+            ("last_recrawl", "REAL DEFAULT 0"),
+            ("recrawl_page", "INTEGER"),
+            ("recrawl_newest", "INTEGER DEFAULT 0"),
+        ):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE crawl_progress ADD COLUMN {column} {definition}")
+        conn.commit()
+
+        if legacy_state_file and os.path.exists(legacy_state_file):
+            self.migrate_legacy_state(legacy_state_file)
+
+        # 布隆过滤器在进程内共享，只在首次创建时扫描全部rpid
+        self.rpid_filter = self.build_rpid_filter()
+
+    def migrate_legacy_state(self, state_file: str):
+        """把旧版pickle中的视频进度导入数据库，并将旧文件改名保留"""
         try:
-            with open(self.state_file, "wb") as f:
-                pickle.dump(self.state, f)
+            with open(state_file, "rb") as f:
+                state = pickle.load(f)
         except Exception as e:
-            print(f"Fail to save crawler status: {str(e)}")
+            print(f"Load crawler status: {str(e)}")
+            return
+
+        rows = [
+            (int(aid), p.get("next_page", 0), p.get("comment_count", 0), p.get("last_updated", 0))
+            for aid, p in state.get("video_progress", {}).items()
+        ]
+        conn = get_raw_connection(self.db_file)
+        conn.executemany('''
+            INSERT OR IGNORE INTO crawl_progress (aid, next_page, comment_count, last_updated)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+        os.replace(state_file, state_file + ".migrated")
+        print(f"Migrated progress of {len(rows)} videos from {state_file}")
+
+    def build_rpid_filter(self) -> RpidBloomFilter:
+        """
+        获取本进程共享的布隆过滤器：首次调用时扫描 raw_comments 构建，之后按写入序号
+        (raw_comments_ingest) 只补充上次以来新入库的rpid，包括其他连接和进程写入的评论。
+        加入的rpid超过容量时重新全量构建
+        """
+        conn = get_raw_connection(self.db_file)
+        cached = _rpid_filters.get(self.db_file)
+        if cached is not None:
+            rpid_filter, last_seq = cached
+            rows = conn.execute(
+                "SELECT seq, rpid FROM raw_comments_ingest WHERE seq > ? ORDER BY seq", (last_seq,)
+            ).fetchall()
+            if rpid_filter.count + len(rows) <= rpid_filter.capacity:
+                for _, rpid in rows:
+                    rpid_filter.add(rpid)
+                if rows:
+                    _rpid_filters[self.db_file] = (rpid_filter, rows[-1][0])
+                return rpid_filter
+
+        # 先取序号再扫描：扫描期间新写入的rpid下次会再加入一次，重复加入无害
+        last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM raw_comments_ingest").fetchone()[0]
+        count = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM raw_comments) + (SELECT COUNT(*) FROM archived_rpids)"
+        ).fetchone()[0]
+        # 预留增长空间，避免本次爬取中误判率上升
+        rpid_filter = RpidBloomFilter(capacity=max(count * 2, 100000))
+        # 已归档的rpid也视为已存在
+        cursor = conn.execute("SELECT rpid FROM raw_comments UNION ALL SELECT rpid FROM archived_rpids")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for (rpid,) in rows:
+                rpid_filter.add(rpid)
+        _rpid_filters[self.db_file] = (rpid_filter, last_seq)
+        return rpid_filter
+
+    def save_state(self):
+        """进度在每次更新时已写入数据库，这里只确保事务已提交"""
+        get_raw_connection(self.db_file).commit()
     
-    def update_video_progress(self, aid: str, next_page: int, comment_count: int):
-        """更新视频爬取进度"""
-        self.state["video_progress"][aid] = {
-            "next_page": next_page,
-            "comment_count": comment_count,
-            "last_updated": time.time()
-        }
-        self.save_state()
+    # 爬取进度的单行upsert；AsyncCommentWriter 用它把进度和对应页的评论写在同一个事务中
+    UPDATE_PROGRESS_SQL = '''
+        INSERT INTO crawl_progress (aid, next_page, comment_count, last_updated, newest_ctime)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(aid) DO UPDATE SET
+            next_page = excluded.next_page,
+            comment_count = excluded.comment_count,
+            last_updated = excluded.last_updated,
+            newest_ctime = MAX(crawl_progress.newest_ctime, excluded.newest_ctime)
+    '''
+
+    @staticmethod
+    def progress_row(aid: str, next_page: int, comment_count: int, newest_ctime: int = 0) -> Tuple:
+        """UPDATE_PROGRESS_SQL 的参数行"""
+        return int(aid), next_page, comment_count, time.time(), newest_ctime
+
+    def update_video_progress(self, aid: str, next_page: int, comment_count: int, newest_ctime: int = 0):
+        """更新视频爬取进度（单行增量写入），newest_ctime 只会增大"""
+        conn = get_raw_connection(self.db_file)
+        conn.execute(self.UPDATE_PROGRESS_SQL, self.progress_row(aid, next_page, comment_count, newest_ctime))
+        conn.commit()
+
+    def get_newest_ctime(self, aid: str) -> int:
+        """该视频已爬到的最新评论时间；旧记录没有水位线时取 raw_comments 中的最大值"""
+        conn = get_raw_connection(self.db_file)
+        row = conn.execute("SELECT newest_ctime FROM crawl_progress WHERE aid = ?", (int(aid),)).fetchone()
+        if row and row[0]:
+            return row[0]
+        row = conn.execute("SELECT MAX(ctime) FROM raw_comments WHERE aid = ?", (int(aid),)).fetchone()
+        return row[0] or 0
+
+    def get_recrawl_cursor(self, aid: str) -> Tuple[Optional[int], int]:
+        """上次回访未到达水位线时保存的 (续爬页码, 已见到的最新评论时间)，没有时页码为None"""
+        row = get_raw_connection(self.db_file).execute(
+            "SELECT recrawl_page, recrawl_newest FROM crawl_progress WHERE aid = ?", (int(aid),)
+        ).fetchone()
+        if row is None:
+            return None, 0
+        return row[0], row[1] or 0
+
+    def record_recrawl(self, aid: str, newest_ctime: int, new_count: int, resume_page: Optional[int] = None):
+        """
+        记录一次回访，并以新增评论数除以距上次回访（首次回访时为距原水位线）的小时数更新评论速度
+        :param resume_page: 回访在到达水位线前因数量上限停止时的续爬页码。此时不推进水位线
+            （水位线与已爬页之间的评论还没有获取），只保存续爬位置和见到的最新评论时间；
+            为None表示已到达水位线或最后一页，推进水位线并清除续爬位置
+        """
+        conn = get_raw_connection(self.db_file)
+        now = time.time()
+        row = conn.execute(
+            "SELECT newest_ctime, last_recrawl FROM crawl_progress WHERE aid = ?", (int(aid),)
+        ).fetchone()
+        since = (row[1] or row[0]) if row else 0
+        hours = max(1.0, (now - since) / 3600) if since else 1.0
+        if resume_page is None:
+            conn.execute('''
+                INSERT INTO crawl_progress (aid, newest_ctime, velocity, last_recrawl)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(aid) DO UPDATE SET
+                    newest_ctime = MAX(crawl_progress.newest_ctime, excluded.newest_ctime),
+                    velocity = excluded.velocity,
+                    last_recrawl = excluded.last_recrawl,
+                    recrawl_page = NULL,
+                    recrawl_newest = 0
+            ''', (int(aid), newest_ctime, new_count / hours, now))
+        else:
+            conn.execute('''
+                INSERT INTO crawl_progress (aid, velocity, last_recrawl, recrawl_page, recrawl_newest)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(aid) DO UPDATE SET
+                    velocity = excluded.velocity,
+                    last_recrawl = excluded.last_recrawl,
+                    recrawl_page = excluded.recrawl_page,
+                    recrawl_newest = MAX(crawl_progress.recrawl_newest, excluded.recrawl_newest)
+            ''', (int(aid), new_count / hours, now, resume_page, newest_ctime))
+        conn.commit()
+
+    def get_recrawl_candidates(
+        self,
+        limit: int = 50,
+        min_interval: float = 6 * 3600,
+        velocity_window: int = 3 * 86400,
+    ) -> List[Tuple[int, str, float]]:
+        """
+        选出需要回访的热门视频，按近期评论速度从高到低排序
+        尚未回访过的视频用 velocity_window 内的评论数估计速度
+        :param min_interval: 两次回访的最小间隔（秒）
+        :return: [(aid, category, 速度), ...]
+        """
+        now = time.time()
+        window_hours = velocity_window / 3600
+        return get_raw_connection(self.db_file).execute('''
+            SELECT p.aid, v.category,
+                   COALESCE(p.velocity, (
+                       SELECT COUNT(*) FROM raw_comments r
+                       WHERE r.aid = p.aid AND r.ctime > ?
+                   ) / ?) AS velocity
+            FROM crawl_progress p
+            JOIN video_info v ON v.aid = p.aid
+            WHERE v.is_hot = 1 AND p.last_recrawl < ?
+            ORDER BY velocity DESC
+            LIMIT ?
+        ''', (int(now - velocity_window), window_hours, now - min_interval, limit)).fetchall()
     
     def get_video_progress(self, aid: str) -> dict:
         """获取视频爬取进度"""
-        return self.state["video_progress"].get(aid, {
-            "next_page": 0,
-            "comment_count": 0,
-            "last_updated": 0
-        })
+        row = get_raw_connection(self.db_file).execute(
+            "SELECT next_page, comment_count, last_updated FROM crawl_progress WHERE aid = ?",
+            (int(aid),)
+        ).fetchone()
+        if row is None:
+            return {
+                "next_page": 0,
+                "comment_count": 0,
+                "last_updated": 0
+            }
+        return {
+            "next_page": row[0],
+            "comment_count": row[1],
+            "last_updated": row[2]
+        }
     
     def add_rpid(self, rpid: int):
-        """添加rpid到全局集合"""
-        if rpid not in self.global_rpid_set:
-            self.global_rpid_set.add(rpid)
-            # 每添加100个rpid保存一次状态
-            if len(self.global_rpid_set) % 100 == 0:
-                self.save_state()
+        """记录已爬取的rpid（评论本身由 raw_comments 主键去重）"""
+        self.rpid_filter.add(rpid)
     
     def is_rpid_exists(self, rpid: int) -> bool:
-        """检查rpid是否已存在"""
-        return rpid in self.global_rpid_set
+        """
+        检查rpid是否已存在（在热数据中或已移入冷存储）：
+        布隆过滤器判定不存在即返回，可能存在时再查主键
+        """
+        if rpid not in self.rpid_filter:
+            return False
+        row = get_raw_connection(self.db_file).execute('''
+            SELECT EXISTS (SELECT 1 FROM raw_comments WHERE rpid = ?)
+                OR EXISTS (SELECT 1 FROM archived_rpids WHERE rpid = ?)
+        ''', (rpid, rpid)).fetchone()
+        return bool(row[0])
+
+# 采集会话日志：crawl_strategically 中断后从未完成的视频继续，评论翻页位置仍由 crawl_progress 记录
+class CrawlSessionJournal:
+    # 视频状态：已计划 -> 已获取详情（保存了 video_info，恢复时不再查询）-> 完成 / 失败
+    PENDING = "pending"
+    DETAIL = "detail"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, db_file: str = DB_FILE):
+        self.db_file = db_file
+        conn = get_raw_connection(db_file)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_sessions (
+                session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                target INTEGER NOT NULL,
+                collected INTEGER DEFAULT 0,
+                started_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finished_at REAL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_session_videos (
+                session_id INTEGER NOT NULL,
+                aid INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                category VARCHAR(50),
+                is_hot BOOLEAN DEFAULT FALSE,
+                status TEXT NOT NULL,
+                video_info TEXT,
+                PRIMARY KEY (session_id, aid)
+            )
+        ''')
+        conn.commit()
+
+    def start_session(self, target: int) -> int:
+        """开始新会话，返回会话ID"""
+        conn = get_raw_connection(self.db_file)
+        now = time.time()
+        cursor = conn.execute(
+            "INSERT INTO crawl_sessions (target, started_at, updated_at) VALUES (?, ?, ?)",
+            (target, now, now)
+        )
+        conn.commit()
+        return cursor.lastrowid
+
+    def get_unfinished_session(self) -> Optional[Tuple[int, int, int]]:
+        """最近一个未结束的会话 (会话ID, 目标视频数, 已完成视频数)，没有则返回None"""
+        return get_raw_connection(self.db_file).execute('''
+            SELECT session_id, target, collected FROM crawl_sessions
+            WHERE finished_at IS NULL
+            ORDER BY session_id DESC LIMIT 1
+        ''').fetchone()
+
+    def finish_session(self, session_id: int):
+        conn = get_raw_connection(self.db_file)
+        now = time.time()
+        conn.execute(
+            "UPDATE crawl_sessions SET finished_at = ?, updated_at = ? WHERE session_id = ?",
+            (now, now, session_id)
+        )
+        conn.commit()
+
+    def plan_videos(self, session_id: int, category: str, videos: List[Tuple[int, bool]]):
+        """记录一批计划处理的视频 [(aid, is_hot), ...]"""
+        conn = get_raw_connection(self.db_file)
+        seq = conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM crawl_session_videos WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+        conn.executemany('''
+            INSERT OR IGNORE INTO crawl_session_videos (session_id, aid, seq, category, is_hot, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            (session_id, int(aid), seq + i, category, is_hot, self.PENDING)
+            for i, (aid, is_hot) in enumerate(videos, 1)
+        ])
+        conn.commit()
+
+    def record_detail(self, session_id: int, aid: int, video_info: Dict):
+        self._set_status(session_id, aid, self.DETAIL, json.dumps(video_info, ensure_ascii=False))
+
+    def mark_failed(self, session_id: int, aid: int):
+        self._set_status(session_id, aid, self.FAILED)
+
+    def mark_done(self, session_id: int, aid: int):
+        """视频处理完成，同时增加会话的已完成数"""
+        conn = get_raw_connection(self.db_file)
+        conn.execute(
+            "UPDATE crawl_session_videos SET status = ? WHERE session_id = ? AND aid = ?",
+            (self.DONE, session_id, int(aid))
+        )
+        conn.execute(
+            "UPDATE crawl_sessions SET collected = collected + 1, updated_at = ? WHERE session_id = ?",
+            (time.time(), session_id)
+        )
+        conn.commit()
+
+    def _set_status(self, session_id: int, aid: int, status: str, video_info: Optional[str] = None):
+        conn = get_raw_connection(self.db_file)
+        conn.execute('''
+            UPDATE crawl_session_videos SET status = ?, video_info = COALESCE(?, video_info)
+            WHERE session_id = ? AND aid = ?
+        ''', (status, video_info, session_id, int(aid)))
+        conn.commit()
+
+    def get_unfinished_videos(self, session_id: int) -> List[Tuple[int, str, bool, Optional[Dict]]]:
+        """
+        会话中尚未完成的视频，按计划顺序
+        :return: [(aid, 计划分区, is_hot, 已获取的 video_info 或 None), ...]
+        """
+        rows = get_raw_connection(self.db_file).execute('''
+            SELECT aid, category, is_hot, video_info FROM crawl_session_videos
+            WHERE session_id = ? AND status IN (?, ?)
+            ORDER BY seq
+        ''', (session_id, self.PENDING, self.DETAIL)).fetchall()
+        return [
+            (aid, category, bool(is_hot), json.loads(video_info) if video_info else None)
+            for aid, category, is_hot, video_info in rows
+        ]
+
+    def get_planned_aids(self, session_id: int) -> set:
+        """会话中已计划过的全部aid（包括失败的），新批次不再重复选择"""
+        rows = get_raw_connection(self.db_file).execute(
+            "SELECT aid FROM crawl_session_videos WHERE session_id = ?", (session_id,)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+# 分布式采集任务队列：多个采集进程以租约认领视频，租约到期未续约（进程退出）的任务可被重新认领
+class CrawlJobQueue:
+    QUEUED = "queued"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, db_file: str = DB_FILE, lease_seconds: float = 300.0, max_attempts: int = 3):
+        """
+        :param db_file: 原始评论数据库，任务表与评论在同一个库中
+        :param lease_seconds: 租约时长，worker 需在到期前发送心跳续约
+        :param max_attempts: 每个视频最多认领的次数，超过后标记为失败
+        """
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        conn = get_raw_connection(db_file)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_jobs (
+                aid INTEGER PRIMARY KEY,
+                category VARCHAR(50),
+                is_hot BOOLEAN DEFAULT FALSE,
+                status TEXT NOT NULL,
+                worker TEXT,
+                attempts INTEGER DEFAULT 0,
+                lease_expires REAL DEFAULT 0,
+                heartbeat REAL DEFAULT 0,
+                comments INTEGER DEFAULT 0,
+                last_error TEXT,
+                enqueued_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_crawl_jobs_status ON crawl_jobs(status, enqueued_at)')
+        # 队列开关：协调进程停止入队后关闭，worker 处理完剩余任务即退出
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_queue_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        conn.commit()
+
+    def enqueue(self, videos: List[Tuple[int, str, bool]]) -> int:
+        """加入任务 [(aid, 计划分区, is_hot), ...]，已在队列中的aid忽略，返回新加入的数量"""
+        conn = get_raw_connection(self.db_file)
+        now = time.time()
+        cursor = conn.executemany('''
+            INSERT OR IGNORE INTO crawl_jobs (aid, category, is_hot, status, enqueued_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(int(aid), category, is_hot, self.QUEUED, now, now) for aid, category, is_hot in videos])
+        conn.commit()
+        return cursor.rowcount
+
+    def claim(self, worker: str, limit: int = 1) -> List[Tuple[int, str, bool]]:
+        """原子地认领最多 limit 个排队中或租约已过期的任务，返回 [(aid, 计划分区, is_hot), ...]"""
+        conn = get_raw_connection(self.db_file)
+        now = time.time()
+        # 租约过期且次数已用完的任务不再重试
+        conn.execute('''
+            UPDATE crawl_jobs SET status = ?, last_error = COALESCE(last_error, 'lease expired'), updated_at = ?
+            WHERE status = ? AND lease_expires < ? AND attempts >= ?
+        ''', (self.FAILED, now, self.LEASED, now, self.max_attempts))
+        # 单条 UPDATE ... RETURNING 在写事务中完成选择和认领，多个进程不会认领到同一个任务
+        rows = conn.execute('''
+            UPDATE crawl_jobs
+            SET status = ?, worker = ?, attempts = attempts + 1,
+                lease_expires = ?, heartbeat = ?, updated_at = ?
+            WHERE aid IN (
+                SELECT aid FROM crawl_jobs
+                WHERE status = ? OR (status = ? AND lease_expires < ?)
+                ORDER BY enqueued_at
+                LIMIT ?
+            )
+            RETURNING aid, category, is_hot
+        ''', (self.LEASED, worker, now + self.lease_seconds, now, now,
+              self.QUEUED, self.LEASED, now, limit)).fetchall()
+        conn.commit()
+        return [(aid, category, bool(is_hot)) for aid, category, is_hot in rows]
+
+    def heartbeat(self, worker: str) -> int:
+        """续约该 worker 持有的全部任务，返回续约的任务数"""
+        conn = get_raw_connection(self.db_file)
+        now = time.time()
+        cursor = conn.execute('''
+            UPDATE crawl_jobs SET lease_expires = ?, heartbeat = ?
+            WHERE status = ? AND worker = ?
+        ''', (now + self.lease_seconds, now, self.LEASED, worker))
+        conn.commit()
+        return cursor.rowcount
+
+    def complete(self, aid: int, worker: str, comments: int = 0):
+        """标记任务完成；租约已被其他 worker 接管时不修改"""
+        conn = get_raw_connection(self.db_file)
+        conn.execute('''
+            UPDATE crawl_jobs SET status = ?, comments = ?, updated_at = ?
+            WHERE aid = ? AND worker = ? AND status = ?
+        ''', (self.DONE, comments, time.time(), int(aid), worker, self.LEASED))
+        conn.commit()
+
+    def fail(self, aid: int, worker: str, error: str):
+        """任务失败：还有重试次数时重新排队，否则标记为失败"""
+        conn = get_raw_connection(self.db_file)
+        conn.execute('''
+            UPDATE crawl_jobs
+            SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                last_error = ?, lease_expires = 0, updated_at = ?
+            WHERE aid = ? AND worker = ? AND status = ?
+        ''', (self.max_attempts, self.FAILED, self.QUEUED, error[:500], time.time(),
+              int(aid), worker, self.LEASED))
+        conn.commit()
+
+    def status_counts(self, since: float = 0) -> Dict[str, int]:
+        """
+        各状态的任务数
+        :param since: 已完成和失败的任务只统计该时间之后结束的（本次运行），排队中和已认领的任务全部统计
+        """
+        rows = get_raw_connection(self.db_file).execute('''
+            SELECT status, COUNT(*) FROM crawl_jobs
+            WHERE status IN (?, ?) OR updated_at >= ?
+            GROUP BY status
+        ''', (self.QUEUED, self.LEASED, since)).fetchall()
+        return dict(rows)
+
+    def outstanding_by_category(self) -> Dict[str, int]:
+        """排队中和已认领未完成的任务数，按计划分区"""
+        rows = get_raw_connection(self.db_file).execute(
+            "SELECT category, COUNT(*) FROM crawl_jobs WHERE status IN (?, ?) GROUP BY category",
+            (self.QUEUED, self.LEASED)
+        ).fetchall()
+        return dict(rows)
+
+    def completed_since(self, since: float) -> List[Tuple[int, str, int, float]]:
+        """在 since 之后完成的任务 [(aid, 计划分区, 评论数, 完成时间), ...]"""
+        return get_raw_connection(self.db_file).execute(
+            "SELECT aid, category, comments, updated_at FROM crawl_jobs WHERE status = ? AND updated_at > ?",
+            (self.DONE, since)
+        ).fetchall()
+
+    def filter_known_aids(self, aids: Iterable[int]) -> set:
+        """返回候选aid中已在队列中（任意状态）的部分"""
+        return filter_existing_keys(self.db_file, "crawl_jobs", "aid", aids)
+
+    def _set_closed(self, conn: sqlite3.Connection, closed: bool):
+        conn.execute(
+            "INSERT OR REPLACE INTO crawl_queue_meta (key, value) VALUES ('closed', ?)", ("1" if closed else "0",)
+        )
+
+    def open(self):
+        """打开队列并开始新一轮运行（运行编号加一）"""
+        conn = get_raw_connection(self.db_file)
+        conn.execute('''
+            INSERT INTO crawl_queue_meta (key, value) VALUES ('generation', '1')
+            ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+        ''')
+        self._set_closed(conn, False)
+        conn.commit()
+
+    def close(self):
+        conn = get_raw_connection(self.db_file)
+        self._set_closed(conn, True)
+        conn.commit()
+
+    def is_closed(self) -> bool:
+        row = get_raw_connection(self.db_file).execute(
+            "SELECT value FROM crawl_queue_meta WHERE key = 'closed'"
+        ).fetchone()
+        return row is not None and row[0] == "1"
+
+    def generation(self) -> int:
+        """最近一次打开队列的运行编号，从未打开过为0"""
+        row = get_raw_connection(self.db_file).execute(
+            "SELECT value FROM crawl_queue_meta WHERE key = 'generation'"
+        ).fetchone()
+        return int(row[0]) if row else 0
+
+    def current_run(self) -> int:
+        """
+        worker 启动时调用，返回它要服务的运行编号：队列已打开时为当前运行，
+        已关闭（上次运行留下的状态）或从未打开时为下一次打开的运行
+        """
+        generation = self.generation()
+        return generation + 1 if generation == 0 or self.is_closed() else generation
+
+    def is_drained(self, run: Optional[int] = None) -> bool:
+        """
+        队列已关闭且没有排队中或已认领的任务
+        :param run: current_run 返回的运行编号，设置时该运行打开之前的关闭状态不算
+        """
+        if run is not None and self.generation() < run:
+            return False
+        counts = self.status_counts()
+        return self.is_closed() and not counts.get(self.QUEUED) and not counts.get(self.LEASED)
+
+# 评论排序方式：0 默认（热度），2 按时间从新到旧
+COMMENT_MODE_DEFAULT = 0
+COMMENT_MODE_TIME = 2
+
+# 原始响应存档的类型（见 ResponseArchive.py）
+KIND_REPLY = "reply"            # /x/v2/reply/wbi/main 默认排序
+KIND_REPLY_TIME = "reply_time"  # /x/v2/reply/wbi/main 按时间排序
+KIND_SUB_REPLY = "sub_reply"    # /x/v2/reply/reply
+KIND_VIEW = "view"              # /x/web-interface/view
+
+# WBI签名密钥缓存时间（秒）
+WBI_KEY_TTL = 6 * 3600
+# 签名无效或被风控拒绝时的错误码
+WBI_REJECTED_CODES = {-352, -403}
 
 # B站客户端
 class BilibiliClient:
@@ -200,20 +1011,50 @@ class BilibiliClient:
         headers: Dict[str, str],
         playwright_page: Page,
         cookie_dict: Dict[str, str],
+        http_client: Optional[httpx.AsyncClient] = None,
+        api_host: str = API_HOST,
+        telemetry: Optional[CrawlTelemetry] = None,
     ):
+        """
+        :param http_client: 共享的连接池客户端，未提供时自行创建并在 aclose() 中关闭
+        :param api_host: API地址，测试时可指向本地模拟服务器
+        :param telemetry: 运行指标，设置后记录每个请求的延迟、状态码和签名耗时
+        """
         self.proxy = proxy
         self.timeout = timeout
         self.headers = headers
-        self._host = "https://api.bilibili.com"
+        self._host = api_host
         self.playwright_page = playwright_page
         self.cookie_dict = cookie_dict
+        self._owns_http_client = http_client is None
+        self.http_client = http_client or create_http_client(proxy=proxy, timeout=timeout)
+        self.telemetry = telemetry
+        if telemetry:
+            telemetry.install(self.http_client)
+
+        # WBI密钥约每天轮换一次，缓存签名器避免每次请求都访问浏览器
+        self.wbi_key_ttl = WBI_KEY_TTL
+        self._wbi_signer: Optional[BilibiliSign] = None
+        self._wbi_expire_at = 0.0
+        self._wbi_refresh_from_api = False
+        # 并发任务同时发现缓存失效时只由一个任务获取密钥，其余任务等待后复用
+        self._wbi_lock = asyncio.Lock()
+
+    async def aclose(self):
+        """关闭自行创建的HTTP客户端，共享客户端由其持有者关闭"""
+        if self._owns_http_client and not self.http_client.is_closed:
+            await self.http_client.aclose()
 
     async def request(self, method: str, url: str, **kwargs) -> Any:
         """发送HTTP请求"""
-        async with httpx.AsyncClient(proxy=self.proxy) as client:
-            response = await client.request(
+        try:
+            response = await self.http_client.request(
                 method, url, timeout=self.timeout, **kwargs
             )
+        except httpx.HTTPError as e:
+            if self.telemetry:
+                self.telemetry.observe_transport_error(CrawlTelemetry.endpoint(url), e)
+            raise
             
         try:
             data: Dict = response.json()
@@ -222,31 +1063,59 @@ class BilibiliClient:
             
         if data.get("code") != 0:
             error_msg = data.get("message", "unknown error")
-            raise DataFetchError(f"API error: {error_msg} (code: {data.get('code')})")
+            raise DataFetchError(f"API error: {error_msg} (code: {data.get('code')})", code=data.get("code"))
         return data.get("data", {})
 
     async def pre_request_data(self, req_data: Dict) -> Dict:
         """请求参数签名预处理"""
         if not req_data:
             return {}
-        img_key, sub_key = await self.get_wbi_keys()
-        return BilibiliSign(img_key, sub_key).sign(req_data)
-
-    async def get_wbi_keys(self) -> Tuple[str, str]:
-        """获取WBI签名密钥"""
-        # 从localStorage获取密钥
-        local_storage = await self.playwright_page.evaluate("() => window.localStorage")
-        wbi_img_urls = local_storage.get("wbi_img_urls", "")
+        if self.telemetry is None:
+            return (await self.get_wbi_signer()).sign(req_data)
+        with self.telemetry.timed(PHASE_SIGN):
+            return (await self.get_wbi_signer()).sign(req_data)
+
+    async def get_wbi_signer(self) -> BilibiliSign:
+        """获取缓存的签名器，过期或被清除后才重新获取密钥"""
+        if not self._wbi_signer_expired():
+            return self._wbi_signer
+        async with self._wbi_lock:
+            # 等锁期间其他任务可能已经刷新过密钥
+            if self._wbi_signer_expired():
+                img_key, sub_key = await self.get_wbi_keys(prefer_api=self._wbi_refresh_from_api)
+                self._wbi_signer = BilibiliSign(img_key, sub_key)
+                self._wbi_expire_at = time.time() + self.wbi_key_ttl
+                self._wbi_refresh_from_api = False
+            return self._wbi_signer
+
+    def _wbi_signer_expired(self) -> bool:
+        return self._wbi_signer is None or time.time() >= self._wbi_expire_at
+
+    def invalidate_wbi_keys(self):
+        """签名被拒绝时清除缓存，下次签名前从API重新获取密钥"""
+        self._wbi_signer = None
+        self._wbi_refresh_from_api = True
+
+    async def get_wbi_keys(self, prefer_api: bool = False) -> Tuple[str, str]:
+        """
+        获取WBI签名密钥
+        :param prefer_api: 跳过localStorage，直接从nav接口获取（localStorage中的密钥可能已过期）
+        """
+        wbi_img_urls = ""
+        if not prefer_api and self.playwright_page is not None:
+            # 从localStorage获取密钥
+            local_storage = await self.playwright_page.evaluate("() => window.localStorage")
+            wbi_img_urls = local_storage.get("wbi_img_urls", "")
         
         if wbi_img_urls and "-" in wbi_img_urls:
             img_url, sub_url = wbi_img_urls.split("-")
         else:
             # 从API获取密钥
             try:
-                resp = await self.request("GET", self._host + "/x/web-interface/nav")
+                resp = await self.request("GET", self._host + "/x/web-interface/nav", headers=self.headers)
                 img_url: str = resp['wbi_img']['img_url']
                 sub_url: str = resp['wbi_img']['sub_url']
-            except DataFetchError as e:
+            except (DataFetchError, KeyError) as e:
                 # 如果API请求失败，使用默认密钥
                 img_url = "https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png"
                 sub_url = "https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png"
@@ -255,13 +1124,8 @@ class BilibiliClient:
         sub_key = sub_url.rsplit('/', 1)[1].split('.')[0]
         return img_key, sub_key
 
-    async def get(self, uri: str, params: Optional[Dict] = None, 
-                 enable_params_sign: bool = True) -> Dict:
-        """发送GET请求"""
+    async def _get(self, uri: str, params: Optional[Dict]) -> Dict:
         final_uri = uri
-        if enable_params_sign and params:
-            params = await self.pre_request_data(params)
-        
         if params:
             final_uri = f"{uri}?{urlencode(params)}"
             
@@ -269,6 +1133,22 @@ class BilibiliClient:
             "GET", f"{self._host}{final_uri}", headers=self.headers
         )
 
+    async def get(self, uri: str, params: Optional[Dict] = None, 
+                 enable_params_sign: bool = True) -> Dict:
+        """发送GET请求"""
+        if not (enable_params_sign and params):
+            return await self._get(uri, params)
+
+        try:
+            return await self._get(uri, await self.pre_request_data(dict(params)))
+        except DataFetchError as e:
+            if e.code not in WBI_REJECTED_CODES:
+                raise
+            # 签名被拒绝，密钥可能已轮换：刷新密钥后重试一次
+            print(f"WBI signature rejected (code: {e.code}), refreshing keys...")
+            self.invalidate_wbi_keys()
+            return await self._get(uri, await self.pre_request_data(dict(params)))
+
     async def pong(self) -> bool:
         """
         检查登录状态
@@ -286,8 +1166,9 @@ class BilibiliClient:
         self,
         video_id: str,
         next_page: int = 0,
+        mode: int = COMMENT_MODE_DEFAULT,
     ) -> Dict:
-        """获取视频评论"""
+        """获取视频评论，mode 为 COMMENT_MODE_TIME 时按时间从新到旧"""
         uri = "/x/v2/reply/wbi/main"
         # 确保video_id是整数类型
         try:
@@ -297,27 +1178,48 @@ class BilibiliClient:
             
         post_data = {
             "oid": video_id_int,  # 使用整数类型的aid
-            "mode": 0,  # 默认排序
+            "mode": mode,
             "type": 1, 
             "ps": 20, 
             "next": next_page
         }
         return await self.get(uri, post_data)
 
+    async def get_sub_comments(self, video_id: str, root: int, page: int = 1, page_size: int = 20) -> Dict:
+        """获取某条评论下的楼中楼回复（页码从1开始）"""
+        params = {
+            "oid": int(video_id),
+            "type": 1,
+            "root": root,
+            "ps": page_size,
+            "pn": page,
+        }
+        return await self.get("/x/v2/reply/reply", params, enable_params_sign=False)
+
 # 数据库操作类
 class CommentDatabase:
-    def __init__(self, db_file: str = DB_FILE):
+    def __init__(self, db_file: str = DB_FILE, telemetry: Optional[CrawlTelemetry] = None):
+        """
+        :param db_file: 原始评论数据库路径
+        :param telemetry: 运行指标，设置后记录评论写入耗时和重复rpid数
+        """
         self.db_file = db_file
+        self.telemetry = telemetry
         # 确保数据库目录存在
         db_dir = os.path.dirname(db_file)
         if not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
         self.create_raw_comments_db()
         self.create_video_info_db()
+        self.create_seed_videos_db()
+        self.create_pending_index_builds()
+        self.create_comments_fts()
+        self.create_comments_bigram_index()
+        self.create_raw_danmaku_db()
     
     def create_raw_comments_db(self):
         """创建存储原始评论的数据库表"""
-        conn = sqlite3.connect(self.db_file)
+        conn = get_raw_connection(self.db_file)
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS raw_comments (
@@ -326,21 +1228,73 @@ class CommentDatabase:
                 comment TEXT NOT NULL,
                 ctime INTEGER NOT NULL,
                 category VARCHAR(50) Default 'Other',
-                is_hot BOOLEAN DEFAULT FALSE
+                is_hot BOOLEAN DEFAULT FALSE,
+                parent INTEGER DEFAULT 0
             )
         ''')
+        # 旧表补充 parent 列：楼中楼回复所属的评论rpid，顶层评论为0
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(raw_comments)")}
+        if "parent" not in columns:
+            cursor.execute("ALTER TABLE raw_comments ADD COLUMN parent INTEGER DEFAULT 0")
         # 创建索引以提高查询性能
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_aid ON raw_comments(aid)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_ctime ON raw_comments(ctime)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_category ON raw_comments(category)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_is_hot ON raw_comments(is_hot)')
+        self.create_ingest_log(cursor, "raw_comments", "rpid")
+        # 已移入冷存储的rpid（见 CommentArchive.archive_older_than）：爬虫视为已存在，
+        # 再次写入 raw_comments 时由触发器忽略，避免以新的写入序号重复进入增量处理
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archived_rpids (
+                rpid INTEGER PRIMARY KEY
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS raw_comments_skip_archived BEFORE INSERT ON raw_comments
+            WHEN EXISTS (SELECT 1 FROM archived_rpids WHERE rpid = new.rpid) BEGIN
+                SELECT RAISE(IGNORE);
+            END
+        ''')
         conn.commit()
-        conn.close()
         print("Raw comments database is set.")
+
+    @staticmethod
+    def create_ingest_log(cursor: sqlite3.Cursor, table: str, id_column: str):
+        """
+        为 table 创建写入序号表 {table}_ingest(seq, id)，由触发器在插入时分配递增的 seq
+        增量处理按 seq 推进水位线：后采集的数据 rpid/dmid 可能更小，但 seq 总是更大
+        已有数据按id顺序补写序号并标记 backfilled，用于从旧的id水位线迁移（见 legacy_ingest_seq）
+        """
+        log = f"{table}_ingest"
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (log,))
+        existed = cursor.fetchone() is not None
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {log} (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                {id_column} INTEGER NOT NULL UNIQUE,
+                backfilled BOOLEAN DEFAULT FALSE
+            )
+        ''')
+        # INSERT OR IGNORE 忽略的重复行不触发 AFTER INSERT，已有的行保持原来的序号
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {log}_ai AFTER INSERT ON {table} BEGIN
+                INSERT OR IGNORE INTO {log} ({id_column}) VALUES (new.{id_column});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {log}_ad AFTER DELETE ON {table} BEGIN
+                DELETE FROM {log} WHERE {id_column} = old.{id_column};
+            END
+        ''')
+        if not existed:
+            cursor.execute(f'''
+                INSERT INTO {log} ({id_column}, backfilled)
+                SELECT {id_column}, 1 FROM {table} ORDER BY {id_column}
+            ''')
     
     def create_video_info_db(self):
         """创建视频信息表"""
-        conn = sqlite3.connect(self.db_file)
+        conn = get_raw_connection(self.db_file)
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS video_info (
@@ -358,92 +1312,575 @@ class CommentDatabase:
         # 创建索引
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_video_category ON video_info(category)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_video_hot ON video_info(is_hot)')
+
+        # 各分区视频数由触发器维护，读取计数不必扫描 video_info
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='video_category_counts'")
+        existed = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS video_category_counts (
+                category VARCHAR(50) PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # 视频信息只用 upsert（ON CONFLICT DO UPDATE）写入，已有视频改分区时触发 UPDATE 触发器；
+        # 触发器不依赖 recursive_triggers，INSERT OR REPLACE 不会触发删除触发器，不应用于 video_info。
+        # 没有分区的视频计入 'other'（与 detect_category 的默认值相同），计数表中不出现 NULL 分区
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='trigger' AND name='video_info_count_ai'")
+        if cursor.fetchone() is not None:
+            # 旧版触发器按 NULL 分区各插入一行：删除旧触发器并把这些行合并到 'other'
+            for suffix in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS video_info_count_{suffix}")
+            cursor.execute('''
+                INSERT INTO video_category_counts (category, count)
+                SELECT 'other', SUM(count) FROM video_category_counts WHERE category IS NULL HAVING COUNT(*) > 0
+                ON CONFLICT(category) DO UPDATE SET count = count + excluded.count
+            ''')
+            cursor.execute("DELETE FROM video_category_counts WHERE category IS NULL")
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS video_category_count_ai AFTER INSERT ON video_info BEGIN
+                INSERT INTO video_category_counts (category, count) VALUES (COALESCE(new.category, 'other'), 1)
+                ON CONFLICT(category) DO UPDATE SET count = count + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS video_category_count_ad AFTER DELETE ON video_info BEGIN
+                UPDATE video_category_counts SET count = count - 1 WHERE category = COALESCE(old.category, 'other');
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS video_category_count_au AFTER UPDATE OF category ON video_info
+            WHEN COALESCE(old.category, 'other') != COALESCE(new.category, 'other') BEGIN
+                UPDATE video_category_counts SET count = count - 1 WHERE category = COALESCE(old.category, 'other');
+                INSERT INTO video_category_counts (category, count) VALUES (COALESCE(new.category, 'other'), 1)
+                ON CONFLICT(category) DO UPDATE SET count = count + 1;
+            END
+        ''')
+        if not existed:
+            # 已有数据库：用现有视频初始化计数
+            cursor.execute('''
+                INSERT INTO video_category_counts (category, count)
+                SELECT COALESCE(category, 'other'), COUNT(*) FROM video_info GROUP BY COALESCE(category, 'other')
+            ''')
         conn.commit()
-        conn.close()
         print("Video info database is set.")
+
+    def create_seed_videos_db(self):
+        """
+        创建待爬取的种子视频表（如 Get_oid 从分区列表收集的aid）
+        种子不计入 video_info 和分区计数，视频信息写入 video_info 时由触发器移出种子表
+        """
+        conn = get_raw_connection(self.db_file)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS seed_videos (
+                aid INTEGER PRIMARY KEY,
+                title TEXT,
+                category VARCHAR(50),
+                view_count INTEGER DEFAULT 0,
+                like_count INTEGER DEFAULT 0,
+                comment_count INTEGER DEFAULT 0,
+                added_at REAL DEFAULT 0
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_seed_category ON seed_videos(category, added_at)')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS seed_videos_crawled AFTER INSERT ON video_info BEGIN
+                DELETE FROM seed_videos WHERE aid = new.aid;
+            END
+        ''')
+        conn.commit()
+        print("Seed videos database is set.")
+
+    def create_pending_index_builds(self):
+        """
+        新建的检索索引在已有数据上的一次性补建记录在 pending_index_builds 中，
+        由 build_search_indexes 显式执行（每日任务中调用），构造函数不做整表重建
+        """
+        conn = get_raw_connection(self.db_file)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS pending_index_builds (
+                name TEXT PRIMARY KEY,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+
+    # 各检索索引在已有数据上的补建语句
+    INDEX_BUILD_SQL = {
+        "raw_comments_fts": "INSERT INTO raw_comments_fts(raw_comments_fts) VALUES ('rebuild')",
+        "raw_comments_bigrams": '''
+            INSERT OR IGNORE INTO raw_comments_bigrams (bigram, rpid)
+            WITH RECURSIVE pos(i) AS (
+                SELECT 1 UNION ALL
+                SELECT i + 1 FROM pos WHERE i < (SELECT MAX(length(comment)) FROM raw_comments)
+            )
+            SELECT substr(r.comment, pos.i, 2), r.rpid
+            FROM raw_comments r JOIN pos ON pos.i <= length(r.comment)
+        ''',
+    }
+
+    def build_search_indexes(self) -> List[str]:
+        """
+        执行待补建的检索索引（旧数据库首次创建索引后，已有评论尚未进入索引），每个索引一个事务；
+        补建完成前词语检索只能查到索引创建之后写入的评论。返回本次补建的索引名
+        """
+        conn = get_raw_connection(self.db_file)
+        pending = [row[0] for row in conn.execute("SELECT name FROM pending_index_builds ORDER BY created_at")]
+        built = []
+        for name in pending:
+            start = time.perf_counter()
+            try:
+                conn.execute(self.INDEX_BUILD_SQL[name])
+                conn.execute("DELETE FROM pending_index_builds WHERE name = ?", (name,))
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"数据库操作错误: {e}")
+                conn.rollback()
+                continue
+            built.append(name)
+            print(f"Built index {name} in {time.perf_counter() - start:.1f} s")
+        return built
+
+    @staticmethod
+    def _mark_index_pending(cursor: sqlite3.Cursor, name: str):
+        """索引刚创建且表中已有评论时，记录待补建"""
+        if cursor.execute("SELECT 1 FROM raw_comments LIMIT 1").fetchone():
+            cursor.execute(
+                "INSERT OR IGNORE INTO pending_index_builds (name, created_at) VALUES (?, ?)", (name, time.time())
+            )
+            print(f"Index {name} covers only new comments until build_search_indexes() runs")
+
+    def create_comments_fts(self):
+        """创建评论全文索引（trigram分词，支持中文子串检索），由触发器与 raw_comments 同步"""
+        conn = get_raw_connection(self.db_file)
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='raw_comments_fts'")
+        existed = cursor.fetchone() is not None
+
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS raw_comments_fts USING fts5(
+                comment,
+                content='raw_comments',
+                content_rowid='rpid',
+                tokenize='trigram'
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS raw_comments_fts_ai AFTER INSERT ON raw_comments BEGIN
+                INSERT INTO raw_comments_fts(rowid, comment) VALUES (new.rpid, new.comment);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS raw_comments_fts_ad AFTER DELETE ON raw_comments BEGIN
+                INSERT INTO raw_comments_fts(raw_comments_fts, rowid, comment) VALUES ('delete', old.rpid, old.comment);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS raw_comments_fts_au AFTER UPDATE OF comment ON raw_comments BEGIN
+                INSERT INTO raw_comments_fts(raw_comments_fts, rowid, comment) VALUES ('delete', old.rpid, old.comment);
+                INSERT INTO raw_comments_fts(rowid, comment) VALUES (new.rpid, new.comment);
+            END
+        ''')
+        # 已有数据的旧数据库：首次创建索引后由 build_search_indexes 整体重建一次
+        if not existed:
+            self._mark_index_pending(cursor, "raw_comments_fts")
+        conn.commit()
+        print("Comments full-text index is set.")
+
+    # 评论中每个位置起的两个字（最后一个位置为单字），供 create_comments_bigram_index 的触发器使用
+    _BIGRAMS_OF = '''
+        WITH RECURSIVE pos(i) AS (
+            SELECT 1 WHERE length({row}.comment) > 0
+            UNION ALL SELECT i + 1 FROM pos WHERE i < length({row}.comment)
+        )
+        SELECT substr({row}.comment, i, 2){rpid} FROM pos
+    '''
+
+    def create_comments_bigram_index(self):
+        """
+        创建评论的二字索引 (bigram, rpid)，由触发器与 raw_comments 同步
+        trigram 全文索引无法检索少于3个字的词，这类词（多数新词只有两个字）改查该索引。
+        代价是每条评论按字数写入同样多的索引行；任意评论都可能包含要查的两字词，不能只为部分评论建索引
+        """
+        conn = get_raw_connection(self.db_file)
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='raw_comments_bigrams'")
+        existed = cursor.fetchone() is not None
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS raw_comments_bigrams (
+                bigram TEXT NOT NULL,
+                rpid INTEGER NOT NULL,
+                PRIMARY KEY (bigram, rpid)
+            ) WITHOUT ROWID
+        ''')
+        insert_new = "INSERT OR IGNORE INTO raw_comments_bigrams (bigram, rpid)" + \
+            self._BIGRAMS_OF.format(row="new", rpid=", new.rpid")
+        # 按旧评论的二字删除，走主键而不是扫描整张表
+        delete_old = "DELETE FROM raw_comments_bigrams WHERE rpid = old.rpid AND bigram IN (" + \
+            self._BIGRAMS_OF.format(row="old", rpid="") + ")"
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS raw_comments_bigrams_ai AFTER INSERT ON raw_comments BEGIN
+                {insert_new};
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS raw_comments_bigrams_ad AFTER DELETE ON raw_comments BEGIN
+                {delete_old};
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS raw_comments_bigrams_au AFTER UPDATE OF comment ON raw_comments BEGIN
+                {delete_old};
+                {insert_new};
+            END
+        ''')
+        # 已有数据的旧数据库：首次创建索引后由 build_search_indexes 整体补建一次
+        if not existed:
+            self._mark_index_pending(cursor, "raw_comments_bigrams")
+        conn.commit()
+        print("Comments bigram index is set.")
+
+    def create_raw_danmaku_db(self):
+        """创建弹幕表：与 raw_comments 相同的 (aid, comment, ctime, category, is_hot) 列，以dmid为主键"""
+        conn = get_raw_connection(self.db_file)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS raw_danmaku (
+                dmid INTEGER PRIMARY KEY,
+                aid INTEGER NOT NULL,
+                cid INTEGER NOT NULL,
+                comment TEXT NOT NULL,
+                ctime INTEGER NOT NULL,
+                progress INTEGER DEFAULT 0,
+                category VARCHAR(50) Default 'Other',
+                is_hot BOOLEAN DEFAULT FALSE
+            )
+        ''')  # progress: 弹幕出现在视频中的时间（毫秒）
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_danmaku_aid ON raw_danmaku(aid)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_danmaku_ctime ON raw_danmaku(ctime)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_danmaku_category ON raw_danmaku(category)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_danmaku_is_hot ON raw_danmaku(is_hot)')
+        # 已抓取弹幕的视频（包括没有弹幕的），避免重复请求
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS danmaku_progress (
+                aid INTEGER PRIMARY KEY,
+                cid INTEGER,
+                segments INTEGER DEFAULT 0,
+                danmaku_count INTEGER DEFAULT 0,
+                fetched_at REAL DEFAULT 0
+            )
+        ''')
+        # 增量处理按写入序号读取弹幕：dmid 与入库顺序无关
+        self.create_ingest_log(cursor, "raw_danmaku", "dmid")
+        conn.commit()
+        print("Raw danmaku database is set.")
+
+    @staticmethod
+    def _word_condition(word: str) -> Tuple[str, List]:
+        """
+        生成“评论包含该词”的条件（作用于 raw_comments r）：不少于3个字用trigram全文索引的短语查询，
+        两个字查二字索引，单字按前缀范围查二字索引（每条评论的最后一个字也以单字记录）
+        """
+        if len(word) >= 3:
+            return ("r.rpid IN (SELECT rowid FROM raw_comments_fts WHERE raw_comments_fts MATCH ?)",
+                    ['"' + word.replace('"', '""') + '"'])
+        if len(word) == 2:
+            return "r.rpid IN (SELECT rpid FROM raw_comments_bigrams WHERE bigram = ?)", [word]
+        return ("r.rpid IN (SELECT rpid FROM raw_comments_bigrams WHERE bigram >= ? AND bigram < ?)",
+                [word, word + "\U0010ffff"])
+
+    def search_word_contexts(
+        self,
+        word: str,
+        page: int = 1,
+        per_page: int = 20,
+        category: Optional[str] = None,
+    ) -> List[Dict]:
+        """分页获取包含该词的评论，按评论时间倒序；只检索热数据，已移入冷存储的评论不在其中"""
+        condition, params = self._word_condition(word)
+        query = f'''
+            SELECT r.rpid, r.aid, r.comment, r.ctime, r.category, r.is_hot
+            FROM raw_comments r
+            WHERE {condition}
+        '''
+        if category is not None:
+            query += " AND r.category = ?"
+            params.append(category)
+        query += " ORDER BY r.ctime DESC LIMIT ? OFFSET ?"
+        params.extend([per_page, (max(page, 1) - 1) * per_page])
+
+        conn = get_raw_connection(self.db_file)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            cols = [c[0] for c in cursor.description]
+            return [dict(zip(cols, row)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"数据库操作错误: {e}")
+            return []
+
+    def get_word_usage_stats(self, word: str) -> Dict:
+        """
+        获取热数据中包含该词的评论总数、各分区数量和最早出现时间；
+        归档后冷存储中的评论不计入，包括冷数据的统计见 CommentArchive.get_word_usage_stats
+        """
+        condition, params = self._word_condition(word)
+        conn = get_raw_connection(self.db_file)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f'''
+                SELECT r.category, COUNT(*), MIN(r.ctime)
+                FROM raw_comments r
+                WHERE {condition}
+                GROUP BY r.category
+            ''', params)
+            rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"数据库操作错误: {e}")
+            rows = []
+
+        return {
+            "total": sum(row[1] for row in rows),
+            "by_category": {row[0]: row[1] for row in rows},
+            "first_seen": min((row[2] for row in rows), default=None),
+        }
     
+    INSERT_COMMENT_SQL = '''
+        INSERT OR IGNORE INTO raw_comments 
+        (rpid, aid, comment, ctime, category, is_hot, parent)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+
+    # 已有视频只更新统计信息，保留 crawl_time 等首次采集时写入的字段
+    INSERT_VIDEO_SQL = '''
+        INSERT INTO video_info 
+        (aid, title, category, is_hot, hotness_score, view_count, like_count, comment_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(aid) DO UPDATE SET
+            title = excluded.title,
+            category = excluded.category,
+            is_hot = excluded.is_hot,
+            hotness_score = excluded.hotness_score,
+            view_count = excluded.view_count,
+            like_count = excluded.like_count,
+            comment_count = excluded.comment_count
+    '''
+
+    # 只写入不在 video_info 中的新种子，已有的种子保持不变
+    INSERT_SEED_VIDEO_SQL = '''
+        INSERT OR IGNORE INTO seed_videos
+        (aid, title, category, view_count, like_count, comment_count, added_at)
+        SELECT ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM video_info WHERE aid = ?)
+    '''
+
+    @staticmethod
+    def comment_to_row(comment: Dict) -> Tuple:
+        """评论字典转换为 raw_comments 插入行"""
+        return (
+            comment['rpid'], comment['aid'], comment['comment'], 
+            comment['ctime'], comment.get('category', 'Other'),
+            comment.get('is_hot', False), comment.get('parent', 0)
+        )
+
+    @staticmethod
+    def video_to_row(video_data: Dict) -> Tuple:
+        """视频信息字典转换为 video_info 插入行"""
+        return (
+            video_data['aid'],
+            video_data.get('title', ''),
+            video_data.get('category', 'unknown'),
+            video_data.get('is_hot', False),
+            video_data.get('hotness_score', 0),
+            video_data.get('view_count', 0),
+            video_data.get('like_count', 0),
+            video_data.get('comment_count', 0)
+        )
+
     def save_comments_batch(self, comments_batch: List[Dict]):
         """将一批评论保存到数据库"""
-        conn = sqlite3.connect(self.db_file)
+        conn = get_raw_connection(self.db_file)
         cursor = conn.cursor()
         
         try:
             # 准备批量插入数据
-            data_to_insert = [
-                (
-                    comment['rpid'], comment['aid'], comment['comment'], 
-                    comment['ctime'], comment.get('category', 'Other'),
-                    comment.get('is_hot', False)
-                )
-                for comment in comments_batch
-            ]
+            data_to_insert = [self.comment_to_row(comment) for comment in comments_batch]
             
             # 执行批量插入
-            cursor.executemany('''
-                INSERT OR IGNORE INTO raw_comments 
-                (rpid, aid, comment, ctime, category, is_hot)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', data_to_insert)
+            start = time.perf_counter()
+            cursor.executemany(self.INSERT_COMMENT_SQL, data_to_insert)
+            inserted = cursor.rowcount
             
             conn.commit()
+            if self.telemetry:
+                self.telemetry.add_time(PHASE_DB_WRITE, time.perf_counter() - start)
+                self.telemetry.observe_comments(inserted, len(data_to_insert) - inserted)
             print(f"Save {len(comments_batch)} comments to database")
         except sqlite3.Error as e:
             print(f"数据库操作错误: {e}")
             conn.rollback()
-        finally:
-            conn.close()
     
+    INSERT_DANMAKU_SQL = '''
+        INSERT OR IGNORE INTO raw_danmaku
+        (dmid, aid, cid, comment, ctime, progress, category, is_hot)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+
+    def save_danmaku_batch(self, aid: int, cid: int, segments: int, danmaku_batch: List[Dict]):
+        """在一个事务中保存一个视频的弹幕并记录抓取进度"""
+        conn = get_raw_connection(self.db_file)
+        try:
+            conn.executemany(self.INSERT_DANMAKU_SQL, [
+                (d['dmid'], aid, cid, d['comment'], d['ctime'], d.get('progress', 0),
+                 d.get('category', 'Other'), d.get('is_hot', False))
+                for d in danmaku_batch
+            ])
+            conn.execute('''
+                INSERT OR REPLACE INTO danmaku_progress (aid, cid, segments, danmaku_count, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (aid, cid, segments, len(danmaku_batch), time.time()))
+            conn.commit()
+            print(f"Save {len(danmaku_batch)} danmaku of {aid} to database")
+        except sqlite3.Error as e:
+            print(f"数据库操作错误: {e}")
+            conn.rollback()
+
+    def get_videos_without_danmaku(self, limit: int = 50) -> List[Tuple[int, str, bool]]:
+        """尚未抓取弹幕的视频 [(aid, category, is_hot), ...]，最近采集的优先"""
+        return get_raw_connection(self.db_file).execute('''
+            SELECT v.aid, v.category, v.is_hot
+            FROM video_info v
+            LEFT JOIN danmaku_progress d ON d.aid = v.aid
+            WHERE d.aid IS NULL
+            ORDER BY v.crawl_time DESC
+            LIMIT ?
+        ''', (limit,)).fetchall()
+
+    @staticmethod
+    def write_crawl_rows(
+        conn: sqlite3.Connection,
+        video_rows: List[Tuple],
+        comment_rows: List[Tuple],
+        progress_rows: Sequence[Tuple] = (),
+    ) -> int:
+        """
+        在调用方的事务中写入视频行（upsert）、评论行和爬取进度行（CrawlerStateManager.progress_row），
+        返回实际插入的评论数（不含重复rpid）
+        """
+        if video_rows:
+            conn.executemany(CommentDatabase.INSERT_VIDEO_SQL, video_rows)
+        if progress_rows:
+            conn.executemany(CrawlerStateManager.UPDATE_PROGRESS_SQL, progress_rows)
+        if not comment_rows:
+            return 0
+        return conn.executemany(CommentDatabase.INSERT_COMMENT_SQL, comment_rows).rowcount
+
+    def save_crawl_batch(self, videos: List[Dict], comments: List[Dict]) -> bool:
+        """在一个事务中保存一批视频信息及其评论，要么全部写入要么全部回滚"""
+        conn = get_raw_connection(self.db_file)
+        start = time.perf_counter()
+        comment_rows = [self.comment_to_row(comment) for comment in comments]
+        try:
+            inserted = self.write_crawl_rows(conn, [self.video_to_row(video) for video in videos], comment_rows)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"数据库操作错误: {e}")
+            conn.rollback()
+            return False
+        if self.telemetry:
+            self.telemetry.add_time(PHASE_DB_WRITE, time.perf_counter() - start)
+            self.telemetry.observe_comments(inserted, len(comment_rows) - inserted)
+        return True
+
+    def save_videos_batch(self, videos: List[Dict]) -> bool:
+        """批量upsert视频信息，一次提交"""
+        if self.save_crawl_batch(videos, []):
+            print(f"Save video info for {len(videos)} videos")
+            return True
+        return False
+
     def save_video_info(self, video_data: Dict):
         """保存视频信息"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
+        self.save_videos_batch([video_data])
+    
+    def save_seed_videos(self, videos: List[Dict]):
+        """批量写入待爬取的种子视频，已爬取或已是种子的aid跳过"""
+        conn = get_raw_connection(self.db_file)
+        now = time.time()
         try:
-            cursor.execute('''
-                INSERT OR REPLACE INTO video_info 
-                (aid, title, category, is_hot, hotness_score, view_count, like_count, comment_count)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                video_data['aid'],
-                video_data.get('title', ''),
-                video_data.get('category', 'unknown'),
-                video_data.get('is_hot', False),
-                video_data.get('hotness_score', 0),
-                video_data.get('view_count', 0),
-                video_data.get('like_count', 0),
-                video_data.get('comment_count', 0)
-            ))
-            
+            conn.executemany(self.INSERT_SEED_VIDEO_SQL, [
+                (video['aid'], video.get('title', ''), video.get('category', 'unknown'),
+                 video.get('view_count', 0), video.get('like_count', 0), video.get('comment_count', 0),
+                 now, video['aid'])
+                for video in videos
+            ])
             conn.commit()
-            print(f"Save video info for aid: {video_data['aid']}")
         except sqlite3.Error as e:
             print(f"数据库操作错误: {e}")
             conn.rollback()
-        finally:
-            conn.close()
-    
+
+    def filter_seeded_aids(self, aids: Iterable[int]) -> set:
+        """返回候选aid中已在种子表中的部分"""
+        return filter_existing_keys(self.db_file, "seed_videos", "aid", aids)
+
+    def get_seed_videos(self, category: str, limit: int = 20) -> List[Dict]:
+        """某分区最早加入的种子视频，格式同分区列表接口返回的视频（只有 aid、title、stat）"""
+        rows = get_raw_connection(self.db_file).execute('''
+            SELECT aid, title, view_count, like_count, comment_count
+            FROM seed_videos
+            WHERE category = ?
+            ORDER BY added_at, aid
+            LIMIT ?
+        ''', (category, limit)).fetchall()
+        return [
+            {'aid': aid, 'title': title, 'stat': {'view': view, 'like': like, 'reply': reply}}
+            for aid, title, view, like, reply in rows
+        ]
+
     def get_video_count_by_category(self):
         """获取各分区的视频数量"""
-        conn = sqlite3.connect(self.db_file)
+        conn = get_raw_connection(self.db_file)
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
-                SELECT category, COUNT(*) as count 
-                FROM video_info 
-                GROUP BY category
+                SELECT category, count
+                FROM video_category_counts
+                WHERE count > 0
             ''')
             result = dict(cursor.fetchall())
             return result
         except sqlite3.Error as e:
             print(f"数据库操作错误: {e}")
             return {}
-        finally:
-            conn.close()
     
+    def filter_existing_aids(self, aids: Iterable[int]) -> set:
+        """返回候选aid中已在 video_info 中的部分（按块查询主键）"""
+        return filter_existing_keys(self.db_file, "video_info", "aid", aids)
+
+    def filter_finished_aids(self, aids: Iterable[int], max_comments: int) -> set:
+        """
+        返回候选aid中已在 video_info 中且评论已爬完的部分：crawl_progress 已标记完成（next_page 为0）
+        或评论数已达上限。没有进度或进度未完成的视频（如中途出错）仍可再次采集
+        """
+        aids = list(dict.fromkeys(int(aid) for aid in aids))
+        conn = get_raw_connection(self.db_file)
+        found = set()
+        for start in range(0, len(aids), EXISTS_CHUNK_SIZE):
+            chunk = aids[start:start + EXISTS_CHUNK_SIZE]
+            rows = conn.execute(f'''
+                SELECT v.aid FROM video_info v
+                JOIN crawl_progress p ON p.aid = v.aid
+                WHERE v.aid IN ({','.join('?' * len(chunk))})
+                  AND (p.next_page = 0 OR p.comment_count >= ?)
+            ''', (*chunk, max_comments)).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+
     def get_existing_aids(self):
-        """获取已存在的视频aid列表"""
-        conn = sqlite3.connect(self.db_file)
+        """获取已存在的视频aid列表（加载整张表，新代码应使用 filter_existing_aids）"""
+        conn = get_raw_connection(self.db_file)
         cursor = conn.cursor()
         
         try:
@@ -453,11 +1890,146 @@ class CommentDatabase:
         except sqlite3.Error as e:
             print(f"数据库操作错误: {e}")
             return set()
-        finally:
-            conn.close()
     
+    def stream_comment_rows(
+        self,
+        batch_size: int = 5000,
+        category: Optional[str] = None,
+        is_hot: Optional[bool] = None,
+        start_ctime: Optional[int] = None,
+        end_ctime: Optional[int] = None,
+        after_rpid: int = 0,
+    ) -> Generator[List[Tuple], None, None]:
+        """
+        按rpid游标分页流式读取评论，每批返回 [(rpid, aid, comment, ctime), ...]
+
+        :param batch_size: 每批读取的评论数
+        :param category: 只读取该分区的评论 (idx_category)
+        :param is_hot: 只读取热门/非热门视频的评论 (idx_is_hot)
+        :param start_ctime: 评论时间下限（包含）(idx_ctime)
+        :param end_ctime: 评论时间上限（不包含）(idx_ctime)
+        :param after_rpid: 从该rpid之后开始读取
+        """
+        yield from self._stream_rows(
+            "raw_comments", "rpid", batch_size, category, is_hot, start_ctime, end_ctime, after_rpid
+        )
+
+    def stream_danmaku_rows(
+        self,
+        batch_size: int = 5000,
+        category: Optional[str] = None,
+        is_hot: Optional[bool] = None,
+        start_ctime: Optional[int] = None,
+        end_ctime: Optional[int] = None,
+        after_dmid: int = 0,
+    ) -> Generator[List[Tuple], None, None]:
+        """与 stream_comment_rows 相同，按dmid游标读取弹幕，每批返回 [(dmid, aid, comment, ctime), ...]"""
+        yield from self._stream_rows(
+            "raw_danmaku", "dmid", batch_size, category, is_hot, start_ctime, end_ctime, after_dmid
+        )
+
+    def stream_new_comment_rows(self, batch_size: int = 5000, after_seq: int = 0) -> Generator[List[Tuple], None, None]:
+        """
+        按写入序号流式读取 after_seq 之后入库的评论，每批返回 [(seq, rpid, aid, comment, ctime), ...]
+        用于增量处理：无论rpid大小，后入库的评论都排在水位线之后
+        """
+        yield from self._stream_ingested_rows("raw_comments", "rpid", batch_size, after_seq)
+
+    def stream_new_danmaku_rows(self, batch_size: int = 5000, after_seq: int = 0) -> Generator[List[Tuple], None, None]:
+        """与 stream_new_comment_rows 相同，按写入序号读取弹幕，每批返回 [(seq, dmid, aid, comment, ctime), ...]"""
+        yield from self._stream_ingested_rows("raw_danmaku", "dmid", batch_size, after_seq)
+
+    def legacy_ingest_seq(self, table: str, id_column: str, last_id: int) -> int:
+        """把旧的 rpid/dmid 水位线换算为写入序号：补写序号的已有数据中id不超过 last_id 的部分视为已处理"""
+        row = get_raw_connection(self.db_file).execute(
+            f"SELECT MAX(seq) FROM {table}_ingest WHERE backfilled AND {id_column} <= ?", (last_id,)
+        ).fetchone()
+        return row[0] or 0
+
+    def _stream_ingested_rows(
+        self,
+        table: str,
+        id_column: str,
+        batch_size: int,
+        after_seq: int,
+    ) -> Generator[List[Tuple], None, None]:
+        query = f'''
+            SELECT i.seq, t.{id_column}, t.aid, t.comment, t.ctime
+            FROM {table}_ingest i
+            JOIN {table} t ON t.{id_column} = i.{id_column}
+            WHERE i.seq > ?
+            ORDER BY i.seq
+            LIMIT ?
+        '''
+        # 写事务串行提交，读到的最大seq之前不会再出现未提交的行，按seq键集分页不会漏读
+        conn = get_raw_connection(self.db_file)
+        last_seq = after_seq
+        while True:
+            cursor = conn.execute(query, (last_seq, batch_size))
+            rows = cursor.fetchmany(batch_size)
+            cursor.close()
+            if not rows:
+                break
+            last_seq = rows[-1][0]
+            yield rows
+            if len(rows) < batch_size:
+                break
+
+    def _stream_rows(
+        self,
+        table: str,
+        id_column: str,
+        batch_size: int,
+        category: Optional[str],
+        is_hot: Optional[bool],
+        start_ctime: Optional[int],
+        end_ctime: Optional[int],
+        after_id: int,
+    ) -> Generator[List[Tuple], None, None]:
+        conditions = [f"{id_column} > ?"]
+        filter_params = []
+        if category is not None:
+            conditions.append("category = ?")
+            filter_params.append(category)
+        if is_hot is not None:
+            conditions.append("is_hot = ?")
+            filter_params.append(int(is_hot))
+        if start_ctime is not None:
+            conditions.append("ctime >= ?")
+            filter_params.append(start_ctime)
+        if end_ctime is not None:
+            conditions.append("ctime < ?")
+            filter_params.append(end_ctime)
+
+        # 键集分页：每页从上一页最后一个id继续，不使用OFFSET
+        query = f'''
+            SELECT {id_column}, aid, comment, ctime
+            FROM {table}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY {id_column}
+            LIMIT ?
+        '''
+
+        conn = get_raw_connection(self.db_file)
+        last_id = after_id
+        while True:
+            cursor = conn.execute(query, [last_id, *filter_params, batch_size])
+            rows = cursor.fetchmany(batch_size)
+            cursor.close()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            yield rows
+            if len(rows) < batch_size:
+                break
+
+    def stream_comments(self, batch_size: int = 5000, **filters) -> Generator[List[Tuple], None, None]:
+        """流式读取评论，每批返回 [(comment, aid), ...]，可直接传给 FindWords4XG.add_comments"""
+        for rows in self.stream_comment_rows(batch_size=batch_size, **filters):
+            yield [(comment, aid) for _, aid, comment, _ in rows]
+
     def show_information(self):
-        conn=sqlite3.connect(self.db_file)
+        conn=get_raw_connection(self.db_file)
         cursor=conn.cursor()
         try:
             cursor.execute("""select count(*) from raw_comments""")
@@ -465,9 +2037,6 @@ class CommentDatabase:
             print(f"There are {count} comments in the database.")
         except sqlite3.Error as e:
             print(f"数据库操作错误: {e}")
-        finally:
-            conn.commit()
-            conn.close()
 
         result=self.get_video_count_by_category()
         total_value=sum(result.values())
@@ -475,17 +2044,255 @@ class CommentDatabase:
         for key in result:
             print(f'{key}:{round(result[key]/total_value,2)*100}%')
 
+# 异步写入队列：在事件循环外合并写入，避免fsync阻塞网络请求
+class AsyncCommentWriter:
+    _STOP = object()
+
+    def __init__(
+        self,
+        db_file: str = DB_FILE,
+        max_queue_size: int = 500,
+        flush_rows: int = 2000,
+        flush_interval: float = 2.0,
+        telemetry: Optional[CrawlTelemetry] = None,
+    ):
+        """
+        :param db_file: 原始评论数据库路径
+        :param max_queue_size: 队列最大长度，队列满时写入方等待（背压）
+        :param flush_rows: 累积到该行数后提交一次事务
+        :param flush_interval: 距第一条待写数据超过该秒数后提交一次事务
+        :param telemetry: 运行指标，设置后记录事务耗时和重复rpid数
+        """
+        self.db_file = db_file
+        self.telemetry = telemetry
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.conn: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        # 每个事务在专用线程内一次执行完毕：事务期间不依赖事件循环，
+        # 事件循环线程上的同步写入（如爬取进度）等锁时不会与之互相等待
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.write_latencies: List[float] = []  # 每次事务提交耗时（秒）
+        self.error: Optional[Exception] = None  # 最近一次写入失败的异常，由 flush/close 抛出
+
+    async def start(self):
+        """打开数据库连接并启动写入任务"""
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="comment-writer")
+        self.conn = await self._in_writer_thread(self._connect)
+        self._task = asyncio.create_task(self._run())
+
+    async def save_video_info(self, video_data: Dict):
+        """将视频信息加入写入队列"""
+        await self.queue.put(("video", video_data))
+
+    async def save_comments_batch(self, comments_batch: List[Dict]):
+        """将一批评论加入写入队列"""
+        if comments_batch:
+            await self.queue.put(("comments", comments_batch))
+
+    async def save_crawl_batch(self, videos: List[Dict], comments: List[Dict], progress: Sequence[Tuple] = ()):
+        """
+        将视频信息、它们的评论和爬取进度作为一项加入写入队列，保证在同一个事务中提交
+        :param progress: CrawlerStateManager.progress_row 生成的进度行
+        """
+        await self.queue.put(("batch", (videos, comments, progress)))
+
+    async def flush(self):
+        """
+        等待调用前加入队列的数据全部提交（不等待之后其他任务加入的数据）；
+        本次运行中有批次写入失败时抛出 DataWriteError
+        """
+        if self._task is not None:
+            written = asyncio.get_running_loop().create_future()
+            await self.queue.put(("barrier", written))
+            await written
+        self.raise_if_failed()
+
+    async def close(self):
+        """写完队列中剩余的数据并关闭连接；有批次写入失败时在关闭后抛出 DataWriteError"""
+        if self._task:
+            await self.queue.put(self._STOP)
+            await self._task
+            self._task = None
+        if self.conn:
+            await self._in_writer_thread(self.conn.close)
+            self.conn = None
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+        self.raise_if_failed()
+
+    def raise_if_failed(self):
+        """
+        写入失败后不再确认任何数据已落盘：失败的批次可能包含任意视频的数据，
+        调用方据此不把视频标记为完成，下次采集时重新处理
+        """
+        if self.error is not None:
+            raise DataWriteError(f"Comment writer failed: {self.error!r}") from self.error
+
+    async def _in_writer_thread(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        for pragma in RAW_DB_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @staticmethod
+    def _item_rows(item) -> int:
+        kind, payload = item
+        if kind == "batch":
+            return sum(len(rows) for rows in payload)
+        if kind == "barrier":
+            return 0
+        return len(payload) if kind == "comments" else 1
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is self._STOP:
+                self.queue.task_done()
+                break
+
+            # 合并队列中的后续数据，直到行数或等待时间达到阈值；有 flush 在等待时立即提交
+            batch = [item]
+            rows = self._item_rows(item)
+            deadline = loop.time() + self.flush_interval
+            while rows < self.flush_rows and batch[-1][0] != "barrier":
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is self._STOP:
+                    self.queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+                rows += self._item_rows(item)
+
+            try:
+                await self._write(batch)
+            except Exception as e:
+                # 写入任务不能因单个批次退出，否则 put/flush/close 会一直等待
+                print(f"Failed to write {len(batch)} queued items, dropped: {e!r}")
+                self.error = e
+            finally:
+                for kind, payload in batch:
+                    if kind == "barrier" and not payload.done():
+                        payload.set_result(None)
+                    self.queue.task_done()
+
+    @staticmethod
+    def _item_to_rows(item) -> Tuple[List[Tuple], List[Tuple], List[Tuple]]:
+        """队列中的一项转换为 (视频行, 评论行, 进度行)"""
+        kind, payload = item
+        if kind == "video":
+            return [CommentDatabase.video_to_row(payload)], [], []
+        if kind == "batch":
+            videos, comments, progress = payload
+            return ([CommentDatabase.video_to_row(v) for v in videos],
+                    [CommentDatabase.comment_to_row(c) for c in comments],
+                    list(progress))
+        if kind == "barrier":
+            return [], [], []
+        return [], [CommentDatabase.comment_to_row(c) for c in payload], []
+
+    async def _write(self, batch: List[Tuple[str, Any]]):
+        """在一个事务中写入一批视频信息、评论和爬取进度"""
+        video_rows = []
+        comment_rows = []
+        progress_rows = []
+        for item in batch:
+            # 单项数据格式错误只丢弃该项，同一事务中的其他数据照常写入
+            try:
+                item_videos, item_comments, item_progress = self._item_to_rows(item)
+            except Exception as e:
+                print(f"Failed to convert queued {item[0]} item, dropped: {e!r}")
+                self.error = e
+                continue
+            video_rows.extend(item_videos)
+            comment_rows.extend(item_comments)
+            progress_rows.extend(item_progress)
+        if not (video_rows or comment_rows or progress_rows):
+            return
+
+        start = time.perf_counter()
+        await self._in_writer_thread(self._write_rows, video_rows, comment_rows, progress_rows)
+        self.write_latencies.append(time.perf_counter() - start)
+        print(f"Save {len(video_rows)} videos and {len(comment_rows)} comments to database")
+
+    def _write_rows(self, video_rows: List[Tuple], comment_rows: List[Tuple], progress_rows: List[Tuple]):
+        """在写入线程中执行整个事务，失败时回滚并抛出异常"""
+        start = time.perf_counter()
+        try:
+            inserted = CommentDatabase.write_crawl_rows(self.conn, video_rows, comment_rows, progress_rows)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"数据库操作错误: {e}")
+            self.conn.rollback()
+            raise
+        if self.telemetry:
+            self.telemetry.add_time(PHASE_DB_WRITE, time.perf_counter() - start)
+            self.telemetry.observe_comments(inserted, len(comment_rows) - inserted)
+
 # 评论爬虫主类
 class BilibiliCommentCrawler:
-    def __init__(self, aid_list: List[str], max_comments_per_video: int = 50):
+    def __init__(
+        self,
+        aid_list: List[str],
+        max_comments_per_video: int = 50,
+        http_client: Optional[httpx.AsyncClient] = None,
+        max_concurrent_videos: int = 1,
+        rate_limiter: Optional[TokenBucketLimiter] = None,
+        browserless: bool = True,
+        db_file: str = DB_FILE,
+        data_dir: Optional[str] = None,
+        api_host: str = API_HOST,
+        sub_reply_threshold: Optional[int] = None,
+        max_sub_replies_per_root: int = 40,
+        sub_reply_concurrency: int = 4,
+        response_archive=None,
+        telemetry: Optional[CrawlTelemetry] = None,
+    ):
         """
         初始化B站评论爬虫
         
         :param aid_list: 视频aid列表
         :param max_comments_per_video: 每个视频最多爬取的评论数
+        :param http_client: 共享的连接池客户端，未提供时在 create_client() 中创建
+        :param max_concurrent_videos: crawl_comments 同时爬取的视频数
+        :param rate_limiter: 全局限速器；设置后由它控制请求节奏，不再在翻页和视频之间随机等待
+        :param browserless: 保存的cookies有效时不启动浏览器，只在需要扫码登录时使用Playwright
+        :param db_file: 原始评论数据库路径
+        :param data_dir: cookies和旧版状态文件所在目录，默认 Data_Collection
+        :param api_host: API地址，测试时可指向本地模拟服务器
+        :param sub_reply_threshold: 回复数达到该值的评论再抓取其楼中楼回复；None 表示不抓取
+        :param max_sub_replies_per_root: 每条评论最多抓取的楼中楼回复数
+        :param sub_reply_concurrency: 同时抓取楼中楼的评论数（仍受全局限速器约束）
+        :param response_archive: ResponseArchive 实例，设置后保存每个评论页的原始响应
+        :param telemetry: 运行指标，默认新建；与其他组件共享时传入同一实例
         """
         self.aid_list = aid_list
         self.max_comments_per_video = max_comments_per_video
+        self._owns_http_client = http_client is None
+        self.http_client = http_client
+        self.max_concurrent_videos = max(1, max_concurrent_videos)
+        self.rate_limiter = rate_limiter
+        self.api_host = api_host
+        self.sub_reply_threshold = sub_reply_threshold
+        self.max_sub_replies_per_root = max_sub_replies_per_root
+        self.sub_reply_concurrency = max(1, sub_reply_concurrency)
+        self.response_archive = response_archive
+        self.telemetry = telemetry or CrawlTelemetry()
+        self.browserless = browserless
+        self.browserless_active = False  # 当前是否以纯HTTP模式运行
         self.browser_context: Optional[BrowserContext] = None
         self.context_page: Optional[Page] = None
         self.client: Optional[BilibiliClient] = None
@@ -494,7 +2301,7 @@ class BilibiliCommentCrawler:
         self.extra_video_info = {}  # 存储额外的视频信息（分类和热门标记）
 
         # 统一文件路径管理
-        self.data_dir = os.path.join(BASEDIR, "Data_Collection")
+        self.data_dir = data_dir or os.path.join(BASEDIR, "Data_Collection")
         self.cookies_file = os.path.join(self.data_dir, "bilibili_cookies.json")
         self.state_file = os.path.join(self.data_dir, "crawler_state.pkl")
         
@@ -502,15 +2309,48 @@ class BilibiliCommentCrawler:
         os.makedirs(self.data_dir, exist_ok=True)
         
         # 确保数据库目录存在
-        db_dir = os.path.dirname(DB_FILE)
+        db_dir = os.path.dirname(db_file)
         os.makedirs(db_dir, exist_ok=True)
         
         # 确保状态文件目录存在
         os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
         
-        # 初始化状态管理器
-        self.state_manager = CrawlerStateManager(self.state_file)
-        self.db = CommentDatabase()  # 初始化数据库操作对象
+        # 初始化数据库和状态管理器（状态表依赖 raw_comments）
+        self.db = CommentDatabase(db_file, telemetry=self.telemetry)  # 初始化数据库操作对象
+        self.state_manager = CrawlerStateManager(self.db.db_file, legacy_state_file=self.state_file)
+
+    async def start(self):
+        """启动爬虫：优先用保存的cookies走纯HTTP模式，cookies无效时才启动浏览器扫码登录"""
+        if self.browserless and await self.setup_browserless():
+            return
+        await self.setup_browser()
+        await self.login_if_needed()
+        await self.create_client()
+
+    def load_saved_cookies(self) -> List[Dict]:
+        """读取保存的cookies，不存在或损坏时返回空列表"""
+        if not os.path.exists(self.cookies_file):
+            return []
+        try:
+            with open(self.cookies_file, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Failed to load Cookies: {str(e)}")
+            return []
+
+    async def setup_browserless(self) -> bool:
+        """用保存的cookies创建客户端并通过 pong 验证，成功则无需浏览器"""
+        if not self.load_saved_cookies():
+            return False
+        await self.create_client()
+        if await self.client.pong():
+            print("Saved cookies are valid, crawling without browser")
+            self.logged_in = True
+            self.browserless_active = True
+            return True
+        print("Saved cookies are invalid, falling back to browser login")
+        self.client = None
+        return False
 
     async def setup_browser(self):
         """设置浏览器环境"""
@@ -538,10 +2378,9 @@ class BilibiliCommentCrawler:
         """)
         
         # 尝试加载保存的cookies
-        if os.path.exists(self.cookies_file):
+        cookies = self.load_saved_cookies()
+        if cookies:
             try:
-                with open(self.cookies_file, "r") as f:
-                    cookies = json.load(f)
                 await self.browser_context.add_cookies(cookies)
                 print("Saved Cookies are loaded")
                 self.logged_in = True
@@ -598,9 +2437,16 @@ class BilibiliCommentCrawler:
 
     async def create_client(self):
         """创建API客户端"""
-        # 创建客户端
-        cookies = await self.browser_context.cookies()
+        # 创建客户端：有浏览器时取浏览器中的cookies，纯HTTP模式取保存的cookies
+        if self.browser_context:
+            cookies = await self.browser_context.cookies()
+        else:
+            cookies = self.load_saved_cookies()
         cookie_str, cookie_dict = convert_cookies(cookies)
+
+        # 重建客户端时复用同一个连接池
+        if self.http_client is None or self.http_client.is_closed:
+            self.http_client = create_http_client(rate_limiter=self.rate_limiter)
         
         self.client = BilibiliClient(
             proxy=None,
@@ -612,7 +2458,10 @@ class BilibiliCommentCrawler:
                 "Content-Type": "application/json;charset=UTF-8",
             },
             playwright_page=self.context_page,
-            cookie_dict=cookie_dict
+            cookie_dict=cookie_dict,
+            api_host=self.api_host,
+            http_client=self.http_client,
+            telemetry=self.telemetry,
         )
 
     async def close(self):
@@ -622,6 +2471,9 @@ class BilibiliCommentCrawler:
                 await self.browser_context.close()
             if self.playwright:
                 await self.playwright.stop()
+            # 只关闭自己创建的连接池，共享的由持有者关闭
+            if self._owns_http_client and self.http_client and not self.http_client.is_closed:
+                await self.http_client.aclose()
             # 保存最终状态
             self.state_manager.save_state()
         except Exception as e:
@@ -629,22 +2481,27 @@ class BilibiliCommentCrawler:
 
     async def ensure_browser_alive(self):
         """确保浏览器环境存活，如果已关闭则重新初始化"""
+        # 纯HTTP模式不需要浏览器
+        if self.browserless_active:
+            return False
         try:
             # 检查浏览器上下文是否仍然有效
             if not self.browser_context:
                 print("Browser context is closed, reinitializing...")
-                await self.setup_browser()
-                await self.login_if_needed()
-                await self.create_client()
+                with self.telemetry.timed(PHASE_BROWSER_RESTART):
+                    await self.setup_browser()
+                    await self.login_if_needed()
+                    await self.create_client()
                 return True
             return False
         except Exception as e:
             print(f"Error checking browser status: {e}")
             # 尝试重新初始化
             try:
-                await self.setup_browser()
-                await self.login_if_needed()
-                await self.create_client()
+                with self.telemetry.timed(PHASE_BROWSER_RESTART):
+                    await self.setup_browser()
+                    await self.login_if_needed()
+                    await self.create_client()
                 return True
             except Exception as e2:
                 print(f"Failed to reinitialize browser: {e2}")
@@ -652,44 +2509,66 @@ class BilibiliCommentCrawler:
 
     async def crawl_comments(self) -> List[Dict]:
         """爬取所有视频的评论"""
-        await self.setup_browser()
-        await self.login_if_needed()
-        await self.create_client()
+        await self.start()
         
         results = []
-        for aid in self.aid_list:
-            try:
-                # 检查是否已完成爬取
-                progress = self.state_manager.get_video_progress(aid)
-                if progress["comment_count"] >= self.max_comments_per_video:
-                    print(f"Video {aid} has been fetched.Skip")
-                    continue
+        # 最多同时爬取 max_concurrent_videos 个视频
+        semaphore = asyncio.Semaphore(self.max_concurrent_videos)
+
+        async def crawl_one(aid):
+            async with semaphore:
+                try:
+                    # 检查是否已完成爬取
+                    progress = self.state_manager.get_video_progress(aid)
+                    if progress["comment_count"] >= self.max_comments_per_video:
+                        print(f"Video {aid} has been fetched.Skip")
+                        return
+                        
+                    print(f"Start fetching comments from {aid}...")
                     
-                print(f"Start fetching comments from {aid}...")
-                
-                # 确保从正确的页码开始
-                comments = await self.get_video_comments(aid)
-                
-                # 保存当前视频的评论到数据库
-                if comments:
-                    self.db.save_comments_batch(comments)
-                    results.extend(comments)
-                
-                print(f"Successfully fetched {len(comments)} comments from {aid}")
-                
-                # 随机延迟防止请求过快
-                delay = random.uniform(2.0, 5.0)
-                print(f"Wait for {delay:.2f} seconds and continue...")
-                await asyncio.sleep(delay)
-            except DataFetchError as e:
-                print(f"Failed to fetch commments from {aid} : {e}")
-            except Exception as e:
-                print(f"Error when processing {aid}: {str(e)}")
-        
+                    # 确保从正确的页码开始
+                    comments = await self.get_video_comments(aid)
+                    
+                    # 保存当前视频的评论到数据库
+                    if comments:
+                        self.db.save_comments_batch(comments)
+                        results.extend(comments)
+                    
+                    print(f"Successfully fetched {len(comments)} comments from {aid}")
+                    
+                    # 没有全局限速器时，随机延迟防止请求过快
+                    if self.rate_limiter is None:
+                        delay = random.uniform(2.0, 5.0)
+                        print(f"Wait for {delay:.2f} seconds and continue...")
+                        await self.telemetry.sleep(delay)
+                except DataFetchError as e:
+                    print(f"Failed to fetch commments from {aid} : {e}")
+                except Exception as e:
+                    print(f"Error when processing {aid}: {str(e)}")
+
+        await asyncio.gather(*(crawl_one(aid) for aid in self.aid_list))
         return results
 
-    async def get_video_comments(self, aid: str, start_page: int = 0) -> List[Dict]:
-        """获取单个视频的评论，支持断点续爬"""
+    async def get_video_comments(
+        self,
+        aid: str,
+        start_page: int = 0,
+        video_info: Optional[Dict] = None,
+        writer: Optional[AsyncCommentWriter] = None,
+        videos: Sequence[Dict] = (),
+    ) -> List[Dict]:
+        """
+        获取单个视频的评论，支持断点续爬
+        :param video_info: 该视频的分类和热门标记，并发爬取时使用；默认取 extra_video_info
+        :param writer: 设置后每页评论和该页之后的爬取进度作为一项加入写入队列，在同一个事务中提交，
+            中断后不会出现进度已推进、评论却没有入库的情况；返回的评论已写入队列，调用方不必再保存。
+            未设置时进度立即写入，评论由调用方保存
+        :param videos: 设置 writer 时使用，与最后一页评论、楼中楼和最终进度作为同一项写入的视频信息，
+            视频行入库时它的评论和完成标记一定已经提交；本方法正常返回即已入队。
+            设置 writer 时中途放弃（重试用尽等）抛出 DataFetchError，调用方不应把视频标记为完成
+        """
+        if video_info is None:
+            video_info = self.extra_video_info
         # 确保浏览器环境存活
         await self.ensure_browser_alive()
         
@@ -701,6 +2580,8 @@ class BilibiliCommentCrawler:
         # 如果已爬取数量超过限制，直接返回空列表
         if current_count >= self.max_comments_per_video:
             print(f"Reach maximum comments per video ({self.max_comments_per_video}) for {aid}. Skip")
+            if writer is not None and videos:
+                await writer.save_crawl_batch(list(videos), [])
             return []
         
         comments = []
@@ -712,6 +2593,10 @@ class BilibiliCommentCrawler:
         
         # 添加标志位控制是否达到限制
         reached_max = False
+        newest_ctime = 0  # 本次见到的最新评论时间，作为回访的水位线
+        sub_reply_roots = []  # 回复数达到阈值、需要抓取楼中楼的评论
+        # 最后一页的评论和进度，留到循环结束后与楼中楼、视频信息一起写入
+        last_page_comments, last_progress = [], []
         
         while not is_end and not reached_max:
             try:
@@ -723,6 +2608,8 @@ class BilibiliCommentCrawler:
                     next_page=next_page
                 )
                 retry_count = 0  # 重置重试计数
+                if self.response_archive:
+                    self.response_archive.append(KIND_REPLY, aid, comments_res, page=next_page)
                 
                 cursor_info = comments_res.get("cursor", {})
                 is_end = cursor_info.get("is_end", True)
@@ -740,25 +2627,23 @@ class BilibiliCommentCrawler:
                     rpid = comment.get("rpid")
                     if not rpid:
                         continue
+                    newest_ctime = max(newest_ctime, comment.get("ctime", 0))
                     # 检查是否已爬取过
                     if self.state_manager.is_rpid_exists(rpid):
+                        self.telemetry.observe_comments(0, 1)
                         continue
                         
                     # 创建评论数据
-                    comment_data = {
-                        "rpid": rpid,
-                        "aid": aid,
-                        "comment": comment.get("content", {}).get("message", ""),
-                        "ctime": comment.get("ctime", 0),
-                        "category": self.extra_video_info.get('category', 'unknown'),
-                        "is_hot": self.extra_video_info.get('is_hot', False)
-                    }
+                    comment_data = self.to_comment_data(aid, comment, video_info)
                     
                     # 添加到结果
                     if all([comment_data["rpid"], comment_data["aid"], comment_data["comment"]]):
                         page_comments.append(comment_data)
                         self.state_manager.add_rpid(rpid)
                         current_count += 1
+                        if self.sub_reply_threshold is not None and \
+                                comment.get("rcount", 0) >= self.sub_reply_threshold:
+                            sub_reply_roots.append(rpid)
                     
                     # 检查是否达到最大限制 - 设置标志位
                     if current_count >= self.max_comments_per_video:
@@ -773,28 +2658,40 @@ class BilibiliCommentCrawler:
                 print(f"Video {aid} Page {next_page}: obtain {len(page_comments)} comments. Total: {current_count}/{self.max_comments_per_video}")
                 
                 # 保存当前进度
-                self.state_manager.update_video_progress(aid, next_page, current_count)
+                if writer is None:
+                    self.state_manager.update_video_progress(aid, next_page, current_count, newest_ctime)
+                elif is_end or reached_max:
+                    last_page_comments = page_comments
+                    last_progress = [CrawlerStateManager.progress_row(aid, next_page, current_count, newest_ctime)]
+                else:
+                    progress_row = CrawlerStateManager.progress_row(aid, next_page, current_count, newest_ctime)
+                    await writer.save_crawl_batch([], page_comments, [progress_row])
                 
                 # 如果达到限制，跳出主循环
                 if reached_max:
                     break
                 
-                # 随机延迟
-                delay = random.uniform(0.8, 1.5)
-                await asyncio.sleep(delay)
+                # 随机延迟（有全局限速器时由其控制节奏）
+                if self.rate_limiter is None:
+                    delay = random.uniform(0.8, 1.5)
+                    await self.telemetry.sleep(delay)
                 
-            except DataFetchError as e:
+            except (DataFetchError, httpx.HTTPError) as e:
+                # 连接错误、超时等传输错误与API错误一样计入重试次数并退避
                 retry_count += 1
                 if retry_count >= max_retries:
                     print(f"Request failed when fetching comments of {aid}. Skip this video: {str(e)}")
                     break
                 
-                # 指数退避重试
-                delay = 2 ** retry_count + random.uniform(0, 1)
+                # 指数退避重试（限流响应由自适应限速器降速暂停）
+                delay = retry_delay(self.rate_limiter, retry_count, is_throttle_error(e))
                 print(f"Request failed. Retry after{delay:.2f} seconds (Try {retry_count}/{max_retries})...")
-                await asyncio.sleep(delay)
+                await self.telemetry.sleep(delay)
             except Exception as e:
                 print(f"Unexpected error when fetching comments: {e}")
+                retry_count += 1
+                if retry_count >= max_retries:
+                    break
                 # 尝试重新初始化浏览器
                 try:
                     await self.ensure_browser_alive()
@@ -802,24 +2699,430 @@ class BilibiliCommentCrawler:
                     print(f"Failed to reinitialize browser: {e2}")
                     break
         
-        # 如果已结束，标记为完成
-        if is_end and not reached_max:
+        # 楼中楼不计入 max_comments_per_video，也不需要额外的视频详情请求
+        sub_replies = []
+        if sub_reply_roots:
+            sub_replies = await self.get_sub_replies(aid, sub_reply_roots, video_info)
+            comments.extend(sub_replies)
+
+        # 如果已结束，标记为完成（与最后一页、楼中楼和视频信息一起写入）
+        finished = is_end and not reached_max
+        if finished:
             print(f"Fetched all comments from {aid} ({current_count} in total)")
-            self.state_manager.update_video_progress(aid, 0, current_count)
-        
+        if writer is not None:
+            if finished:
+                last_progress = [CrawlerStateManager.progress_row(aid, 0, current_count, newest_ctime)]
+            final_comments = last_page_comments + sub_replies
+            # 中途放弃时视频没有最后一页，视频信息不入库
+            final_videos = list(videos) if finished or reached_max else []
+            if final_videos or final_comments or last_progress:
+                await writer.save_crawl_batch(final_videos, final_comments, last_progress)
+        elif finished:
+            self.state_manager.update_video_progress(aid, 0, current_count, newest_ctime)
+        if writer is not None and not finished and not reached_max:
+            # 重试用尽或响应格式错误时中途放弃：已入队的评论和进度照常提交，但视频没有完成也没有入库
+            raise DataFetchError(f"Gave up fetching comments of {aid} at page {next_page}")
+
+        return comments
+
+    async def get_sub_replies(self, aid: str, roots: List[int], video_info: Dict) -> List[Dict]:
+        """并发抓取多条评论的楼中楼回复"""
+        semaphore = asyncio.Semaphore(self.sub_reply_concurrency)
+
+        async def fetch(root):
+            async with semaphore:
+                return await self.get_root_sub_replies(aid, root, video_info)
+
+        # 单条评论的楼中楼出错（如解析异常）只丢弃这一条评论下的回复
+        results = await asyncio.gather(*(fetch(root) for root in roots), return_exceptions=True)
+        sub_replies = []
+        for root, replies in zip(roots, results):
+            if isinstance(replies, Exception):
+                print(f"Failed to fetch sub-replies of {root}: {replies}")
+                continue
+            sub_replies.extend(replies)
+        print(f"Video {aid}: obtain {len(sub_replies)} sub-replies under {len(roots)} comments")
+        return sub_replies
+
+    async def get_root_sub_replies(self, aid: str, root: int, video_info: Dict) -> List[Dict]:
+        """
+        逐页抓取一条评论下的楼中楼回复，最多 max_sub_replies_per_root 条。
+        请求失败时返回已抓取的部分，不影响同一视频的其他评论和楼中楼
+        """
+        replies = []
+        page = 1
+        max_retries = 3
+        retry_count = 0
+
+        while len(replies) < self.max_sub_replies_per_root:
+            try:
+                res = await self.client.get_sub_comments(aid, root, page)
+                if self.response_archive:
+                    self.response_archive.append(KIND_SUB_REPLY, aid, res, page=page, root=root)
+            except (DataFetchError, httpx.HTTPError) as e:
+                retry_count += 1
+                if retry_count >= max_retries:
+                    print(f"Request failed when fetching sub-replies of {root}: {str(e)}")
+                    break
+                await self.telemetry.sleep(retry_delay(self.rate_limiter, retry_count, is_throttle_error(e)))
+                continue
+            except Exception as e:
+                print(f"Unexpected error when fetching sub-replies of {root}: {e}")
+                break
+            retry_count = 0
+
+            reply_list = res.get("replies") or []
+            for comment in reply_list:
+                rpid = comment.get("rpid")
+                if not rpid:
+                    continue
+                if self.state_manager.is_rpid_exists(rpid):
+                    self.telemetry.observe_comments(0, 1)
+                    continue
+                comment_data = self.to_comment_data(aid, comment, video_info, parent=comment.get("parent") or root)
+                if comment_data["comment"]:
+                    replies.append(comment_data)
+                    self.state_manager.add_rpid(rpid)
+                    if len(replies) >= self.max_sub_replies_per_root:
+                        break
+
+            page_info = res.get("page", {})
+            if not reply_list or page * page_info.get("size", 20) >= page_info.get("count", 0):
+                break
+            page += 1
+
+            if self.rate_limiter is None:
+                await self.telemetry.sleep(random.uniform(0.8, 1.5))
+
+        return replies
+
+    @staticmethod
+    def to_comment_data(aid: str, comment: Dict, video_info: Dict, parent: int = 0) -> Dict:
+        """API返回的评论转换为入库格式，parent 为楼中楼回复所属评论的rpid"""
+        return {
+            "rpid": comment.get("rpid"),
+            "aid": aid,
+            "comment": comment.get("content", {}).get("message", ""),
+            "ctime": comment.get("ctime", 0),
+            "category": video_info.get('category', 'unknown'),
+            "is_hot": video_info.get('is_hot', False),
+            "parent": parent,
+        }
+
+    async def recrawl_video_comments(
+        self,
+        aid: str,
+        video_info: Dict,
+        writer: Optional[AsyncCommentWriter] = None,
+    ) -> List[Dict]:
+        """
+        回访已爬过的视频：按时间从新到旧获取评论，遇到不晚于水位线的评论即停止，
+        每次回访最多获取 max_comments_per_video 条新评论。
+        达到上限时还没到水位线，则保存续爬页码而不推进水位线，下次回访从该页继续；
+        新评论只会把旧评论推向后面的页，从保存的页码继续不会漏掉评论
+        :param writer: 设置后由这里保存新评论，提交成功后才记录水位线或续爬位置；
+            未设置时评论由调用方保存
+        """
+        await self.ensure_browser_alive()
+
+        watermark = self.state_manager.get_newest_ctime(aid)
+        resume_page, pending_newest = self.state_manager.get_recrawl_cursor(aid)
+        newest_ctime = max(watermark, pending_newest)
+        comments = []
+        page = resume_page if resume_page is not None else 0
+        max_retries = 3
+        retry_count = 0
+
+        while True:
+            try:
+                comments_res = await self.client.get_video_comments(
+                    video_id=aid, next_page=page, mode=COMMENT_MODE_TIME
+                )
+                if self.response_archive:
+                    self.response_archive.append(KIND_REPLY_TIME, aid, comments_res, page=page)
+            except (DataFetchError, httpx.HTTPError) as e:
+                retry_count += 1
+                if retry_count >= max_retries:
+                    # 不推进水位线，下次回访从原来的位置重新开始
+                    print(f"Request failed when recrawling {aid}. Skip this video: {str(e)}")
+                    return comments
+                await self.telemetry.sleep(retry_delay(self.rate_limiter, retry_count, is_throttle_error(e)))
+                continue
+            retry_count = 0
+
+            reached_watermark = False
+            reached_max = False
+            for comment in comments_res.get("replies") or []:
+                ctime = comment.get("ctime", 0)
+                if ctime <= watermark:
+                    reached_watermark = True
+                    break
+                newest_ctime = max(newest_ctime, ctime)
+                rpid = comment.get("rpid")
+                if not rpid:
+                    continue
+                if self.state_manager.is_rpid_exists(rpid):
+                    self.telemetry.observe_comments(0, 1)
+                    continue
+                comment_data = self.to_comment_data(aid, comment, video_info)
+                if comment_data["comment"]:
+                    comments.append(comment_data)
+                    self.state_manager.add_rpid(rpid)
+                    if len(comments) >= self.max_comments_per_video:
+                        reached_max = True
+                        break
+
+            cursor_info = comments_res.get("cursor", {})
+            if reached_max:
+                # 本页剩余的评论尚未处理，下次从本页继续（已保存的rpid会被跳过）
+                if await self._save_recrawled(aid, comments, writer):
+                    self.state_manager.record_recrawl(aid, newest_ctime, len(comments), resume_page=page)
+                print(f"Recrawled {aid}: {len(comments)} new comments, paused at page {page} before watermark {watermark}")
+                return comments
+            if reached_watermark or cursor_info.get("is_end", True):
+                break
+            page = cursor_info.get("next", 0)
+
+            if self.rate_limiter is None:
+                await self.telemetry.sleep(random.uniform(0.8, 1.5))
+
+        if await self._save_recrawled(aid, comments, writer):
+            self.state_manager.record_recrawl(aid, newest_ctime, len(comments))
+        print(f"Recrawled {aid}: {len(comments)} new comments since {watermark}")
         return comments
 
+    async def _save_recrawled(self, aid: str, comments: List[Dict], writer: Optional[AsyncCommentWriter]) -> bool:
+        """回访的新评论加入写入队列并等待提交；返回是否可以推进水位线"""
+        if writer is None:
+            return True
+        await writer.save_comments_batch(comments)
+        try:
+            await writer.flush()
+        except DataWriteError as e:
+            print(f"Recrawl of {aid} not recorded: {e}")
+            return False
+        return True
+
+# 分区调度器：在比例约束下把爬取预算分配给单位请求收益最高的分区
+class CategoryScheduler:
+    """
+    每个分区是一个老虎机臂，收益 = 新评论数 + ngram_weight * 新出现的字符n-gram数，
+    按每次API请求的平均收益做UCB1选择；分区占比低于目标比例超过容差时强制补足，
+    高于目标比例超过容差时暂不选择。各分区视频数只在开始时读一次数据库，之后在内存中增量更新
+    """
+    def __init__(
+        self,
+        target_ratios: Dict[str, float],
+        counts: Optional[Dict[str, int]] = None,
+        ratio_tolerance: float = 0.05,
+        exploration: float = 1.0,
+        ngram_weight: float = 0.2,
+        ngram_sizes: Tuple[int, ...] = (2, 3),
+    ):
+        """
+        :param target_ratios: 各分区的目标视频比例
+        :param counts: 各分区当前的视频数
+        :param ratio_tolerance: 实际占比偏离目标比例的容差
+        :param exploration: UCB探索系数
+        :param ngram_weight: 每个新n-gram相对一条新评论的收益权重
+        :param ngram_sizes: 统计新颖度的n-gram长度
+        """
+        self.target_ratios = target_ratios
+        self.counts = dict(counts or {})
+        self.ratio_tolerance = ratio_tolerance
+        self.exploration = exploration
+        self.ngram_weight = ngram_weight
+        self.ngram_sizes = ngram_sizes
+
+        self.pulls = {category: 0 for category in target_ratios}
+        self.requests = {category: 0 for category in target_ratios}
+        self.new_comments = {category: 0 for category in target_ratios}
+        self.novel_ngrams = {category: 0 for category in target_ratios}
+        self.seen_ngrams = RpidBloomFilter(capacity=2_000_000)
+
+    def record_video(self, category: str):
+        """采集到一个视频后更新分区计数"""
+        self.counts[category] = self.counts.get(category, 0) + 1
+
+    def count_novel_ngrams(self, comments: Iterable[str]) -> int:
+        """统计并记住评论中首次出现的n-gram数量（布隆过滤器，可能略有低估）"""
+        novel = 0
+        for text in comments:
+            for n in self.ngram_sizes:
+                for i in range(len(text) - n + 1):
+                    key = hash(text[i:i + n]) & 0xFFFFFFFFFFFFFFFF
+                    if key not in self.seen_ngrams:
+                        self.seen_ngrams.add(key)
+                        novel += 1
+        return novel
+
+    def record_batch(self, category: str, requests: int, comments: List[str]):
+        """记录一批采集的收益：消耗的请求数和得到的新评论"""
+        self.pulls[category] = self.pulls.get(category, 0) + 1
+        self.requests[category] = self.requests.get(category, 0) + max(1, requests)
+        self.new_comments[category] = self.new_comments.get(category, 0) + len(comments)
+        self.novel_ngrams[category] = self.novel_ngrams.get(category, 0) + self.count_novel_ngrams(comments)
+
+    def yield_per_request(self, category: str) -> float:
+        if not self.requests.get(category):
+            return 0.0
+        reward = self.new_comments[category] + self.ngram_weight * self.novel_ngrams[category]
+        return reward / self.requests[category]
+
+    def shares(self) -> Dict[str, float]:
+        total = sum(self.counts.get(category, 0) for category in self.target_ratios)
+        if total == 0:
+            return {category: 0.0 for category in self.target_ratios}
+        return {category: self.counts.get(category, 0) / total for category in self.target_ratios}
+
+    def next_category(self) -> str:
+        """选择下一批要采集的分区"""
+        shares = self.shares()
+
+        # 比例约束：严重不足的分区优先补足
+        deficits = [
+            (target - shares[category], category)
+            for category, target in self.target_ratios.items()
+            if target - shares[category] > self.ratio_tolerance
+        ]
+        if deficits:
+            return max(deficits)[1]
+
+        # 其余未明显超额的分区按UCB1选择，未尝试过的分区先各试一次
+        eligible = [
+            category for category, target in self.target_ratios.items()
+            if shares[category] - target <= self.ratio_tolerance
+        ] or list(self.target_ratios)
+        untried = [category for category in eligible if not self.pulls.get(category)]
+        if untried:
+            return random.choice(untried)
+
+        yields = {category: self.yield_per_request(category) for category in eligible}
+        best_yield = max(yields.values()) or 1.0
+        total_pulls = sum(self.pulls[category] for category in eligible)
+
+        def ucb(category):
+            bonus = self.exploration * math.sqrt(math.log(total_pulls) / self.pulls[category])
+            return yields[category] / best_yield + bonus
+
+        return max(eligible, key=ucb)
+
+    def summary(self) -> str:
+        lines = []
+        shares = self.shares()
+        for category, target in self.target_ratios.items():
+            lines.append(
+                f"{category}: {self.counts.get(category, 0)} videos "
+                f"({shares[category]:.0%} / target {target:.0%}), "
+                f"{self.requests.get(category, 0)} requests, "
+                f"{self.new_comments.get(category, 0)} comments, "
+                f"{self.novel_ngrams.get(category, 0)} new n-grams, "
+                f"yield {self.yield_per_request(category):.2f}/request"
+            )
+        return "\n".join(lines)
+
+# 各目标分区对应的分区ID（'other' 不对应具体分区）
+CATEGORY_TID_MAP = {
+    'kichiku': [119],    # 鬼畜区
+    'music': [3],        # 音乐区
+    'game': [4],         # 游戏区
+    'life': [160],       # 生活区
+    'knowledge': [36,188],   # 知识区
+    'film': [167,117,13,11,23], #影视区
+    'other': [0]
+}
+
+# 子分区ID到目标分区的映射
+CATEGORY_SUBTID_MAP = {
+    # 生活区
+    160: "life", 138: "life", 239: "life", 161: "life", 162: "life", 21: "life",
+
+    # 游戏区
+    4: "game", 17: "game", 65: "game", 172: "game",
+    171: "game", 173: "game", 136: "game", 121: "game", 19: "game",
+
+    # 音乐区
+    3: "music", 130: "music", 29: "music", 59: "music",
+    31: "music", 193: "music", 30: "music", 194: "music", 28: "music",
+
+    # 知识区 + 科技整合
+    36: "knowledge", 201: "knowledge", 124: "knowledge", 228: "knowledge",
+    207: "knowledge", 208: "knowledge", 209: "knowledge", 229: "knowledge",
+    122: "knowledge", 95: "knowledge", 230: "knowledge", 231: "knowledge",
+    232: "knowledge", 233: "knowledge",
+
+    # 影视类（合并番剧、国创、电视剧、纪录片、电影）
+    51: "film", 32: "film", 33: "film", 153: "film", 168: "film", 169: "film",
+    170: "film", 195: "film", 185: "film", 187: "film", 23: "film", 83: "film",
+    145: "film", 146: "film", 147: "film", 177: "film", 182: "film", 37: "film",
+
+    # 鬼畜区（单独）
+    119: "kichiku", 22: "kichiku", 26: "kichiku", 126: "kichiku",
+    216: "kichiku", 127: "kichiku"
+
+}
+
+
 # 多分区热门视频采集器
 class MultiCategoryHotCrawler:
-    def __init__(self, db_connection, max_comments_per_video=50):
+    def __init__(self, db_connection, max_comments_per_video=50,
+                 max_concurrent_videos=1, requests_per_second=None,
+                 adaptive_rate=False, max_requests_per_second=3.0,
+                 api_host=API_HOST, data_dir=None,
+                 detail_concurrency=4, detail_cache_ttl=3600, detail_cache_size=2000,
+                 sub_reply_threshold=None, response_archive=None,
+                 telemetry=None, telemetry_file=None, rate_state_file=None):
+        """
+        :param db_connection: CommentDatabase 实例
+        :param max_comments_per_video: 每个视频最多爬取的评论数
+        :param max_concurrent_videos: 同时爬取评论的视频数
+        :param requests_per_second: 全局每秒请求数上限，设置后取代固定的随机等待
+        :param adaptive_rate: 根据API响应自动调整速率（AIMD），并在多次运行间保存学到的速率
+        :param max_requests_per_second: 自适应速率的上限
+        :param api_host: API地址，测试时可指向本地模拟服务器
+        :param data_dir: 评论爬虫的cookies和状态文件目录
+        :param detail_concurrency: 同时预取视频详情的请求数
+        :param detail_cache_ttl: 视频详情缓存秒数，出现在多个列表中的视频只查询一次
+        :param detail_cache_size: 视频详情缓存的最大条数，超过时淘汰最早缓存的详情
+        :param sub_reply_threshold: 回复数达到该值的评论再抓取楼中楼回复；None 表示不抓取
+        :param response_archive: ResponseArchive 实例，设置后保存视频详情和评论页的原始响应
+        :param telemetry: 运行指标，默认新建；会话、写入队列、评论爬虫和数据库共享同一实例
+        :param telemetry_file: 每次 crawl_strategically 结束后把指标快照写入该JSON文件
+        :param rate_state_file: 自适应速率的保存文件，默认为 data_dir（未设置时为 Data_Collection）下的 crawler_rate.json；
+            指向测试服务器时应设置 data_dir 或该参数，避免学到的速率影响正式采集
+        """
         self.db = db_connection
+        self.telemetry = telemetry or CrawlTelemetry()
+        self.telemetry_file = telemetry_file
+        if self.db.telemetry is None:
+            self.db.telemetry = self.telemetry
         self.max_comments_per_video = max_comments_per_video
+        self.api_host = api_host
+        self.data_dir = data_dir
+        self.sub_reply_threshold = sub_reply_threshold
+        self.response_archive = response_archive
+        self.max_concurrent_videos = max(1, max_concurrent_videos)
+        if adaptive_rate:
+            self.rate_limiter = AdaptiveRateLimiter(
+                requests_per_second or 1.0,
+                max_rate=max_requests_per_second,
+                state_file=rate_state_file or os.path.join(
+                    data_dir or os.path.join(BASEDIR, "Data_Collection"), "crawler_rate.json"
+                ),
+            )
+        elif requests_per_second:
+            self.rate_limiter = TokenBucketLimiter(requests_per_second)
+        else:
+            self.rate_limiter = None
         self.session = None
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Referer': 'https://www.bilibili.com'
         }
         self.crawler = None  # 延迟初始化
+        self.writer: Optional[AsyncCommentWriter] = None
+        self.scheduler: Optional[CategoryScheduler] = None
+        self.request_count = 0  # 经共享会话发出的请求数，用于计算各分区的单位请求收益
         
         # 定义目标分区及其比例
         self.target_ratios = {
@@ -832,91 +3135,45 @@ class MultiCategoryHotCrawler:
             'other':0.05
         }
         
-        self.category_tid_map = {
-            'kichiku': [119],    # 鬼畜区
-            'music': [3],        # 音乐区
-            'game': [4],         # 游戏区
-            'life': [160],       # 生活区
-            'knowledge': [36,188],   # 知识区
-            'film': [167,117,13,11,23], #影视区
-            'other': [0]
-        }
-
-        # 分区ID映射
-        self.category_subtid_map = {
-            # 生活区
-            160: "life", 138: "life", 239: "life", 161: "life", 162: "life", 21: "life",
-
-            # 游戏区
-            4: "game", 17: "game", 65: "game", 172: "game",
-            171: "game", 173: "game", 136: "game", 121: "game", 19: "game",
-
-            # 音乐区
-            3: "music", 130: "music", 29: "music", 59: "music",
-            31: "music", 193: "music", 30: "music", 194: "music", 28: "music",
-
-            # 知识区 + 科技整合
-            36: "knowledge", 201: "knowledge", 124: "knowledge", 228: "knowledge",
-            207: "knowledge", 208: "knowledge", 209: "knowledge", 229: "knowledge",
-            122: "knowledge", 95: "knowledge", 230: "knowledge", 231: "knowledge",
-            232: "knowledge", 233: "knowledge",
-
-            # 影视类（合并番剧、国创、电视剧、纪录片、电影）
-            51: "film", 32: "film", 33: "film", 153: "film", 168: "film", 169: "film",
-            170: "film", 195: "film", 185: "film", 187: "film", 23: "film", 83: "film",
-            145: "film", 146: "film", 147: "film", 177: "film", 182: "film", 37: "film",
-
-            # 鬼畜区（单独）
-            119: "kichiku", 22: "kichiku", 26: "kichiku", 126: "kichiku",
-            216: "kichiku", 127: "kichiku"
-
-        }
+        self.category_tid_map = CATEGORY_TID_MAP
+        self.category_subtid_map = CATEGORY_SUBTID_MAP
         
         # 热门视频API端点
         self.hot_video_apis = {
-            'popular': 'https://api.bilibili.com/x/web-interface/popular',
-            'weekly': 'https://api.bilibili.com/x/web-interface/popular/series/one',
-            'rank_all': 'https://api.bilibili.com/x/web-interface/ranking/v2',
+            'popular': f'{api_host}/x/web-interface/popular',
+            'weekly': f'{api_host}/x/web-interface/popular/series/one',
+            'rank_all': f'{api_host}/x/web-interface/ranking/v2',
         }
 
         self.existing_aids = set()
+        # 本进程已交给调度的种子视频，爬取失败的种子不会在同一次运行中反复出现
+        self._offered_seeds = set()
+        self._reinit_lock = asyncio.Lock()
+        self.journal = CrawlSessionJournal(self.db.db_file)
+
+        # 视频详情缓存 {aid: (过期时间, 详情)}，按写入顺序即过期顺序排列；进行中的查询 {aid: Task}
+        self.detail_concurrency = max(1, detail_concurrency)
+        self.detail_cache_ttl = detail_cache_ttl
+        self.detail_cache_size = max(1, detail_cache_size)
+        self._detail_cache: Dict[int, Tuple[float, Dict]] = OrderedDict()
+        self._detail_tasks: Dict[int, asyncio.Task] = {}
+        self._detail_semaphore = asyncio.Semaphore(self.detail_concurrency)
     
     async def init_session(self):
-        """初始化HTTP会话"""
-        self.session = httpx.AsyncClient(headers=self.headers, timeout=30.0)
+        """初始化HTTP会话（连接池由列表、详情和评论请求共享）"""
+        if self.session is None or self.session.is_closed:
+            self.session = create_http_client(headers=self.headers, timeout=30.0, rate_limiter=self.rate_limiter)
+            self.session.event_hooks["request"].append(self._count_request)
+            self.telemetry.install(self.session)
+
+    async def _count_request(self, request: httpx.Request):
+        self.request_count += 1
     
     async def close_session(self):
         """关闭HTTP会话"""
-        if self.session:
+        if self.session and not self.session.is_closed:
             await self.session.aclose()
     
-    def calculate_next_category(self, current_counts):
-        """根据当前比例计算下一个应该采集的分区"""
-        total_videos = sum(current_counts.values())
-        if total_videos == 0:
-            return random.choice(list(self.target_ratios.keys()))
-        
-        # 计算各分区的当前比例
-        current_ratios = {}
-        for category, target_ratio in self.target_ratios.items():
-            current_count = current_counts.get(category, 0)
-            current_ratios[category] = current_count / total_videos
-        
-        # 找出比例最低于目标的分区
-        deficit_categories = []
-        for category, target_ratio in self.target_ratios.items():
-            deficit = target_ratio - current_ratios.get(category, 0)
-            if deficit > 0:
-                deficit_categories.append((category, deficit))
-        
-        # 按赤字大小排序，优先采集赤字最大的分区
-        if deficit_categories:
-            deficit_categories.sort(key=lambda x: x[1], reverse=True)
-            return deficit_categories[0][0]
-        
-        # 如果所有分区都达到或超过目标，随机选择一个
-        return random.choice(list(self.target_ratios.keys()))
-    
     async def get_hot_videos(self, source_type='popular', count=20):
         """获取热门视频列表"""
         if source_type not in self.hot_video_apis:
@@ -945,7 +3202,7 @@ class MultiCategoryHotCrawler:
             raise ValueError(f"Unknown category: {category}")
         
         tid = random.choice(self.category_tid_map[category])
-        url = "https://api.bilibili.com/x/web-interface/dynamic/region"
+        url = f"{self.api_host}/x/web-interface/dynamic/region"
         params = {'rid': tid, 'ps': count}
         
         try:
@@ -983,41 +3240,106 @@ class MultiCategoryHotCrawler:
         # 随机打乱视频顺序
         random.shuffle(all_videos)
         
-        other_videos = []
+        candidates = []
+        seen_aids = self.existing_aids | self.db.filter_existing_aids(video['aid'] for video in all_videos)
         for video in all_videos:
-            if len(other_videos) >= count:
-                break
-                
             aid = video['aid']
-            if aid in self.existing_aids:
+            if aid in seen_aids:
                 continue
+            seen_aids.add(aid)
+            candidates.append(video)
 
-            # 获取视频详细信息
-            video_detail = await self.get_video_detail(aid)
-            if not video_detail:  # 如果获取失败，跳过
-                continue
-                
-            # 检测分区
-            detected_category = self.detect_category(video_detail)
-            
-            # 如果不是已知分区，则归类为"other"
-            if detected_category == 'other':
-                other_videos.append(video)
+        # 按批并发获取详情，凑够数量后停止；已获取的详情留在缓存中供后续处理使用
+        other_videos = []
+        chunk_size = self.detail_concurrency
+        for start in range(0, len(candidates), chunk_size):
+            if len(other_videos) >= count:
+                break
+            chunk = candidates[start:start + chunk_size]
+            details = await asyncio.gather(*(self.get_video_detail(video['aid']) for video in chunk))
+            for video, video_detail in zip(chunk, details):
+                if len(other_videos) >= count:
+                    break
+                if not video_detail:  # 如果获取失败，跳过
+                    continue
+                # 如果不是已知分区，则归类为"other"
+                if self.detect_category(video_detail) == 'other':
+                    other_videos.append(video)
         
         # 如果仍然没有找到足够的"other"视频，返回一些热门视频
         if len(other_videos) < count:
             hot_videos = await self.get_hot_videos('popular', count)
+            existing = self.existing_aids | self.db.filter_existing_aids(video['aid'] for video in hot_videos)
             for video in hot_videos:
                 if len(other_videos) >= count:
                     break
-                if video['aid'] not in self.existing_aids:
+                if video['aid'] not in existing:
                     other_videos.append(video)
         
         return other_videos
     
     async def get_video_detail(self, aid):
-        """获取视频详细信息"""
-        url = f"https://api.bilibili.com/x/web-interface/view?aid={aid}"
+        """获取视频详细信息：优先使用缓存，同一aid的并发查询共用一个请求"""
+        cached = self.cached_video_detail(aid)
+        if cached is not None:
+            return cached
+        # 不随调用方一起取消，其他等待同一aid的任务仍能拿到结果
+        return await asyncio.shield(self._detail_task(aid))
+
+    def prefetch_video_details(self, aids):
+        """在后台并发获取一批视频的详情（并发数受 detail_concurrency 限制）"""
+        for aid in aids:
+            if self.cached_video_detail(aid) is None:
+                self._detail_task(aid)
+
+    def cached_video_detail(self, aid) -> Optional[Dict]:
+        """未过期的缓存详情，没有则返回None"""
+        cached = self._detail_cache.get(aid)
+        if cached is None:
+            return None
+        if cached[0] <= time.time():
+            del self._detail_cache[aid]
+            return None
+        return cached[1]
+
+    def _detail_task(self, aid) -> asyncio.Task:
+        """该aid进行中的详情查询，没有则新建"""
+        task = self._detail_tasks.get(aid)
+        if task is None:
+            task = asyncio.create_task(self._fetch_video_detail(aid))
+            self._detail_tasks[aid] = task
+            task.add_done_callback(lambda _: self._detail_tasks.pop(aid, None))
+        return task
+
+    async def cancel_prefetch(self):
+        """取消尚未完成的详情预取"""
+        tasks = list(self._detail_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _fetch_video_detail(self, aid):
+        """请求视频详情并写入缓存，失败返回空字典（不缓存）"""
+        async with self._detail_semaphore:
+            detail = await self._request_video_detail(aid)
+        if detail:
+            self.cache_video_detail(aid, detail)
+        return detail
+
+    def cache_video_detail(self, aid, detail: Dict):
+        """写入缓存并淘汰过期的详情；长时间运行时缓存不超过 detail_cache_size 条"""
+        now = time.time()
+        self._detail_cache[aid] = (now + self.detail_cache_ttl, detail)
+        self._detail_cache.move_to_end(aid)
+        # 所有条目的TTL相同，最早写入的最先过期
+        while self._detail_cache:
+            oldest_aid, (expire_at, _) = next(iter(self._detail_cache.items()))
+            if expire_at > now and len(self._detail_cache) <= self.detail_cache_size:
+                break
+            del self._detail_cache[oldest_aid]
+
+    async def _request_video_detail(self, aid):
+        url = f"{self.api_host}/x/web-interface/view?aid={aid}"
         
         max_retries = 3
         retry_count = 0
@@ -1029,7 +3351,7 @@ class MultiCategoryHotCrawler:
                 if response.status_code != 200:
                     print(f"Error: Received status code {response.status_code} for aid {aid}")
                     retry_count += 1
-                    await asyncio.sleep(2 ** retry_count)  # 指数退避
+                    await self.telemetry.sleep(retry_delay(self.rate_limiter, retry_count, throttled=True))  # 指数退避
                     continue
                     
                 # 检查响应内容是否为JSON
@@ -1037,12 +3359,14 @@ class MultiCategoryHotCrawler:
                 if 'application/json' not in content_type:
                     print(f"Error: Non-JSON response for aid {aid}, content-type: {content_type}")
                     retry_count += 1
-                    await asyncio.sleep(2 ** retry_count)
+                    await self.telemetry.sleep(retry_delay(self.rate_limiter, retry_count, throttled=True))
                     continue
                 
                 data = response.json()
                 
                 if data.get('code') == 0:
+                    if self.response_archive:
+                        self.response_archive.append(KIND_VIEW, aid, data.get('data', {}))
                     return data.get('data', {})
                 else:
                     print(f"API Error for aid {aid}: {data.get('message')}")
@@ -1050,11 +3374,13 @@ class MultiCategoryHotCrawler:
             except json.JSONDecodeError:
                 print(f"JSON decode error for aid {aid}, retrying...")
                 retry_count += 1
-                await asyncio.sleep(2 ** retry_count)
+                await self.telemetry.sleep(retry_delay(self.rate_limiter, retry_count, throttled=True))
             except Exception as e:
                 print(f"Error fetching video detail for aid {aid}: {e}")
+                if isinstance(e, httpx.HTTPError):
+                    self.telemetry.observe_transport_error(CrawlTelemetry.endpoint(url), e)
                 retry_count += 1
-                await asyncio.sleep(2 ** retry_count)
+                await self.telemetry.sleep(retry_delay(self.rate_limiter, retry_count))
         
         print(f"Failed to get video detail for aid {aid} after {max_retries} retries")
         return {}
@@ -1076,126 +3402,389 @@ class MultiCategoryHotCrawler:
         # 简单的热门判断逻辑
         return view > 100000 or like > 1000 or reply > 500
 
-    async def crawl_strategically(self, total_videos=100):
-        """智能策略采集视频，保持各分区比例"""
+    def new_comment_crawler(self) -> BilibiliCommentCrawler:
+        """创建共享连接池和限速器的评论爬虫"""
+        return BilibiliCommentCrawler(
+            [], self.max_comments_per_video,
+            http_client=self.session, rate_limiter=self.rate_limiter,
+            db_file=self.db.db_file, data_dir=self.data_dir, api_host=self.api_host,
+            sub_reply_threshold=self.sub_reply_threshold, response_archive=self.response_archive,
+            telemetry=self.telemetry
+        )
+
+    async def reinit_comment_crawler(self, broken_crawler: BilibiliCommentCrawler):
+        """浏览器意外关闭时重建评论爬虫；并发任务中只重建一次"""
+        async with self._reinit_lock:
+            if self.crawler is not broken_crawler:
+                return
+            print("Browser closed unexpectedly. Reinitializing...")
+            with self.telemetry.timed(PHASE_BROWSER_RESTART):
+                await self.crawler.close()
+                self.crawler = self.new_comment_crawler()
+                await self.crawler.start()
+
+    async def resolve_video_info(self, aid, is_hot) -> Optional[Dict]:
+        """获取视频详情并检测分区和热门状态，返回 video_info 记录；详情获取失败返回None"""
+        video_detail = await self.get_video_detail(aid)
+        if not video_detail:
+            return None
+        return {
+            'aid': aid,
+            'title': video_detail.get('title', ''),
+            'category': self.detect_category(video_detail),
+            'is_hot': self.is_hot_video(video_detail) or is_hot,
+            'view_count': video_detail.get('stat', {}).get('view', 0),
+            'like_count': video_detail.get('stat', {}).get('like', 0),
+            'comment_count': video_detail.get('stat', {}).get('reply', 0),
+        }
+
+    async def process_video(self, aid, is_hot, writer: AsyncCommentWriter,
+                            video_info: Optional[Dict] = None,
+                            session_id: Optional[int] = None) -> Optional[Tuple[str, List[Dict]]]:
+        """
+        获取视频详情、保存视频信息并爬取评论，返回 (检测到的分区, 新评论)；详情获取失败返回None，
+        评论爬取出错时抛出异常，视频保持未完成
+        :param video_info: 恢复会话时已获取的视频信息，提供时不再查询详情
+        :param session_id: 采集会话ID，设置后在会话日志中记录详情和失败状态
+        """
+        if video_info is None:
+            video_info = await self.resolve_video_info(aid, is_hot)
+            if video_info is None:
+                if session_id is not None:
+                    self.journal.mark_failed(session_id, aid)
+                return None
+            if session_id is not None:
+                self.journal.record_detail(session_id, aid, video_info)
+        detected_category = video_info['category']
+        detected_hot = video_info['is_hot']
+        
+        crawler = self.crawler
+        comments = []
+        try:
+            # 爬取评论，分类和热门标记随调用传入，便于并发；每页评论与爬取进度一起写入队列，
+            # 视频信息与最后一页评论和完成标记在同一个事务中提交
+            comments = await crawler.get_video_comments(aid, video_info={
+                'category': detected_category,
+                'is_hot': detected_hot
+            }, writer=writer, videos=[video_info])
+        except Exception as e:
+            print(f"Error fetching comments for video {aid}: {e}")
+            # 检查是否是浏览器关闭的错误
+            if "Target page, context or browser has been closed" in str(e):
+                await self.reinit_comment_crawler(crawler)
+            # 爬取中途出错时不写入视频信息，它只随最后一页评论提交；详情已记录在会话日志中，
+            # 已入队的评论和进度照常提交，重试时从保存的进度继续
+            raise
+        
+        return detected_category, comments
+
+    async def begin_run(self) -> AsyncCommentWriter:
+        """一次采集开始：打开会话和写入队列，创建评论爬虫"""
         await self.init_session()
-        
+        # 数据库写入交给后台任务，网络请求不必等待磁盘
+        writer = AsyncCommentWriter(self.db.db_file, telemetry=self.telemetry)
+        self.writer = writer
+        await writer.start()
+
+        # 只创建一个crawler实例
+        if self.crawler is None:
+            self.crawler = self.new_comment_crawler()
+            await self.crawler.start()
+        return writer
+
+    async def end_run(self):
+        """一次采集结束：写完数据并释放会话、浏览器等资源"""
+        await self.cancel_prefetch()
         try:
-            # 获取当前各分区的视频数量
-            current_counts = self.db.get_video_count_by_category()
-            existing_aids = self.db.get_existing_aids()
-            self.existing_aids = existing_aids  # 更新实例变量
-            
-            # 只创建一个crawler实例
-            if self.crawler is None:
-                self.crawler = BilibiliCommentCrawler([], self.max_comments_per_video)
-                await self.crawler.setup_browser()
-                await self.crawler.login_if_needed()
-                await self.crawler.create_client()
+            if self.writer:
+                await self.writer.close()
+        except DataWriteError as e:
+            print(e)
+        await self.close_session()
+        if isinstance(self.rate_limiter, AdaptiveRateLimiter):
+            self.rate_limiter.save()
+        if self.crawler:
+            await self.crawler.close()
+            # 会话已关闭，下次采集重新创建爬虫
+            self.crawler = None
+        if self.response_archive:
+            self.response_archive.close()
+
+    async def recrawl_hot_videos(self, max_videos=50, min_interval_hours=6):
+        """
+        回访已爬过的热门视频，按近期评论速度优先，只获取水位线之后的新评论
+        :param max_videos: 本次最多回访的视频数
+        :param min_interval_hours: 同一视频两次回访的最小间隔
+        :return: 获取的新评论数
+        """
+        try:
+            writer = await self.begin_run()
+            candidates = self.crawler.state_manager.get_recrawl_candidates(
+                limit=max_videos, min_interval=min_interval_hours * 3600
+            )
+            print(f"Recrawling {len(candidates)} hot videos")
+
+            semaphore = asyncio.Semaphore(self.max_concurrent_videos)
+            total_new = 0
+
+            async def recrawl_one(aid, category):
+                nonlocal total_new
+                async with semaphore:
+                    try:
+                        # 新评论提交后才推进该视频的水位线
+                        comments = await self.crawler.recrawl_video_comments(
+                            aid, {'category': category, 'is_hot': True}, writer=writer
+                        )
+                    except Exception as e:
+                        print(f"Error recrawling video {aid}: {e}")
+                        return
+                    total_new += len(comments)
+
+            await asyncio.gather(*(recrawl_one(aid, category) for aid, category, _ in candidates))
+            print(f"Recrawl finished: {total_new} new comments from {len(candidates)} videos")
+            return total_new
+        finally:
+            await self.end_run()
+
+    async def list_category_videos(self, category, batch_size, total_videos) -> Tuple[List[Dict], bool]:
+        """
+        获取一批待采集的视频列表，返回 (视频列表, 是否热门)；使用 self.scheduler 中的分区计数
+        该分区有尚未交给调度的种子视频时先返回种子
+        """
+        seeds = [
+            video for video in self.db.get_seed_videos(category, batch_size + len(self._offered_seeds))
+            if video['aid'] not in self._offered_seeds
+        ][:batch_size]
+        if seeds:
+            self._offered_seeds.update(video['aid'] for video in seeds)
+            return seeds, False
+        if category == 'kichiku' and self.scheduler.counts.get('kichiku', 0) > total_videos * 0.4:
+            # 如果鬼畜区已经超过40%，采集热门视频
+            return await self.get_hot_videos('popular', batch_size), True
+        if category == 'other':
+            # 如果下一个分区是other，尝试获取其他分区的视频
+            return await self.get_other_videos(batch_size), True
+        # 采集指定分区的视频
+        return await self.get_category_videos(category, batch_size), False
+
+    async def crawl_strategically(self, total_videos=100, resume=True):
+        """
+        智能策略采集视频，保持各分区比例
+        每批计划的视频和处理状态记录在会话日志中；上次采集中断时（resume=True）
+        沿用其目标视频数，先处理未完成的视频，已获取详情的视频不再查询
+        """
+        try:
+            writer = await self.begin_run()
+
+            # 各分区视频数只在开始时读取一次，之后由调度器在内存中更新
+            self.scheduler = CategoryScheduler(self.target_ratios, self.db.get_video_count_by_category())
+            # 本次采集已处理的视频；其余视频是否已入库按批查询
+            existing_aids = set()
+            self.existing_aids = existing_aids
+
+            session = self.journal.get_unfinished_session() if resume else None
+            if session:
+                session_id, total_videos, collected_count = session
+                print(f"Resuming crawl session {session_id}: {collected_count}/{total_videos} videos collected")
+            else:
+                session_id = self.journal.start_session(total_videos)
+                collected_count = 0
+            planned_aids = self.journal.get_planned_aids(session_id)
             
-            collected_count = 0
             batch_size = 10
             consecutive_failures = 0  # 连续失败计数器
+            # 写入失败后不再能确认任何视频已落盘，停止本次采集，会话留待下次继续
+            write_failed = False
+            # 最多同时处理 max_concurrent_videos 个视频
+            semaphore = asyncio.Semaphore(self.max_concurrent_videos)
+
+            async def crawl_batch(category, videos, requests_before):
+                """
+                处理一批视频 [(aid, is_hot, 已获取的video_info或None), ...]，并按分区记录本批收益；
+                整批写入提交后才在会话日志中标记完成，写入队列可以把多个视频合并到一个事务中
+                """
+                nonlocal collected_count, write_failed
+                finished = []  # [(aid, 检测到的分区, 新评论), ...]
+
+                async def crawl_one(aid, is_hot, video_info):
+                    async with semaphore:
+                        try:
+                            result = await self.process_video(aid, is_hot, writer, video_info, session_id)
+                        except Exception as e:
+                            # 评论爬取出错的视频不标记完成，恢复会话时从保存的进度继续
+                            print(f"Video {aid} is left unfinished: {e}")
+                            return
+                        if result is None:
+                            return
+                        finished.append((aid, *result))
+                        
+                        # 没有全局限速器时随机延迟
+                        if self.rate_limiter is None:
+                            await self.telemetry.sleep(random.uniform(1.0, 3.0))
+
+                await asyncio.gather(*(crawl_one(*video) for video in videos))
+                # 评论提交后才在会话日志中标记完成；写入失败时本批视频都留待下次继续
+                try:
+                    await writer.flush()
+                except DataWriteError as e:
+                    print(f"{len(finished)} videos of this batch are left unfinished: {e}")
+                    write_failed = True
+                    finished = []
+                batch_comments = []
+                for aid, detected_category, comments in finished:
+                    batch_comments.extend(comment['comment'] for comment in comments)
+                    # 更新计数
+                    self.scheduler.record_video(detected_category)
+                    self.journal.mark_done(session_id, aid)
+                    collected_count += 1
+                    existing_aids.add(aid)
+                print(f"Collected {collected_count}/{total_videos} videos")
+                self.scheduler.record_batch(category, self.request_count - requests_before, batch_comments)
+
+            # 先完成上次中断时已计划的视频，按计划分区分批
+            unfinished: Dict[str, List] = {}
+            for aid, category, is_hot, video_info in self.journal.get_unfinished_videos(session_id):
+                unfinished.setdefault(category, []).append((aid, is_hot, video_info))
+            for category, videos in unfinished.items():
+                if write_failed:
+                    break
+                print(f"Resuming {len(videos)} planned videos of category {category}")
+                await crawl_batch(category, videos, self.request_count)
             
-            while collected_count < total_videos and consecutive_failures < 10:  # 添加失败限制
+            while collected_count < total_videos and consecutive_failures < 10 and not write_failed:  # 添加失败限制
                 # 确定下一个要采集的分区
-                next_category = self.calculate_next_category(current_counts)
+                next_category = self.scheduler.next_category()
                 print(f"Next category to crawl: {next_category}")
+                requests_before = self.request_count
                 
                 # 采集该分区的视频
-                if next_category == 'kichiku' and current_counts.get('kichiku', 0) > total_videos * 0.4:
-                    # 如果鬼畜区已经超过40%，采集热门视频
-                    videos = await self.get_hot_videos('popular', batch_size)
-                    is_hot = True
-                elif next_category == 'other':
-                    # 如果下一个分区是other，尝试获取其他分区的视频
-                    videos = await self.get_other_videos(batch_size)
-                    is_hot = True
-                else:
-                    # 采集指定分区的视频
-                    videos = await self.get_category_videos(next_category, batch_size)
-                    is_hot = False
+                videos, is_hot = await self.list_category_videos(next_category, batch_size, total_videos)
                 
                 # 如果没有获取到视频，增加失败计数并跳过
                 if not videos:
+                    self.scheduler.record_batch(next_category, self.request_count - requests_before, [])
                     consecutive_failures += 1
                     print(f"No videos found for category {next_category}. Consecutive failures: {consecutive_failures}")
                     # 随机延迟后继续
-                    await asyncio.sleep(random.uniform(2.0, 5.0))
+                    await self.telemetry.sleep(random.uniform(2.0, 5.0))
                     continue
                 
                 # 重置连续失败计数
                 consecutive_failures = 0
                 
-                # 处理视频
+                # 选出本批要处理的新视频；已入库但评论未爬完的视频仍可选择
+                stored_aids = self.db.filter_finished_aids(
+                    (video['aid'] for video in videos), self.max_comments_per_video
+                )
+                candidate_aids = []
                 for video in videos:
-                    if collected_count >= total_videos:
+                    if len(candidate_aids) >= total_videos - collected_count:
                         break
-                    
                     aid = video['aid']
-                    if aid in existing_aids:
-                        continue
-                    
-                    # 获取视频详细信息
-                    video_detail = await self.get_video_detail(aid)
-                    if not video_detail:
+                    if aid in existing_aids or aid in stored_aids or aid in planned_aids or aid in candidate_aids:
                         continue
-                    
-                    # 检测分区和热门状态
-                    detected_category = self.detect_category(video_detail)
-                    detected_hot = self.is_hot_video(video_detail) or is_hot
-                    
-                    # 保存视频信息
-                    video_info = {
-                        'aid': aid,
-                        'title': video_detail.get('title', ''),
-                        'category': detected_category,
-                        'is_hot': detected_hot,
-                        'view_count': video_detail.get('stat', {}).get('view', 0),
-                        'like_count': video_detail.get('stat', {}).get('like', 0),
-                        'comment_count': video_detail.get('stat', {}).get('reply', 0),
-                    }
-                    self.db.save_video_info(video_info)
-                    
-                    # 设置额外的视频信息，用于在保存评论时添加分类和热门标记
-                    self.crawler.extra_video_info = {
-                        'category': detected_category,
-                        'is_hot': detected_hot
-                    }
-                    
-                    try:
-                        # 爬取评论
-                        comments = await self.crawler.get_video_comments(aid)
-                        
-                        # 保存评论到数据库
-                        if comments:
-                            self.db.save_comments_batch(comments)
-                    except Exception as e:
-                        print(f"Error fetching comments for video {aid}: {e}")
-                        # 检查是否是浏览器关闭的错误
-                        if "Target page, context or browser has been closed" in str(e):
-                            print("Browser closed unexpectedly. Reinitializing...")
-                            # 重新初始化crawler
-                            await self.crawler.close()
-                            self.crawler = BilibiliCommentCrawler([], self.max_comments_per_video)
-                            await self.crawler.setup_browser()
-                            await self.crawler.login_if_needed()
-                            await self.crawler.create_client()
-                    
-                    # 更新计数
-                    current_counts[detected_category] = current_counts.get(detected_category, 0) + 1
-                    collected_count += 1
-                    existing_aids.add(aid)
-                    
-                    print(f"Collected {collected_count}/{total_videos} videos")
-                    
-                    # 随机延迟
-                    await asyncio.sleep(random.uniform(1.0, 3.0))
-                
-                # 更新当前计数
-                current_counts = self.db.get_video_count_by_category()
+                    candidate_aids.append(aid)
+
+                # 先写入会话日志再处理，中断后可从这里继续
+                self.journal.plan_videos(session_id, next_category, [(aid, is_hot) for aid in candidate_aids])
+                planned_aids.update(candidate_aids)
+
+                # 在后台并发获取本批全部视频的详情：本批前几个视频爬取评论时，
+                # 排在后面、等待并发名额的视频的详情已经就绪（不会提前获取下一批）
+                self.prefetch_video_details(candidate_aids)
+                await crawl_batch(next_category, [(aid, is_hot, None) for aid in candidate_aids], requests_before)
+
+            if write_failed:
+                print(f"Crawl session {session_id} stopped after a database write failure, "
+                      f"{collected_count}/{total_videos} videos collected; it will be resumed next time")
+            else:
+                self.journal.finish_session(session_id)
+            print("Crawl budget by category:")
+            print(self.scheduler.summary())
         
         finally:
-            await self.close_session()
-            if self.crawler:
-                await self.crawler.close()
\ No newline at end of file
+            await self.end_run()
+            self.report_telemetry()
+
+    def report_telemetry(self):
+        """打印运行指标汇总，设置了 telemetry_file 时同时保存JSON快照"""
+        print(self.telemetry.summary())
+        if self.telemetry_file:
+            try:
+                ensure_dir_exists(self.telemetry_file)
+                self.telemetry.save(self.telemetry_file)
+            except OSError as e:
+                print(f"Failed to save crawl telemetry: {e}")
+
+    async def work_queue(self, queue: CrawlJobQueue, worker_id: str, poll_interval: float = 2.0) -> int:
+        """
+        作为分布式采集的 worker 运行：从任务队列认领视频、获取详情并爬取评论，
+        本次运行的队列关闭且没有剩余任务时退出（先于协调进程启动时等待其打开队列）。
+        各进程使用自己的限速器，分区比例由入队的协调进程控制
+        :return: 本 worker 完成的视频数
+        """
+        completed = 0
+        write_failed = False
+        # 上次运行关闭的队列不能让 worker 直接退出
+        run = queue.current_run()
+
+        async def keep_leases():
+            while True:
+                await asyncio.sleep(queue.lease_seconds / 3)
+                # 单次续约失败（如多进程写入时数据库被锁）不能结束心跳任务，否则租约到期后任务会被重复认领
+                try:
+                    queue.heartbeat(worker_id)
+                except sqlite3.Error as e:
+                    print(f"Worker {worker_id}: failed to renew leases, retry next time: {e}")
+
+        async def run_job(aid, is_hot, writer) -> Optional[int]:
+            """爬取一个任务，成功时返回新评论数（尚未确认提交），失败时交还任务并返回None"""
+            try:
+                result = await self.process_video(aid, is_hot, writer)
+            except Exception as e:
+                # 评论爬取出错：交还任务，由租约和重试逻辑再次尝试
+                queue.fail(aid, worker_id, f"{type(e).__name__}: {e}")
+                return None
+            if result is None:
+                queue.fail(aid, worker_id, "video detail unavailable")
+                return None
+            return len(result[1])
+
+        heartbeat_task = None
+        try:
+            writer = await self.begin_run()
+            heartbeat_task = asyncio.create_task(keep_leases())
+            while not write_failed:
+                jobs = queue.claim(worker_id, self.max_concurrent_videos)
+                if not jobs:
+                    if queue.is_drained(run):
+                        break
+                    await asyncio.sleep(poll_interval)
+                    continue
+                self.prefetch_video_details([aid for aid, _, _ in jobs])
+                results = await asyncio.gather(*(run_job(aid, is_hot, writer) for aid, _, is_hot in jobs))
+                succeeded = [(aid, comments) for (aid, _, _), comments in zip(jobs, results) if comments is not None]
+                # 本批评论全部提交后才标记任务完成，整批只等待一次写入
+                try:
+                    await writer.flush()
+                except DataWriteError as e:
+                    for aid, _ in succeeded:
+                        queue.fail(aid, worker_id, f"DataWriteError: {e}")
+                    write_failed = True
+                    break
+                for aid, comments in succeeded:
+                    queue.complete(aid, worker_id, comments)
+                completed += len(succeeded)
+                print(f"Worker {worker_id}: {completed} videos completed")
+            if write_failed:
+                # 写入失败后无法确认任何任务已落盘，停止认领，剩余任务交给其他 worker
+                print(f"Worker {worker_id}: stopped after a database write failure")
+        finally:
+            if heartbeat_task:
+                heartbeat_task.cancel()
+                # 等心跳任务结束再关闭，正在进行的续约写入不会在事件循环关闭后被丢弃
+                with contextlib.suppress(asyncio.CancelledError):
+                    await heartbeat_task
+            await self.end_run()
+            self.report_telemetry()
+        return completed
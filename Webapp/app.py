@@ -4,14 +4,17 @@ from Webapp.models.db import get_db
 from Webapp.models.words import get_words_for_user, get_word_by_id, insert_words_batch, create_words_table, update_word_status, get_accepted_words, batch_update_words_status
 from Webapp.models.labels import submit_label_safe, get_user_labeled_words, get_word_vote_stats, create_labels_table, get_label_stats, get_today_words_labeled_count
 from Webapp.models.user import create_user_table, add_user, get_user_by_username, get_user_by_id, update_user_password, is_user_admin
-from Webapp.config import BATCH_SIZE, MAX_VOTES_PER_WORD, RAW_DATA_PATH
+from Webapp.config import BATCH_SIZE, MAX_VOTES_PER_WORD, RAW_DATA_PATH, DISCOVERY_PIPELINE, DISCOVERER_STATE_PATH, ARCHIVE_AFTER_DAYS, RESPONSE_ARCHIVE_PATH, CRAWL_TELEMETRY_PATH
 from apscheduler.schedulers.background import BackgroundScheduler
 import asyncio
-from Data_Collection.SmartBiliCrawler import MultiCategoryHotCrawler, CommentDatabase
+from Data_Collection.SmartBiliCrawler import MultiCategoryHotCrawler, CommentDatabase, close_raw_connections
+from Data_Collection.CommentArchive import CommentArchive
+from Data_Collection.DanmakuCollector import DanmakuCollector
+from Data_Collection.ResponseArchive import ResponseArchive
 from Webapp.xgbFindWords import FindWords4XG
-from Database.CommentDatabase import load_comments_batch_return_comment_oid
 from xgbModel.xgbModel import xgbModel
 import secrets
+import os
 from werkzeug.security import generate_password_hash, check_password_hash
 import json
 
@@ -394,6 +397,55 @@ def get_word_detail(word_id):
         print(f"Error in get_word_detail: {e}")
         return jsonify({"error": "服务器内部错误"}), 500
 
+# 原始评论库只在首次查询时建表，之后各请求共用；连接由 get_raw_connection 按线程管理
+_raw_comment_db = None
+_raw_comment_archive = None
+
+def get_raw_comment_db() -> CommentDatabase:
+    global _raw_comment_db
+    if _raw_comment_db is None:
+        _raw_comment_db = CommentDatabase(RAW_DATA_PATH)
+    return _raw_comment_db
+
+def get_raw_comment_archive() -> CommentArchive:
+    global _raw_comment_archive
+    if _raw_comment_archive is None:
+        _raw_comment_archive = CommentArchive(get_raw_comment_db())
+    return _raw_comment_archive
+
+# 从原始评论全文索引中获取词语的更多用例
+@app.route("/admin/word/<int:word_id>/contexts")
+@admin_required
+def get_word_contexts(word_id):
+    page = request.args.get('page', 1, type=int)
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+    category = request.args.get('category') or None
+
+    conn = get_db()
+    row = conn.execute("SELECT word FROM words WHERE id = ?", (word_id,)).fetchone()
+    conn.close()
+    if not row:
+        return jsonify({"error": "词语不存在"}), 404
+
+    word = row[0]
+    raw_db = get_raw_comment_db()
+    # 统计包括冷存储，用例只从热数据（最近 ARCHIVE_AFTER_DAYS 天采集的评论）中分页读取
+    stats = get_raw_comment_archive().get_word_usage_stats(word)
+    contexts = raw_db.search_word_contexts(word, page=page, per_page=per_page, category=category)
+
+    return jsonify({
+        "word": word,
+        "page": page,
+        "per_page": per_page,
+        "total": stats["total"],
+        "by_category": stats["by_category"],
+        "first_seen": stats["first_seen"],
+        "contexts_scope": "hot",
+        "contexts_window_days": ARCHIVE_AFTER_DAYS,
+        "contexts_total": stats["hot_total"],
+        "contexts": contexts
+    })
+
 # Browse Dictionary page
 @app.route("/dictionary")
 def browse_dictionary():
@@ -509,11 +561,21 @@ def daily_job():
         async def crawl_comments(): 
             db = CommentDatabase()
             db.show_information()
-            crawler = MultiCategoryHotCrawler(db, max_comments_per_video=50)
+            # 同时爬取4个视频，请求速率从1次/秒起根据API响应自动调整；回复数不少于20的评论抓取楼中楼
+            crawler = MultiCategoryHotCrawler(db, max_comments_per_video=50,
+                                              max_concurrent_videos=4, requests_per_second=1.0,
+                                              adaptive_rate=True, max_requests_per_second=3.0,
+                                              sub_reply_threshold=20,
+                                              response_archive=ResponseArchive(RESPONSE_ARCHIVE_PATH) if RESPONSE_ARCHIVE_PATH else None,
+                                              telemetry_file=CRAWL_TELEMETRY_PATH)
             
             try:
                 await crawler.crawl_strategically(total_videos=1)
                 print("Smart crawling completed")
+                # 回访评论仍在快速增长的热门视频，只取上次之后的新评论
+                await crawler.recrawl_hot_videos(max_videos=50, min_interval_hours=6)
+                # 为新采集的视频批量下载弹幕
+                await DanmakuCollector(db).collect(max_videos=50)
             except Exception as e:
                 print(f"Error: {e}")
             finally:
@@ -521,13 +583,47 @@ def daily_job():
         
         # Step 2: Process comments to find candidate words
         async def find_new_words():
-            db_path = RAW_DATA_PATH
-            comments_batch = load_comments_batch_return_comment_oid(size=5000, db_path=db_path)
+            db = CommentDatabase(RAW_DATA_PATH)
+            archive = CommentArchive(db)
         
-            discoverer=FindWords4XG()
+            # 载入上次保存的统计状态，只处理水位线之后的新评论
+            if os.path.exists(DISCOVERER_STATE_PATH):
+                discoverer = FindWords4XG.load_state(DISCOVERER_STATE_PATH)
+            else:
+                discoverer = FindWords4XG()
             model=xgbModel()
-            for comment_oid in comments_batch:
-                discoverer.add_comments(comment_oid)
+            watermark = discoverer.watermark
+            # 水位线是评论的写入序号：后采集的评论rpid可能更小，写入序号总是更大
+            if 'last_seq' in watermark:
+                last_seq = watermark['last_seq']
+            else:
+                # 旧状态只有rpid水位线，换算为写入序号
+                last_seq = db.legacy_ingest_seq("raw_comments", "rpid", watermark.get('last_rpid', 0))
+            if 'last_danmaku_seq' in watermark:
+                last_danmaku_seq = watermark['last_danmaku_seq']
+            else:
+                last_danmaku_seq = db.legacy_ingest_seq("raw_danmaku", "dmid", watermark.get('last_dmid', 0))
+            last_ctime = watermark.get('last_ctime', 0)
+            print(f"Pipeline {DISCOVERY_PIPELINE}: processing comments after seq {last_seq}, danmaku after seq {last_danmaku_seq}")
+
+            # 按写入序号分批流式读取新入库的评论（冷存储+热数据），内存占用与批大小相关
+            for rows in archive.stream_new_comment_rows(batch_size=5000, after_seq=last_seq):
+                discoverer.add_comments([(comment, aid) for _, _, aid, comment, _ in rows])
+                last_seq = max(last_seq, max(row[0] for row in rows))
+                last_ctime = max(last_ctime, max(row[4] for row in rows))
+
+            # 弹幕与评论同样格式，同样按写入序号读取（dmid 不随入库顺序递增）
+            for rows in db.stream_new_danmaku_rows(batch_size=5000, after_seq=last_danmaku_seq):
+                discoverer.add_comments([(comment, aid) for _, _, aid, comment, _ in rows])
+                last_danmaku_seq = max(last_danmaku_seq, rows[-1][0])
+
+            # get_results 会剪枝统计量，因此在此之前保存状态并推进水位线
+            discoverer.save_state(DISCOVERER_STATE_PATH, watermark={
+                'pipeline': DISCOVERY_PIPELINE,
+                'last_seq': last_seq,
+                'last_ctime': last_ctime,
+                'last_danmaku_seq': last_danmaku_seq,
+            })
             results = discoverer.get_results()
             # 使用模型筛选结果
             model.predict(results, 0.27)
@@ -538,11 +634,22 @@ def daily_job():
             insert_words_batch(words_list)
             print("Inserted candidate words into the database")
 
+            # 新评论已处理，把旧评论移入冷存储，保持热数据库较小
+            moved = archive.archive_older_than(ARCHIVE_AFTER_DAYS)
+            print(f"Archived {moved} comments older than {ARCHIVE_AFTER_DAYS} days")
+
+            # 旧数据库首次创建检索索引后的一次性补建放在后台任务中，不阻塞管理页面的查询
+            db.build_search_indexes()
+
         # 执行任务
         await crawl_comments()
         await find_new_words() 
 
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    finally:
+        # 释放调度线程持有的原始数据库长连接
+        close_raw_connections()
 
 # 设置定时任务
 scheduler = BackgroundScheduler()
@@ -1,5 +1,19 @@
+import os
 from Data_Collection.BiliCrawler import DB_FILE
 
 BATCH_SIZE=20
 MAX_VOTES_PER_WORD=3
 RAW_DATA_PATH = DB_FILE
+
+# 增量新词发现：状态文件与水位线按流水线名称保存在原始评论数据库旁
+DISCOVERY_PIPELINE = "daily"
+DISCOVERER_STATE_PATH = os.path.join(os.path.dirname(DB_FILE), f"discoverer_state_{DISCOVERY_PIPELINE}.pkl")
+
+# 超过该天数的原始评论在每日任务后移入按月冷存储
+ARCHIVE_AFTER_DAYS = 90
+
+# 原始API响应存档目录，便于离线重新解析；设为 None 关闭存档
+RESPONSE_ARCHIVE_PATH = os.path.join(os.path.dirname(DB_FILE), "responses")
+
+# 每日采集结束后写入的运行指标快照（各接口延迟、错误码、等待与写入耗时、重复率）
+CRAWL_TELEMETRY_PATH = os.path.join(os.path.dirname(DB_FILE), "crawl_telemetry.json")
@@ -1,6 +1,7 @@
 from collections import defaultdict, Counter
 import math
 import logging
+import os
 import pickle
 from typing import List, Optional, Iterator
 from Data_Processing.Clean_Comments import CommentCleaner
@@ -42,6 +43,9 @@ class FindWords4XG:
     # save and load state
     discoverer.save_state("discoverer_state.pkl")
     discoverer2 = FindWords4XG.load_state("discoverer_state.pkl")
+
+    # save state together with the processing watermark
+    discoverer.save_state("discoverer_state.pkl", watermark={'pipeline': 'daily', 'last_seq': 123, 'last_ctime': 0})
     """
     
     def __init__(self, config: Optional[dict] = None):
@@ -66,6 +70,8 @@ class FindWords4XG:
 
         self.found_words = get_all_words() # load found words to filter out
 
+        self.watermark = {}  # last processed comment, saved together with the state
+
         logger.info("NewWordDiscoverer initialized with config: %s", self.config)
 
     def _init_accumulators(self):
@@ -257,7 +263,17 @@ class FindWords4XG:
                 
         return entropy
     
-    def save_state(self, file_path: str):
+    def save_state(self, file_path: str, watermark: Optional[dict] = None):
+        """
+        save accumulators to file_path.
+
+        :param watermark: optional, e.g. {'pipeline': 'daily', 'last_seq': ..., 'last_ctime': ...}.
+            It is written in the same file as the accumulators, so the state and the
+            watermark are always advanced together.
+        """
+        if watermark is not None:
+            self.watermark = dict(watermark)
+
         state = {
             'config': self.config,
             'char_count': dict(self.char_count),
@@ -276,12 +292,17 @@ class FindWords4XG:
             'aid_set': list(self.aid_set),
             'document_frequency': dict(self.document_frequency),
             'term_frequency': {word: dict(aid_dict) for word, aid_dict in self.term_frequency.items()},
-            'aid_by_word': {word: list(aid_list) for word, aid_list in self.aid_by_word.items()}
+            'aid_by_word': {word: list(aid_list) for word, aid_list in self.aid_by_word.items()},
+            'sample_comments': dict(self.sample_comments),
+            'watermark': self.watermark
         }
         
-        with open(file_path, 'wb') as f:
+        # write to a temp file first, then replace, so a crash never leaves a half-written state
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
             pickle.dump(state, f)
-        logger.info("Saved state to %s", file_path)
+        os.replace(tmp_path, file_path)
+        logger.info("Saved state to %s (watermark: %s)", file_path, self.watermark)
     
     @classmethod
     def load_state(cls, file_path: str) :
@@ -317,6 +338,8 @@ class FindWords4XG:
         discoverer.aid_by_word = defaultdict(set)
         for word, aid_list in state.get('aid_by_word', {}).items():
             discoverer.aid_by_word[word] = set(aid_list)
+        discoverer.sample_comments = defaultdict(list, state.get('sample_comments', {}))
+        discoverer.watermark = state.get('watermark', {})
         
         logger.info("Loaded state from %s with %d comments processed", 
                    file_path, discoverer.total_comments)